@@ -0,0 +1,216 @@
+"""Simulation hors ligne du mode adaptatif (``psy.cat``) face au test complet.
+
+Les définitions livrées n'ont pas de banque calibrée : on génère deux
+banques synthétiques au format de ``psy/definitions``, avec leurs
+paramètres IRT :
+
+- type MBTI : ``--mbti-items`` questions à deux options sur 4 dimensions ;
+- type BFI : ``--bfi-items`` questions à 5 options sur 5 traits.
+
+Des répondants simulés (``θ`` tiré d'une loi normale centrée réduite sur
+chaque sous-échelle) répondent selon le modèle. Chacun passe le test
+complet puis le test adaptatif avec les mêmes réponses à chaque question.
+Sont comparés à la vérité (le résultat qu'aurait le répondant sans erreur
+de mesure, c'est-à-dire son score attendu sur la banque complète) :
+
+- MBTI : le pôle de chaque dimension et le type complet ;
+- BFI : la tranche de chaque trait (tiers bas, moyen, haut du score
+  maximal) et l'écart absolu moyen du score.
+
+Pour chaque réglage d'arrêt (``--confidence`` pour le MBTI,
+``--standard-error`` pour le BFI), le rapport donne le nombre moyen de
+questions et d'appels à l'API Telegram par test terminé (un message pour
+la commande, puis ``answerCallbackQuery`` et ``editMessageText`` à chaque
+réponse), et la précision. On retient le réglage le moins coûteux dont la
+précision égale celle du test complet.
+
+On mesure aussi le temps de choix de la question suivante, état en cache
+(cas d'un clic) et recalculé.
+
+Usage :
+    python -m benchmarks.adaptive_testing --respondents 2000
+"""
+
+import argparse
+import dataclasses
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from psy import cat, plans, scoring
+
+from benchmarks.scoring_plans import LIKERT
+
+MBTI_DIMENSIONS = [('EI', 'E', 'I'), ('SN', 'S', 'N'), ('TF', 'T', 'F'), ('JP', 'J', 'P')]
+BFI_TRAITS = ['extraversion', 'agreeableness', 'conscientiousness', 'neuroticism', 'openness']
+
+
+def mbti_bank(rng: random.Random, item_count: int) -> dict:
+    return {
+        'id': 'mbti_cat', 'label': 'MBTI adaptatif',
+        'subscales': [{'id': name, 'poles': [first, second]} for name, first, second in MBTI_DIMENSIONS],
+        'adaptive': {},
+        'items': [
+            {'text': f'Question {index + 1}', 'options': ['A', 'B'],
+             'subscale': MBTI_DIMENSIONS[index % len(MBTI_DIMENSIONS)][0], 'reverse': rng.random() < 0.5,
+             'irt': {'a': round(rng.uniform(0.6, 2.2), 3), 'b': [round(rng.gauss(0, 1), 3)]}}
+            for index in range(item_count)
+        ],
+    }
+
+
+def bfi_bank(rng: random.Random, item_count: int) -> dict:
+    def thresholds():
+        center = rng.gauss(0, 0.6)
+        return sorted(round(center + offset * rng.uniform(0.8, 1.2), 3) for offset in (-1.6, -0.5, 0.5, 1.6))
+
+    return {
+        'id': 'bfi_cat', 'label': 'BFI adaptatif',
+        'option_sets': {'accord': LIKERT},
+        'subscales': [{'id': trait, 'label': trait} for trait in BFI_TRAITS],
+        'adaptive': {},
+        'items': [
+            {'text': f'Question {index + 1}', 'options': 'accord', 'subscale': BFI_TRAITS[index % len(BFI_TRAITS)],
+             'reverse': rng.random() < 1 / 3, 'irt': {'a': round(rng.uniform(0.9, 2.4), 3), 'b': thresholds()}}
+            for index in range(item_count)
+        ],
+    }
+
+
+def simulate_responses(generator, adaptive: cat.AdaptivePlan, thetas: np.ndarray) -> np.ndarray:
+    """Réponses ``(répondants, questions)`` tirées selon le modèle de la banque."""
+    item_count = len(adaptive.option_counts)
+    responses = np.zeros((len(thetas), item_count), dtype=np.int16)
+    for item in range(item_count):
+        theta = thetas[:, adaptive.subscale_of[item]]
+        # Probabilités des options par interpolation sur la grille du plan
+        probabilities = np.exp(np.stack([
+            np.interp(theta, adaptive.grid, adaptive.log_likelihood[item, option])
+            for option in range(adaptive.option_counts[item])
+        ], axis=1))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        draws = generator.random(len(thetas))[:, None]
+        responses[:, item] = (probabilities.cumsum(axis=1) < draws).sum(axis=1)
+    return responses
+
+
+def true_scores(adaptive: cat.AdaptivePlan, thetas: np.ndarray) -> np.ndarray:
+    return np.stack([
+        np.interp(thetas[:, subscale], adaptive.grid, expected) for subscale, expected in enumerate(adaptive.expected)
+    ], axis=1)
+
+
+def run_adaptive(adaptive: cat.AdaptivePlan, responses: np.ndarray):
+    """Scores ``(répondants, sous-échelles)`` et nombre de questions de chaque session adaptative."""
+    scores = np.zeros((len(responses), len(adaptive.subscale_items)))
+    lengths = np.zeros(len(responses), dtype=np.int32)
+    for row, answers_by_item in enumerate(responses.tolist()):
+        answers = bytearray()
+        item = adaptive.next_item(answers)
+        while item is not None:
+            answers.append(answers_by_item[item])
+            item = adaptive.next_item(answers)
+        scores[row] = adaptive.expected_scores(answers)
+        lengths[row] = len(answers)
+    return np.rint(scores), lengths
+
+
+def api_calls(items: float) -> float:
+    return 1 + 2 * items
+
+
+def mbti_accuracy(definition):
+    maximums = definition.plan.maximums
+
+    def accuracy(scores, truth):
+        return (scoring.poles(scores, maximums) == scoring.poles(truth, maximums)).all(axis=1).mean()
+    return accuracy
+
+
+def bfi_accuracy(definition):
+    # Tranches : tiers bas, moyen et haut du score maximal
+    cut_points = np.stack([definition.plan.maximums / 3, definition.plan.maximums * 2 / 3])
+
+    def accuracy(scores, truth):
+        return ((scores[:, None, :] >= cut_points).sum(axis=1) == (truth[:, None, :] >= cut_points).sum(axis=1)).mean()
+    return accuracy
+
+
+def with_settings(definition, **settings):
+    return dataclasses.replace(definition, adaptive=dict(definition.adaptive or {}, **settings))
+
+
+def compare(label: str, definition, generator, args, setting: str, values: list, accuracy) -> None:
+    reference = cat.AdaptivePlan(definition, None)
+    thetas = generator.standard_normal((args.respondents, len(reference.subscale_items)))
+    responses = simulate_responses(generator, reference, thetas)
+    truth = np.rint(true_scores(reference, thetas))
+    fixed = definition.plan.score(responses)
+    items = len(definition.questions)
+
+    print(f"\n{label} : banque de {items} questions, {args.respondents} répondants")
+    print(f"{'arrêt':<24}{'questions':>11}{'appels API':>12}{'précision':>11}{'écart moyen':>13}")
+    print(f"{'test complet':<24}{items:>11.1f}{api_calls(items):>12.1f}{accuracy(fixed, truth) * 100:>10.1f}%"
+          f"{np.abs(fixed - truth).mean():>13.2f}")
+    for value in values:
+        adaptive = cat.AdaptivePlan(with_settings(definition, **{setting: value}), None)
+        scores, lengths = run_adaptive(adaptive, responses)
+        print(f"{f'{setting} = {value:g}':<24}{lengths.mean():>11.1f}{api_calls(lengths.mean()):>12.1f}"
+              f"{accuracy(scores, truth) * 100:>10.1f}%{np.abs(scores - truth).mean():>13.2f}")
+
+
+def measure_selection(definition, generator, sessions: int) -> None:
+    """Temps de ``next_item`` : état en cache (un clic) puis recalculé (cache vidé)."""
+    adaptive = cat.AdaptivePlan(definition, None)
+    thetas = generator.standard_normal((sessions, len(adaptive.subscale_items)))
+    responses = simulate_responses(generator, adaptive, thetas)
+    _, lengths = run_adaptive(adaptive, responses)
+    # Rejouer les mêmes sessions : tous les préfixes sont en cache
+    started = time.perf_counter()
+    run_adaptive(adaptive, responses)
+    cached = (time.perf_counter() - started) / (lengths.sum() + sessions) * 1e6
+    adaptive = cat.AdaptivePlan(definition, None)
+    started = time.perf_counter()
+    run_adaptive(adaptive, responses)
+    computed = (time.perf_counter() - started) / (lengths.sum() + sessions) * 1e6
+    print(f"\nchoix de la question suivante ({definition.id}) : {cached:.1f} µs état en cache, "
+          f"{computed:.1f} µs état recalculé (mise à jour de la grille et tri par information inclus)")
+
+
+def run(args) -> None:
+    rng = random.Random(args.seed)
+    generator = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = Path(temporary)
+        for bank in (mbti_bank(rng, args.mbti_items), bfi_bank(rng, args.bfi_items)):
+            (directory / f"{bank['id']}.json").write_text(json.dumps(bank, ensure_ascii=False))
+        mbti = plans.load('mbti_cat', directory, directory / 'cache')
+        bfi = plans.load('bfi_cat', directory, directory / 'cache')
+
+    compare("MBTI (type complet exact)", mbti, generator, args, 'confidence', args.confidence,
+            mbti_accuracy(mbti))
+    compare("BFI (tranche de chaque trait)", bfi, generator, args, 'standard_error', args.standard_error,
+            bfi_accuracy(bfi))
+    measure_selection(bfi, generator, min(args.respondents, 500))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--respondents', type=int, default=2000)
+    parser.add_argument('--mbti-items', type=int, default=70)
+    parser.add_argument('--bfi-items', type=int, default=100)
+    parser.add_argument('--confidence', type=lambda text: [float(value) for value in text.split(',')],
+                        default=[0.9, 0.95, 0.975, 0.99], help="réglages MBTI, séparés par des virgules")
+    parser.add_argument('--standard-error', type=lambda text: [float(value) for value in text.split(',')],
+                        default=[0.5, 0.4, 0.3, 0.25], help="réglages BFI, séparés par des virgules")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
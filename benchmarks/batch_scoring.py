@@ -0,0 +1,143 @@
+"""Débit du calcul des scores : fonctions ligne par ligne contre calcul vectorisé.
+
+Pour chaque questionnaire, on génère ``--rows`` lignes de réponses
+aléatoires et on compare :
+
+- le calcul historique, une ligne Python à la fois (``sum`` puis tranche,
+  tel qu'il était écrit dans ``calculate_result`` avant ``psy.scoring``) ;
+- ``calculate_result`` ligne par ligne, message compris (chemin du bot) ;
+- ``score`` sur la matrice entière.
+
+Les résultats vectorisés sont vérifiés contre le calcul historique. Avec
+``--csv``, on mesure aussi ``python -m psy.batch`` de bout en bout sur un
+fichier temporaire.
+
+Usage :
+    python -m benchmarks.batch_scoring --rows 1000000 --csv
+"""
+
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from psy import registry
+
+
+def legacy_depression(responses):
+    score = sum(responses)
+    if score < 5:
+        return score, 0
+    elif 5 <= score <= 9:
+        return score, 1
+    elif 10 <= score <= 14:
+        return score, 2
+    elif 15 <= score <= 19:
+        return score, 3
+    return score, 4
+
+
+def legacy_anxiety(responses):
+    score = sum(responses)
+    if score < 5:
+        return score, 0
+    elif 5 <= score <= 9:
+        return score, 1
+    elif 10 <= score <= 14:
+        return score, 2
+    return score, 3
+
+
+def legacy_mbti(responses):
+    letters = []
+    letters.append('E' if sum(responses[0::4]) < len(responses[0::4])/2 else 'I')
+    letters.append('S' if sum(responses[1::4]) < len(responses[1::4])/2 else 'N')
+    letters.append('T' if sum(responses[2::4]) < len(responses[2::4])/2 else 'F')
+    letters.append('J' if sum(responses[3::4]) < len(responses[3::4])/2 else 'P')
+    return ''.join(letters)
+
+
+LEGACY = {'depression': legacy_depression, 'anxiety': legacy_anxiety, 'mbti': legacy_mbti}
+
+
+def check(questionnaire, matrix, legacy_results) -> None:
+    """Vérifie que le calcul vectorisé reproduit le calcul historique."""
+    columns = questionnaire.score(matrix)
+    if questionnaire.id == 'mbti':
+        # Les questions S/N et T/F sont inversées dans psy/definitions/mbti.json :
+        # l'ancien découpage responses[i::4] attribuait leurs options à l'envers
+        swap = str.maketrans('SNTF', 'NSFT')
+        vectorized = [questionnaire.result_levels['type'][code].translate(swap) for code in columns['type'].tolist()]
+    else:
+        vectorized = list(zip(columns['score'].tolist(), columns['severity'].tolist()))
+    if vectorized != legacy_results:
+        raise SystemExit(f"{questionnaire.id} : le calcul vectorisé diffère du calcul historique")
+
+
+def throughput(rows: int, seconds: float) -> str:
+    return f"{rows / seconds:>14,.0f}".replace(',', ' ')
+
+
+def bench_csv(questionnaire, matrix) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'reponses.csv')
+        target = os.path.join(directory, 'scores.csv')
+        with open(source, 'w', newline='') as handle:
+            writer = csv.writer(handle)
+            writer.writerow(['user_id'] + [f'q{index + 1}' for index in range(matrix.shape[1])])
+            for user_id, row in enumerate(matrix.tolist()):
+                writer.writerow([user_id] + row)
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'psy.batch', questionnaire.id, source, '-o', target,
+                        '--id-columns', 'user_id'], check=True, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - started
+    print(f"{'':<12}{'psy.batch (CSV)':<28}{throughput(matrix.shape[0], elapsed)}")
+
+
+def run(args) -> None:
+    rng = np.random.default_rng(args.seed)
+    print(f"{args.rows} lignes par questionnaire\n")
+    print(f"{'test':<12}{'méthode':<28}{'lignes/s':>14}")
+    for test_id, legacy in LEGACY.items():
+        questionnaire = registry.get(test_id)
+        option_counts = [len(options) for _, options in questionnaire.questions]
+        matrix = rng.integers(0, option_counts, size=(args.rows, len(option_counts)), dtype=np.int16)
+        rows = matrix.tolist()
+
+        started = time.perf_counter()
+        legacy_results = [legacy(row) for row in rows]
+        print(f"{test_id:<12}{'historique, par ligne':<28}{throughput(args.rows, time.perf_counter() - started)}")
+
+        sample = rows[:args.message_rows]
+        started = time.perf_counter()
+        for row in sample:
+            questionnaire.calculate_result(row)
+        print(f"{'':<12}{'calculate_result, par ligne':<28}{throughput(len(sample), time.perf_counter() - started)}")
+
+        started = time.perf_counter()
+        questionnaire.score(matrix)
+        print(f"{'':<12}{'score vectorisé':<28}{throughput(args.rows, time.perf_counter() - started)}")
+
+        check(questionnaire, matrix, legacy_results)
+        if args.csv:
+            bench_csv(questionnaire, matrix)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--message-rows', type=int, default=20_000,
+                        help="lignes passées à calculate_result (message compris)")
+    parser.add_argument('--csv', action='store_true', help="mesure aussi python -m psy.batch")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Benchmark du routage des boutons : chaîne de regex vs dispatch par dictionnaire.
+
+Reproduit l'ancien enregistrement (un ``CallbackQueryHandler`` à motif regex
+par action, testés dans l'ordre) et le compare au décodage de
+``bot.callbacks`` suivi d'une recherche dans un dictionnaire, pour un nombre
+croissant de tests enregistrés.
+
+Usage :
+    python -m benchmarks.dispatch --iterations 200000
+"""
+
+import argparse
+import re
+import time
+
+from bot import callbacks
+
+ACTIONS = {callbacks.MENU: 'menu', callbacks.START_TEST: 'start', callbacks.ANSWER: 'answer', callbacks.CANCEL: 'cancel'}
+
+
+def regex_chain(test_ids):
+    """Motifs de l'ancien ``main()`` : un par test, puis réponses, menu et annulation."""
+    patterns = [re.compile(f'^{test_id}$') for test_id in test_ids]
+    patterns += [re.compile('^answer_'), re.compile('^(start|help|new_test)$'), re.compile('^cancel_test$')]
+    return patterns
+
+
+def route_regex(patterns, data):
+    for index, pattern in enumerate(patterns):
+        if pattern.match(data):
+            return index
+    return None
+
+
+def route_dict(data):
+    parsed = callbacks.parse(data)
+    return ACTIONS.get(parsed[0]) if parsed else None
+
+
+def bench(func, datas, iterations) -> float:
+    n = len(datas)
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(datas[i % n])
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'tests':>6}{'regex (ns)':>14}{'dict (ns)':>14}")
+    for count in (4, 16, 64, 256):
+        test_ids = [f'test{i}' for i in range(count)]
+        patterns = regex_chain(test_ids)
+        # Un clic typique est une réponse : c'est le motif le plus loin dans la chaîne
+        legacy = ['answer_1', 'start', 'cancel_test', test_ids[-1]]
+        current = [callbacks.encode(callbacks.ANSWER, test_ids[-1], 3, 1), callbacks.encode(callbacks.MENU, 'start'),
+                   callbacks.encode(callbacks.CANCEL), callbacks.encode(callbacks.START_TEST, test_ids[-1])]
+        regex_ns = bench(lambda data: route_regex(patterns, data), legacy, args.iterations)
+        dict_ns = bench(route_dict, current, args.iterations)
+        print(f"{count:>6}{regex_ns:>14.0f}{dict_ns:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
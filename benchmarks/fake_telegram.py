@@ -0,0 +1,263 @@
+"""Faux serveur de l'API Bot Telegram pour les benchmarks hors ligne.
+
+``FakeTelegramAPI`` répond aux méthodes utilisées par le bot (``getMe``,
+``sendMessage``, ``editMessageText``, ``answerCallbackQuery``,
+``setWebhook``, ``getUpdates``…) avec des réponses valides, enregistre chaque
+appel avec son horodatage et peut simuler une latence réseau ainsi que les
+limites d'envoi de Telegram (réponses 429 ``RetryAfter``). Le bot y est
+raccordé via ``TELEGRAM_API_URL``.
+
+``UpdateFactory`` fabrique des mises à jour synthétiques (commandes et clics
+sur des boutons) au format JSON de Telegram.
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'PsychoTest', 'username': 'psychotest_bot'}
+
+
+class FakeTelegramAPI:
+    """Serveur HTTP/1.1 minimal (keep-alive) imitant l'API Bot."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 global_limit: int = None, chat_limit: int = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        # Messages acceptés par seconde (au total, par conversation) avant de répondre 429
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self._windows = defaultdict(list)
+        self.calls = Counter()
+        self.rejected = Counter()
+        # Appels reçus par conversation : (horodatage, méthode, paramètres)
+        self.chats = defaultdict(list)
+        self._chat_events = defaultdict(asyncio.Event)
+        self._message_ids = itertools.count(1000)
+        self._updates = []
+        self._updates_event = asyncio.Event()
+        self._server = None
+        self._connections = set()
+
+    @property
+    def base_url(self) -> str:
+        """Valeur à passer à ``TELEGRAM_API_URL`` (le token est ajouté par le bot)."""
+        return f'http://{self.host}:{self.port}/bot'
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    # -- Interrogation par les benchmarks -----------------------------------
+
+    def replies(self, chat_id: int) -> list:
+        """Messages envoyés ou modifiés par le bot dans une conversation."""
+        return [call for call in self.chats[chat_id] if call[1] in ('sendMessage', 'editMessageText')]
+
+    async def wait_for_replies(self, chat_id: int, count: int, timeout: float = 30.0) -> list:
+        """Attend que le bot ait produit au moins ``count`` messages dans la conversation."""
+        deadline = time.monotonic() + timeout
+        while len(self.replies(chat_id)) < count:
+            event = self._chat_events[chat_id]
+            event.clear()
+            await asyncio.wait_for(event.wait(), max(0.0, deadline - time.monotonic()))
+        return self.replies(chat_id)
+
+    def push_update(self, update: dict) -> None:
+        """Met une mise à jour à disposition de ``getUpdates`` (mode polling)."""
+        self._updates.append(update)
+        self._updates_event.set()
+
+    # -- Méthodes de l'API --------------------------------------------------
+
+    def _over_limit(self, method: str, params: dict) -> bool:
+        """Applique les limites simulées (fenêtre glissante d'une seconde)."""
+        chat_id = params.get('chat_id')
+        if method == 'answerCallbackQuery' or chat_id is None:
+            return False
+        now = time.monotonic()
+        for key, limit in ((None, self.global_limit), (int(chat_id), self.chat_limit)):
+            if limit is None:
+                continue
+            window = self._windows[key]
+            while window and window[0] <= now - 1.0:
+                window.pop(0)
+            if len(window) >= limit:
+                return True
+        for key in (None, int(chat_id)):
+            self._windows[key].append(now)
+        return False
+
+    def _message(self, params: dict, message_id: int = None) -> dict:
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def _call(self, method: str, params: dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'sendMessage':
+            return self._message(params)
+        if method == 'editMessageText':
+            return self._message(params, int(params.get('message_id', 0)) or None)
+        # answerCallbackQuery, setWebhook, deleteWebhook, setMyCommands…
+        return True
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset', 0) or 0)
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), float(params.get('timeout', 0) or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit', 100) or 100)]
+
+    def _record(self, method: str, params: dict) -> None:
+        self.calls[method] += 1
+        chat_id = params.get('chat_id')
+        if chat_id is None:
+            return
+        chat_id = int(chat_id)
+        self.chats[chat_id].append((time.monotonic(), method, params))
+        self._chat_events[chat_id].set()
+
+    # -- Transport HTTP -----------------------------------------------------
+
+    async def _handle_connection(self, reader, writer) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                method = path.rsplit('/', 1)[-1].split('?', 1)[0]
+                params = self._parse_params(headers.get('content-type', ''), body)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if self._over_limit(method, params):
+                    self.rejected[method] += 1
+                    status = b'429 Too Many Requests'
+                    payload = json.dumps({
+                        'ok': False,
+                        'error_code': 429,
+                        'description': 'Too Many Requests: retry after 1',
+                        'parameters': {'retry_after': 1},
+                    }).encode()
+                else:
+                    result = await self._call(method, params)
+                    self._record(method, params)
+                    status = b'200 OK'
+                    payload = json.dumps({'ok': True, 'result': result}).encode()
+                writer.write(
+                    b'HTTP/1.1 %s\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: %d\r\n\r\n' % (status, len(payload)) + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    @staticmethod
+    def _parse_params(content_type: str, body: bytes) -> dict:
+        if not body:
+            return {}
+        if content_type.startswith('application/json'):
+            return json.loads(body)
+        params = {}
+        for name, value in parse_qsl(body.decode(), keep_blank_values=True):
+            # Les paramètres complexes (reply_markup…) sont encodés en JSON
+            if value[:1] in ('{', '['):
+                value = json.loads(value)
+            params[name] = value
+        return params
+
+
+class UpdateFactory:
+    """Fabrique des mises à jour Telegram synthétiques."""
+
+    def __init__(self, start_id: int = 1):
+        self._update_ids = itertools.count(start_id)
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'language_code': 'fr'}
+
+    def command(self, user_id: int, text: str) -> dict:
+        command = text.split()[0]
+        return {
+            'update_id': next(self._update_ids),
+            'message': {
+                'message_id': next(self._update_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': self._user(user_id),
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+            },
+        }
+
+    def callback(self, user_id: int, data: str, message_id: int = 1, query_id: str = None) -> dict:
+        update_id = next(self._update_ids)
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': query_id or str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': BOT_USER,
+                    'text': '',
+                },
+            },
+        }
+
+
+def buttons(params: dict) -> list:
+    """Liste des ``callback_data`` du clavier d'un message envoyé par le bot."""
+    markup = params.get('reply_markup') or {}
+    return [button['callback_data'] for row in markup.get('inline_keyboard', []) for button in row]
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Percentile ``q`` (0–100) d'une liste triée, par le rang le plus proche."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
@@ -0,0 +1,93 @@
+"""Benchmark de l'ordonnanceur d'envoi face aux limites de Telegram.
+
+Le faux serveur applique les limites de Telegram (30 messages/s au total,
+de courtes rafales de 3 messages puis 1 message/s par conversation, réponses
+429 au-delà). Chaque conversation reçoit une rafale de modifications du même
+message (des clics rapides), chacune précédée d'un ``answerCallbackQuery``,
+puis un nouveau message. On compare un bot sans rate limiter et un bot
+équipé de ``OutboundScheduler``.
+
+Usage :
+    python -m benchmarks.flood_control --chats 100 --edits 5
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from benchmarks.fake_telegram import FakeTelegramAPI, percentile
+from bot.outbound import OutboundScheduler
+
+
+async def conversation(bot, chat_id, edits, answer_latencies, errors) -> None:
+    for step in range(edits):
+        started = time.perf_counter()
+        try:
+            await bot.answer_callback_query(f'{chat_id}-{step}')
+            answer_latencies.append(time.perf_counter() - started)
+            # Pas d'attente entre les modifications : l'utilisateur clique vite
+            asyncio.create_task(_guard(bot.edit_message_text(f'Question {step + 1}', chat_id=chat_id, message_id=1), errors))
+        except RetryAfter:
+            errors.append(step)
+    await _guard(bot.send_message(chat_id, 'Que souhaitez-vous faire maintenant ?'), errors)
+
+
+async def _guard(coroutine, errors) -> None:
+    try:
+        await coroutine
+    except RetryAfter as exc:
+        errors.append(exc)
+
+
+async def run_case(label: str, args, rate_limiter) -> None:
+    api = FakeTelegramAPI(latency=args.api_latency, global_limit=30, chat_limit=3)
+    await api.start()
+    bot = ExtBot('123456:flood', base_url=api.base_url, rate_limiter=rate_limiter)
+    answer_latencies, errors = [], []
+    async with bot:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            conversation(bot, 30_000 + chat, args.edits, answer_latencies, errors)
+            for chat in range(args.chats)
+        ))
+        # Laisser partir les modifications encore en file
+        while rate_limiter is not None and rate_limiter.stats()['queue_depth'] + rate_limiter.stats()['in_flight']:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+    await api.stop()
+
+    answer_latencies.sort()
+    print(f"\n== {label}")
+    print(f"durée : {elapsed:.2f} s, erreurs RetryAfter remontées : {len(errors)}, "
+          f"429 reçus du serveur : {sum(api.rejected.values())}")
+    print(f"messages acceptés : sendMessage={api.calls['sendMessage']} editMessageText={api.calls['editMessageText']}")
+    print(f"answerCallbackQuery p50={percentile(answer_latencies, 50) * 1000:.1f} ms "
+          f"p99={percentile(answer_latencies, 99) * 1000:.1f} ms")
+    if rate_limiter is not None:
+        stats = rate_limiter.stats()
+        print(f"modifications fusionnées : {stats['merged_edits']}, nouvelles tentatives : {stats['retried']}, "
+              f"attente moyenne {stats['wait_seconds_avg'] * 1000:.0f} ms, max {stats['wait_seconds_max'] * 1000:.0f} ms")
+
+
+async def run(args) -> None:
+    print(f"{args.chats} conversations, {args.edits} modifications rapides chacune")
+    await run_case("sans rate limiter", args, None)
+    await run_case("OutboundScheduler", args, OutboundScheduler())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--edits', type=int, default=5)
+    parser.add_argument('--api-latency', type=float, default=0.02, help="latence simulée de l'API (s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Historique des résultats : lectures par utilisateur et export.
+
+Remplit une base SQLite temporaire (voir ``bot/history.py``) par paliers
+(``--sizes``), avec une dizaine de résultats par utilisateur, répartis sur
+les quatre tests. À chaque palier :
+
+- la latence de ``recent`` (les douze derniers résultats d'un utilisateur
+  pour un test, ce que lit ``/history``) pour ``--lookups`` utilisateurs
+  tirés au hasard : elle doit rester stable quand la table grossit ;
+- au dernier palier, l'export de ``--export`` lignes en CSV et en NDJSON
+  (lignes par seconde), puis le pic de mémoire Python d'un second export
+  (``tracemalloc``, qui le ralentit), qui ne dépend que de la taille des
+  pages.
+
+Usage :
+    python -m benchmarks.history --sizes 100000,1000000,10000000
+"""
+
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from bot.history import ResultHistory, format_rows
+
+TESTS = {
+    'depression': lambda rng: {'score': rng.randint(0, 27), 'severity': rng.randint(0, 4)},
+    'anxiety': lambda rng: {'score': rng.randint(0, 21), 'severity': rng.randint(0, 3)},
+    'big_five': lambda rng: {trait: rng.randint(0, 4) for trait in
+                             ('extraversion', 'agreeableness', 'conscientiousness', 'neuroticism', 'openness')},
+    'mbti': lambda rng: {'type': rng.randint(0, 15)},
+}
+RESULTS_PER_USER = 10
+
+
+def fill(history: ResultHistory, start: int, end: int, rng: random.Random) -> float:
+    """Ajoute les résultats ``start`` à ``end`` ; retourne la durée de l'écriture."""
+    tests = list(TESTS)
+    now = time.time()
+    started = time.perf_counter()
+    for number in range(start, end):
+        test_id = tests[number % len(tests)]
+        history.record(number // RESULTS_PER_USER, test_id, TESTS[test_id](rng), now - number)
+        if number % 100_000 == 0:
+            history.flush()
+    history.flush()
+    return time.perf_counter() - started
+
+
+def bench_lookups(history: ResultHistory, users: int, lookups: int, rng: random.Random) -> None:
+    latencies = []
+    for _ in range(lookups):
+        user_id = rng.randrange(users)
+        started = time.perf_counter()
+        history.recent(user_id, 'depression')
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{'':<14}recent : médiane {quantiles[49]:.3f} ms, p99 {quantiles[98]:.3f} ms, "
+          f"max {latencies[-1]:.3f} ms")
+
+
+def export(history: ResultHistory, rows: int, page_size: int, output_format: str, test_id: str) -> tuple:
+    """Exporte jusqu'à ``rows`` résultats ; retourne le nombre de lignes et d'octets."""
+    exported = size = 0
+    lines = format_rows(itertools.islice(history.export(test_id, page_size=page_size), rows), output_format, test_id)
+    for line in lines:
+        size += len(line)
+        exported += 1
+    return exported - (output_format == 'csv'), size
+
+
+def bench_export(history: ResultHistory, rows: int, page_size: int) -> None:
+    for output_format, test_id in (('csv', None), ('csv', 'depression'), ('ndjson', None)):
+        # Le premier export d'un test charge sa définition
+        export(history, 1, page_size, output_format, test_id)
+        started = time.perf_counter()
+        exported, size = export(history, rows, page_size, output_format, test_id)
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        export(history, rows, page_size, output_format, test_id)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        label = f"export {output_format}" + (f" ({test_id})" if test_id else "")
+        print(f"{label:<26}{exported / elapsed:>12,.0f} lignes/s ({exported:,} lignes, "
+              f"{size / 2**20:,.0f} Mio, pic mémoire {peak / 2**20:.1f} Mio)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=lambda value: [int(n) for n in value.split(',')],
+                        default=[100_000, 1_000_000, 10_000_000], help="tailles de la table, croissantes")
+    parser.add_argument('--lookups', type=int, default=2_000)
+    parser.add_argument('--export', type=int, default=1_000_000, help="lignes exportées par format")
+    parser.add_argument('--page-size', type=int, default=1_000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.db')
+        history = ResultHistory(path, flush_interval=3600)
+        stored = 0
+        try:
+            for size in args.sizes:
+                elapsed = fill(history, stored, size, rng)
+                print(f"{size:>12,} résultats ({(size - stored) / elapsed:,.0f} écritures/s, "
+                      f"{os.path.getsize(path) / 2**20:,.0f} Mio)")
+                stored = size
+                bench_lookups(history, size // RESULTS_PER_USER, args.lookups, rng)
+            bench_export(history, args.export, args.page_size)
+        finally:
+            history.close()
+
+
+if __name__ == '__main__':
+    main()
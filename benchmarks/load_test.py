@@ -0,0 +1,289 @@
+"""Test de charge des handlers réels, avec latence par handler.
+
+L'application est construite par ``main.build_application`` (comme en
+production), raccordée à un faux serveur Telegram (``benchmarks.fake_telegram``)
+et alimentée par sa file de mises à jour, avec traitement concurrent. Des
+milliers d'utilisateurs virtuels suivent des scénarios mélangés :
+
+- ``complete`` : ``/start``, choix d'un des quatre tests (bouton du menu ou
+  commande directe), une réponse par question, résultats ;
+- ``cancel`` : même début, puis ``/cancel`` ou le bouton Annuler en cours de test ;
+- ``abandon`` : même début, puis plus rien (la session reste ouverte).
+
+Chaque utilisateur attend la réponse du bot avant d'envoyer la mise à jour
+suivante. Les handlers de ``main`` sont chronométrés (durées inclusives :
+``handle_answer`` comprend ``send_question``, qui comprend ``show_results``
+pour la dernière question). Le rapport donne p50/p95/p99 par handler, la
+latence de bout en bout d'une mise à jour, le débit et le pic de RSS, et
+peut être enregistré en JSON (``--output``) puis comparé à un autre
+(``--compare``).
+
+Les flux de mises à jour sont générés (``--seed``) ou rejoués depuis un
+enregistrement NDJSON (``--record`` / ``--replay``).
+
+Usage :
+    python -m benchmarks.load_test --users 2000 --concurrency 200 --output charge.json
+    python -m benchmarks.load_test --replay flux.ndjson --compare charge.json
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from benchmarks.fake_telegram import FakeTelegramAPI, UpdateFactory, percentile
+from bot import callbacks
+from psy import registry
+
+# Handlers de main.py chronométrés
+HANDLERS = ('handle_callback', 'show_main_menu', 'start_test', 'handle_answer',
+            'send_question', 'show_results', 'cancel')
+
+
+# -- Flux de mises à jour ---------------------------------------------------
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('complete', 'cancel', 'abandon'):
+            raise argparse.ArgumentTypeError(f"scénario inconnu : {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def user_stream(factory, rng, user_id: int, scenario: str) -> list:
+    """Mises à jour d'un utilisateur virtuel pour ``scenario``."""
+    questionnaire = rng.choice(registry.all_questionnaires())
+    stream = [factory.command(user_id, '/start')]
+    if rng.random() < 0.5:
+        stream.append(factory.callback(user_id, callbacks.encode(callbacks.START_TEST, questionnaire.id)))
+    else:
+        stream.append(factory.command(user_id, f'/{questionnaire.command}'))
+
+    question_count = len(questionnaire.questions)
+    stop = question_count if scenario == 'complete' else rng.randrange(question_count)
+    for question_index in range(stop):
+        answer = rng.randrange(len(questionnaire.questions[question_index][1]))
+        data = callbacks.encode(callbacks.ANSWER, questionnaire.id, question_index, answer)
+        stream.append(factory.callback(user_id, data))
+    if scenario == 'cancel':
+        if rng.random() < 0.5:
+            stream.append(factory.command(user_id, '/cancel'))
+        else:
+            stream.append(factory.callback(user_id, callbacks.encode(callbacks.CANCEL)))
+    return stream
+
+
+def generate(args) -> dict:
+    rng = random.Random(args.seed)
+    factory = UpdateFactory()
+    names, weights = zip(*args.mix.items())
+    streams = {}
+    for index in range(args.users):
+        user_id = 50_000 + index
+        streams[user_id] = user_stream(factory, rng, user_id, rng.choices(names, weights)[0])
+    return streams
+
+
+def save_streams(path: str, streams: dict) -> None:
+    with open(path, 'w', encoding='utf-8') as handle:
+        for user_id, stream in streams.items():
+            for update in stream:
+                handle.write(json.dumps({'user': user_id, 'update': update}, ensure_ascii=False) + '\n')
+
+
+def load_streams(path: str) -> dict:
+    streams = defaultdict(list)
+    with open(path, encoding='utf-8') as handle:
+        for line in handle:
+            if line.strip():
+                record = json.loads(line)
+                streams[record['user']].append(record['update'])
+    return dict(streams)
+
+
+# -- Chronométrage ------------------------------------------------------------
+
+def instrument(main, timings: dict) -> None:
+    """Remplace les handlers de ``main`` par des versions chronométrées."""
+    wrappers = {}
+    for name in HANDLERS:
+        original = getattr(main, name)
+
+        @functools.wraps(original)
+        async def timed(*args, _original=original, _name=name, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await _original(*args, **kwargs)
+            finally:
+                timings[_name].append(time.perf_counter() - started)
+
+        wrappers[original] = timed
+        setattr(main, name, timed)
+    # Le dispatch des boutons référence les fonctions d'origine
+    for action, (handler, count) in list(main.CALLBACK_ACTIONS.items()):
+        main.CALLBACK_ACTIONS[action] = (wrappers.get(handler, handler), count)
+
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss est en Kio sous Linux, en octets sous macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'inconnu'
+
+
+# -- Exécution ----------------------------------------------------------------
+
+async def virtual_user(application, api, stream, latencies, semaphore, think, rng) -> None:
+    from telegram import Update
+
+    async with semaphore:
+        for update in stream:
+            user_id = (update.get('message') or update.get('callback_query'))['from']['id']
+            expected = len(api.replies(user_id)) + 1
+            started = time.perf_counter()
+            await application.update_queue.put(Update.de_json(update, application.bot))
+            try:
+                await api.wait_for_replies(user_id, expected, timeout=30.0)
+            except asyncio.TimeoutError:
+                latencies['timeouts'] += 1
+                return
+            latencies['update'].append(time.perf_counter() - started)
+            if think:
+                await asyncio.sleep(rng.uniform(0, think))
+
+
+async def run(args, streams: dict) -> dict:
+    api = FakeTelegramAPI(latency=args.api_latency)
+    await api.start()
+    os.environ['TELEGRAM_API_URL'] = api.base_url
+    if not args.rate_limiter:
+        # Les limites de Telegram masqueraient le coût des handlers
+        os.environ['OUTBOUND_SCHEDULER'] = '0'
+
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+    timings = defaultdict(list)
+    instrument(main, timings)
+    application = main.build_application('123456:load', concurrent_updates=args.concurrent_updates)
+
+    latencies = {'update': [], 'timeouts': 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rng = random.Random(args.seed)
+    update_count = sum(len(stream) for stream in streams.values())
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            virtual_user(application, api, stream, latencies, semaphore, args.think, rng)
+            for stream in streams.values()
+        ))
+        elapsed = time.perf_counter() - started
+        await application.stop()
+    await api.stop()
+
+    return {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': {
+            'users': len(streams), 'updates': update_count, 'concurrency': args.concurrency,
+            'concurrent_updates': args.concurrent_updates, 'api_latency': args.api_latency,
+            'think': args.think, 'rate_limiter': args.rate_limiter, 'seed': args.seed,
+            'replay': args.replay,
+        },
+        'elapsed_s': elapsed,
+        'updates_per_s': update_count / elapsed,
+        'timeouts': latencies['timeouts'],
+        'peak_rss_mib': peak_rss_mib(),
+        'open_sessions': len(main.user_states),
+        'api_calls': dict(api.calls),
+        'update_latency': summarize(latencies['update']),
+        'handlers': {name: summarize(timings[name]) for name in HANDLERS if timings[name]},
+    }
+
+
+def report(result: dict, baseline: dict = None) -> None:
+    parameters = result['parameters']
+    print(f"commit {result['commit']} : {parameters['users']} utilisateurs, {parameters['updates']} mises à jour, "
+          f"{parameters['concurrency']} utilisateurs simultanés, latence API {parameters['api_latency'] * 1000:.0f} ms")
+    print(f"débit {result['updates_per_s']:.0f} mises à jour/s, pic RSS {result['peak_rss_mib']:.1f} Mio, "
+          f"délais dépassés {result['timeouts']}, sessions ouvertes {result['open_sessions']}\n")
+
+    rows = [('mise à jour (bout en bout)', result['update_latency'],
+             baseline and baseline['update_latency'])]
+    rows += [(name, stats, baseline and baseline['handlers'].get(name)) for name, stats in result['handlers'].items()]
+    print(f"{'':<28}{'nombre':>8}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}"
+          + (f"{'Δ p95':>10}" if baseline else ''))
+    for name, stats, previous in rows:
+        line = (f"{name:<28}{stats['count']:>8}{stats['p50_ms']:>10.2f}"
+                f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+        if previous:
+            line += f"{(stats['p95_ms'] / previous['p95_ms'] - 1) * 100 if previous['p95_ms'] else 0:>+9.0f}%"
+        print(line)
+    if baseline:
+        change = (result['updates_per_s'] / baseline['updates_per_s'] - 1) * 100
+        print(f"\ndébit par rapport à {baseline['commit']} : {change:+.0f} %")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200, help="utilisateurs virtuels actifs en même temps")
+    parser.add_argument('--concurrent-updates', type=int, default=256)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('complete=0.6,cancel=0.15,abandon=0.25'),
+                        help="poids des scénarios complete, cancel et abandon")
+    parser.add_argument('--api-latency', type=float, default=0.005, help="latence simulée de l'API (s)")
+    parser.add_argument('--think', type=float, default=0.0, help="pause maximale entre deux clics (s)")
+    parser.add_argument('--rate-limiter', action='store_true', help="garde OutboundScheduler (limites Telegram)")
+    parser.add_argument('--record', help="enregistre les flux générés (NDJSON)")
+    parser.add_argument('--replay', help="rejoue des flux enregistrés au lieu d'en générer")
+    parser.add_argument('--output', help="enregistre le rapport JSON")
+    parser.add_argument('--compare', help="rapport JSON d'un autre commit à comparer")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    streams = load_streams(args.replay) if args.replay else generate(args)
+    if args.record:
+        save_streams(args.record, streams)
+    result = asyncio.run(run(args, streams))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+    report(result, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(result, handle, indent=2, ensure_ascii=False)
+        print(f"\nrapport enregistré dans {args.output}")
+
+
+if __name__ == '__main__':
+    main()
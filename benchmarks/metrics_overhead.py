@@ -0,0 +1,105 @@
+"""Coût des métriques sur le chemin d'un clic.
+
+On mesure, en nanosecondes par opération :
+
+- ``Histogram.observe`` (recherche de la tranche et incrément) ;
+- ``Counter.inc`` et ``Metrics.question_answered`` (série préindexée) ;
+- un handler vide appelé directement puis à travers ``Metrics.timed`` ;
+- la collecte complète (``Metrics.render``) avec des séries remplies,
+  en microsecondes.
+
+Le surcoût de ``timed`` est l'écart entre les deux appels du handler vide :
+c'est ce que paie chaque mise à jour quand ``METRICS_PORT`` est défini.
+
+Usage :
+    python -m benchmarks.metrics_overhead --operations 1000000
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from bot.metrics import Metrics
+from psy import registry
+
+
+def per_operation(function, operations: int) -> float:
+    started = time.perf_counter()
+    function(operations)
+    return (time.perf_counter() - started) / operations * 1e9
+
+
+def run(args) -> None:
+    rng = random.Random(args.seed)
+    questionnaires = {questionnaire.id: len(questionnaire.questions)
+                      for questionnaire in registry.all_questionnaires()}
+    metrics = Metrics(questionnaires, active_sessions=lambda: {test_id: 100 for test_id in questionnaires})
+    histogram = metrics.handler_seconds.labels('handle_answer')
+    counter = metrics.completed.labels('mbti')
+    durations = [rng.lognormvariate(-6, 1.5) for _ in range(1024)]
+
+    def observe(count):
+        for index in range(count):
+            histogram.observe(durations[index & 1023])
+
+    def increment(count):
+        for _ in range(count):
+            counter.inc()
+
+    def answered(count):
+        for index in range(count):
+            metrics.question_answered('depression', index % 9)
+
+    async def handler(update, context):
+        return None
+
+    timed_handler = metrics.timed(handler)
+
+    def call(callback):
+        async def loop(count):
+            for _ in range(count):
+                await callback(None, None)
+        return lambda count: asyncio.run(loop(count))
+
+    print(f"{args.operations} opérations par mesure\n")
+    print(f"{'opération':<36}{'ns/op':>10}")
+    for label, function in (
+        ('Histogram.observe', observe),
+        ('Counter.inc', increment),
+        ('Metrics.question_answered', answered),
+    ):
+        print(f"{label:<36}{per_operation(function, args.operations):>10.0f}")
+
+    raw = per_operation(call(handler), args.operations)
+    wrapped = per_operation(call(timed_handler), args.operations)
+    print(f"{'handler vide, appel direct':<36}{raw:>10.0f}")
+    print(f"{'handler vide, via Metrics.timed':<36}{wrapped:>10.0f}")
+    print(f"{'surcoût par mise à jour':<36}{wrapped - raw:>10.0f}")
+
+    # Séries d'une instance en service : handlers, méthodes de l'API, abandons
+    for name in ('handle_callback', 'show_main_menu', 'cancel', 'start_test_command'):
+        metrics.observe_handler(name, rng.random() / 100)
+    for method in ('sendMessage', 'editMessageText', 'answerCallbackQuery'):
+        metrics.api_seconds.labels(method).observe(rng.random() / 10)
+    for test_id, count in questionnaires.items():
+        for index in range(count):
+            metrics.test_abandoned(test_id, index, 'idle')
+    started = time.perf_counter()
+    for _ in range(args.renders):
+        body = metrics.render()
+    elapsed = (time.perf_counter() - started) / args.renders
+    print(f"\ncollecte : {elapsed * 1e6:.0f} µs, {len(body.splitlines())} lignes, {len(body.encode())} octets")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operations', type=int, default=1_000_000)
+    parser.add_argument('--renders', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Empreinte de N bots : N processus séparés contre un seul (``BOTS_FILE``).
+
+Pour chaque valeur de ``--bots``, lance les bots de deux façons contre le
+faux serveur Telegram (``benchmarks.fake_telegram``) :
+
+- N processus, chacun avec un bot, comme N ``python main.py`` ;
+- un processus qui sert les N bots (``bot/multibot.py``).
+
+Dans chaque processus, ``--users`` utilisateurs par bot passent le PHQ-9
+en entier (mises à jour données directement à ``Application.process_update``).
+Quand tous les processus ont fini, chacun relève sa mémoire et son temps
+CPU (démarrage compris). La mémoire est la PSS (``/proc/self/smaps_rollup``,
+Linux) : les pages partagées entre processus, comme le code de
+l'interpréteur, ne sont comptées qu'une fois au total ; à défaut, le pic
+de RSS de chaque processus.
+
+Usage :
+    python -m benchmarks.multibot --bots 1,4,16 --users 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from benchmarks.fake_telegram import FakeTelegramAPI
+
+CHILD = r'''
+import asyncio, json, resource, sys
+
+def memory_mib():
+    try:
+        with open('/proc/self/smaps_rollup') as rollup:
+            for line in rollup:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+async def run(first, bots, users):
+    import main
+    from benchmarks.fake_telegram import UpdateFactory
+    from bot import multibot
+    from telegram import Update
+    configs = [multibot.BotConfig(f'bot{i}', f'{i + 1}:benchmark') for i in range(first, first + bots)]
+    applications = multibot.build_applications(configs, main.build_application)
+    for application in applications:
+        await application.initialize()
+    await main.start_background_tasks(applications[0])
+    startup = cpu_seconds()
+    factory = UpdateFactory()
+
+    async def user(application, user_id):
+        updates = [factory.command(user_id, '/depression')]
+        updates += [factory.callback(user_id, f'1:a:depression:{i}:{(user_id + i) % 4}') for i in range(9)]
+        for update in updates:
+            await application.process_update(Update.de_json(update, application.bot))
+
+    await asyncio.gather(*(user(application, 1000 + i) for application in applications for i in range(users)))
+    print('prêt', flush=True)
+    sys.stdin.readline()
+    print(json.dumps({'memory': memory_mib(), 'cpu': cpu_seconds(), 'startup': startup,
+                      'sessions': len(main.user_states)}), flush=True)
+    await main.stop_background_tasks(applications[0])
+    for application in applications:
+        await application.shutdown()
+
+asyncio.run(run(*map(int, sys.argv[1:4])))
+'''
+
+
+async def measure(environment: dict, layout: list, users: int) -> dict:
+    """Lance un processus par élément de ``layout`` (nombre de bots) ; totaux des relevés."""
+    processes = []
+    first = 0
+    for bots in layout:
+        processes.append(await asyncio.create_subprocess_exec(
+            sys.executable, '-c', CHILD, str(first), str(bots), str(users), env=environment,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE))
+        first += bots
+    # Relevés une fois que tous les processus ont fini, pour partager les pages entre eux
+    for process in processes:
+        line = await process.stdout.readline()
+        if line.strip() != 'prêt'.encode():
+            raise RuntimeError(f"Processus sans réponse : {line!r}")
+    reports = []
+    for process in processes:
+        process.stdin.write(b'\n')
+        await process.stdin.drain()
+        reports.append(json.loads(await process.stdout.readline()))
+    for process in processes:
+        process.stdin.close()
+        await process.wait()
+    if any(report['sessions'] for report in reports):
+        raise RuntimeError("Des sessions n'ont pas été terminées")
+    return {name: sum(report[name] for report in reports) for name in ('memory', 'cpu', 'startup')}
+
+
+async def run(args) -> None:
+    api = FakeTelegramAPI()
+    await api.start()
+    environment = dict(os.environ, PYTHONPATH=os.getcwd(), TELEGRAM_API_URL=api.base_url,
+                       OUTBOUND_SCHEDULER='0', METRICS_PORT='', RESULT_LOG_DIR='', REMINDERS='0')
+    print(f"{'bots':>5}  {'mode':<20}{'mémoire':>12}{'par bot':>10}{'CPU':>10}{'dont démarrage':>16}{'par bot':>10}")
+    try:
+        for bots in args.bots:
+            for label, layout in (('processus séparés', [1] * bots), ('un processus', [bots])):
+                totals = await measure(environment, layout, args.users)
+                print(f"{bots:>5}  {label:<20}{totals['memory']:>8.1f} Mio{totals['memory'] / bots:>6.1f} Mio"
+                      f"{totals['cpu']:>8.2f} s{totals['startup']:>14.2f} s{totals['cpu'] / bots:>8.2f} s")
+    finally:
+        await api.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bots', type=lambda value: [int(n) for n in value.split(',')], default=[1, 4, 16])
+    parser.add_argument('--users', type=int, default=50, help="utilisateurs par bot")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
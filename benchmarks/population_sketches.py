@@ -0,0 +1,107 @@
+"""Coût et précision des statistiques de population.
+
+On mesure :
+
+- le chemin des résultats : ``Population.record`` (calcul du score et mise
+  à jour des esquisses) et ``Population.percentile`` juste après, en
+  microsecondes, comparés à l'approche naïve qui garde tous les scores
+  (``bisect.insort`` puis recherche du rang) ;
+- l'erreur de l'estimation HyperLogLog des utilisateurs distincts, pour
+  plusieurs effectifs ;
+- l'instantané d'un processus et la relecture des instantanés de
+  ``--processes`` processus, en millisecondes, et leur taille sur disque.
+
+Usage :
+    python -m benchmarks.population_sketches --results 200000
+"""
+
+import argparse
+import bisect
+import os
+import random
+import tempfile
+import time
+
+from bot.population import HyperLogLog, Population
+from psy import registry
+
+
+def sample_responses(rng, questionnaire, count: int) -> list:
+    return [[rng.randrange(len(options)) for _, options in questionnaire.questions] for _ in range(count)]
+
+
+def measure_results(args, rng) -> None:
+    questionnaire = registry.get('depression')
+    rows = sample_responses(rng, questionnaire, 1024)
+    population = Population(registry.all_questionnaires(), min_results=0)
+
+    started = time.perf_counter()
+    for index in range(args.results):
+        scored = population.record(index, 'depression', rows[index & 1023])
+        population.percentile('depression', 'score', scored['score'])
+    sketches = (time.perf_counter() - started) / args.results * 1e6
+
+    # Référence : tous les scores gardés, triés, pour un rang exact
+    scores = []
+    started = time.perf_counter()
+    for index in range(args.results):
+        score = questionnaire.score(rows[index & 1023])['score'][0].item()
+        bisect.insort(scores, score)
+        (bisect.bisect_left(scores, score) + bisect.bisect_right(scores, score)) / 2 / len(scores)
+    naive = (time.perf_counter() - started) / args.results * 1e6
+
+    print(f"{args.results} résultats PHQ-9, enregistrement puis rang centile\n")
+    print(f"{'esquisses (Population)':<32}{sketches:>10.1f} µs/résultat")
+    print(f"{'scores gardés (insort)':<32}{naive:>10.1f} µs/résultat, {len(scores) * 8 / 2**20:.1f} Mio de pointeurs")
+
+
+def measure_hll(args, rng) -> None:
+    print(f"\n{'utilisateurs':>14}{'estimation':>14}{'erreur':>10}")
+    for distinct in args.distinct:
+        sketch = HyperLogLog()
+        for _ in range(distinct):
+            sketch.add(rng.getrandbits(63))
+        estimate = sketch.estimate()
+        print(f"{distinct:>14}{estimate:>14}{(estimate / distinct - 1) * 100:>+9.2f}%")
+
+
+def measure_snapshots(args, rng) -> None:
+    questionnaires = registry.all_questionnaires()
+    samples = {questionnaire.id: sample_responses(rng, questionnaire, 64) for questionnaire in questionnaires}
+    with tempfile.TemporaryDirectory() as directory:
+        processes = [Population(questionnaires, directory, str(index)) for index in range(args.processes)]
+        for index, population in enumerate(processes):
+            for count in range(2000):
+                questionnaire = questionnaires[count % len(questionnaires)]
+                population.record(index * 10_000 + count, questionnaire.id, samples[questionnaire.id][count & 63])
+            population.snapshot()
+
+        population = processes[0]
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            population.snapshot()
+        elapsed = (time.perf_counter() - started) / args.rounds
+        size = os.path.getsize(population.path)
+        total = sum(test['count'] for test in population.distributions().values())
+        print(f"\ninstantané + relecture de {args.processes} processus : {elapsed * 1000:.1f} ms, "
+              f"{size / 1024:.0f} Kio par processus, {total} résultats dans la vue fusionnée")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--results', type=int, default=200_000)
+    parser.add_argument('--distinct', type=lambda text: [int(value) for value in text.split(',')],
+                        default=[1_000, 10_000, 100_000, 1_000_000],
+                        help="effectifs d'utilisateurs distincts, séparés par des virgules")
+    parser.add_argument('--processes', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    measure_results(args, rng)
+    measure_hll(args, rng)
+    measure_snapshots(args, rng)
+
+
+if __name__ == '__main__':
+    main()
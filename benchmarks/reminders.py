@@ -0,0 +1,178 @@
+"""Rappels de dépistage : programmation, envoi, mémoire, redémarrage.
+
+Mesure, sur une base SQLite temporaire (voir ``bot/reminders.py``) :
+
+- la programmation de ``--reminders`` rappels par lots (import, migration)
+  puis un à un, comme les clics « Me le rappeler » (une transaction par
+  rappel) ;
+- la mémoire du tas d'une fenêtre pleine (``--max-heap`` rappels) comparée
+  à une minuterie asyncio par rappel (``loop.call_at``), extrapolée à
+  ``--reminders`` ;
+- l'envoi de ``--due`` rappels échus, avec un ``send`` qui ne fait rien et
+  sans limite de débit : coût du tas, des réclamations et de la boucle ;
+- deux ordonnanceurs sur la même base, dont l'un est arrêté en cours de
+  route puis relancé : aucun rappel n'est envoyé deux fois, et seuls ceux
+  réclamés au moment de l'arrêt sont perdus.
+
+Usage :
+    python -m benchmarks.reminders --reminders 1000000 --due 100000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+from bot.reminders import Reminder, ReminderScheduler, ReminderStore
+
+TESTS = ('depression', 'anxiety')
+
+
+def reminders_between(count: int, start: float, end: float, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [Reminder(rng.uniform(start, end), user_id, TESTS[user_id % 2], 'fr') for user_id in range(count)]
+
+
+def bench_schedule(directory: str, count: int, singles: int) -> str:
+    path = os.path.join(directory, 'schedule.db')
+    store = ReminderStore(path)
+    now = time.time()
+    rows = reminders_between(count, now, now + 14 * 86400)
+    started = time.perf_counter()
+    for i in range(0, count, 10_000):
+        store.schedule(rows[i:i + 10_000])
+    elapsed = time.perf_counter() - started
+    print(f"{'programmation par lots':<34}{count / elapsed:>12,.0f} rappels/s ({count:,} en {elapsed:.1f} s)")
+
+    scheduler = ReminderScheduler(store)
+
+    async def schedule_singles():
+        for user_id in range(count, count + singles):
+            await scheduler.schedule(user_id, 'depression', now + 14 * 86400, 'fr')
+
+    started = time.perf_counter()
+    asyncio.run(schedule_singles())
+    elapsed = time.perf_counter() - started
+    print(f"{'programmation un par un':<34}{singles / elapsed:>12,.0f} rappels/s")
+    print(f"{'base':<34}{os.path.getsize(path) / 2**20:>12,.1f} Mio pour {store.count():,} rappels")
+    store.close()
+    return path
+
+
+def bench_memory(path: str, count: int, max_heap: int) -> None:
+    scheduler = ReminderScheduler(ReminderStore(path), window=14 * 86400, max_heap=max_heap)
+    tracemalloc.start()
+    started = time.perf_counter()
+    loaded = scheduler.load()
+    elapsed = time.perf_counter() - started
+    heap_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    scheduler.close()
+    print(f"{'chargement de la fenêtre':<34}{loaded / elapsed:>12,.0f} rappels/s ({loaded:,} rappels)")
+
+    # Une minuterie par rappel, mesurée sur un échantillon
+    sample = min(count, 100_000)
+    loop = asyncio.new_event_loop()
+    now = loop.time()
+    tracemalloc.start()
+    timers = [loop.call_at(now + 86400 + i, print, i) for i in range(sample)]
+    timer_bytes = tracemalloc.get_traced_memory()[0] / sample * count
+    tracemalloc.stop()
+    for timer in timers:
+        timer.cancel()
+    loop.close()
+    print(f"{'mémoire, tas de la fenêtre':<34}{heap_bytes / 2**20:>12,.1f} Mio ({loaded:,} rappels, borné)")
+    print(f"{'mémoire, minuteries call_at':<34}{timer_bytes / 2**20:>12,.1f} Mio ({count:,} rappels, extrapolé)")
+
+
+async def run_until(scheduler: ReminderScheduler, send, target: int, stop_after: int = None) -> None:
+    task = asyncio.create_task(scheduler.run(send))
+    while scheduler.sent < (stop_after or target) and not task.done():
+        await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def bench_fire(directory: str, count: int, batch_size: int) -> None:
+    path = os.path.join(directory, 'fire.db')
+    store = ReminderStore(path)
+    store.schedule(reminders_between(count, time.time() - 86400, time.time()))
+
+    async def send(reminder):
+        pass
+
+    scheduler = ReminderScheduler(store, max_heap=count, batch_size=batch_size, rate=float('inf'))
+    started = time.perf_counter()
+    asyncio.run(run_until(scheduler, send, count))
+    elapsed = time.perf_counter() - started
+    print(f"{'envoi des rappels échus':<34}{scheduler.sent / elapsed:>12,.0f} rappels/s "
+          f"({scheduler.sent:,} en {elapsed:.1f} s, lots de {batch_size})")
+    scheduler.close()
+
+
+def check_restart(directory: str, count: int, batch_size: int) -> bool:
+    path = os.path.join(directory, 'restart.db')
+    ReminderStore(path).schedule(reminders_between(count, time.time() - 3600, time.time()))
+    sent = Counter()
+
+    async def send(reminder):
+        await asyncio.sleep(0)
+        sent[reminder.user_id, reminder.test_id] += 1
+
+    def scheduler():
+        return ReminderScheduler(ReminderStore(path), max_heap=count // 4, batch_size=batch_size, rate=float('inf'))
+
+    async def scenario():
+        # Deux processus sur la même base ; le premier s'arrête en cours de route puis redémarre
+        first, second = scheduler(), scheduler()
+        running = [asyncio.create_task(second.run(send))]
+        stopped = asyncio.create_task(first.run(send))
+        while first.sent < count // 4:
+            await asyncio.sleep(0.01)
+        stopped.cancel()
+        await asyncio.gather(stopped, return_exceptions=True)
+        first.close()
+        restarted = scheduler()
+        running.append(asyncio.create_task(restarted.run(send)))
+        while second.store.count():
+            await asyncio.sleep(0.05)
+        # Derniers envois après la dernière réclamation
+        await asyncio.sleep(0.2)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        second.close()
+        restarted.close()
+
+    asyncio.run(scenario())
+    duplicates = sum(1 for times in sent.values() if times > 1)
+    lost = count - len(sent)
+    ok = duplicates == 0 and lost <= batch_size
+    print(f"{'redémarrage, deux processus':<34}{len(sent):>12,} envoyés, {duplicates} en double, "
+          f"{lost} perdus à l'arrêt : {'OK' if ok else 'ÉCHEC'}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reminders', type=int, default=1_000_000)
+    parser.add_argument('--singles', type=int, default=2_000, help="rappels programmés un par un")
+    parser.add_argument('--max-heap', type=int, default=100_000)
+    parser.add_argument('--due', type=int, default=100_000, help="rappels échus envoyés")
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = bench_schedule(directory, args.reminders, args.singles)
+        bench_memory(path, args.reminders, args.max_heap)
+        bench_fire(directory, args.due, args.batch_size)
+        if not check_restart(directory, min(args.due, 20_000), args.batch_size):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
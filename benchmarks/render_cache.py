@@ -0,0 +1,78 @@
+"""Micro-benchmark du rendu des questions : reconstruction vs cache.
+
+Compare, pour chaque mise à jour, le coût CPU de la construction du texte et
+du clavier d'une question (ancien ``send_question``) avec une lecture dans
+le cache de ``bot.render.views``.
+
+Usage :
+    python -m benchmarks.render_cache --iterations 200000
+"""
+
+import argparse
+import time
+
+from bot.render import question_keyboard, views
+from psy import registry
+
+
+def build_main_menu():
+    """Reconstruit le menu principal comme le faisaient ``start`` et ``show_main_menu``."""
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("🧠 Test MBTI", callback_data='mbti'),
+            InlineKeyboardButton("🌊 Big Five", callback_data='big_five'),
+        ],
+        [
+            InlineKeyboardButton("😔 Test Dépression", callback_data='depression'),
+            InlineKeyboardButton("😰 Test Anxiété", callback_data='anxiety'),
+        ],
+        [
+            InlineKeyboardButton("ℹ Aide", callback_data='help'),
+        ]
+    ])
+
+
+def bench(label: str, func, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    per_call = (time.perf_counter() - start) / iterations * 1e6
+    print(f"{label:<32}{per_call:>10.2f} µs/appel")
+    return per_call
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    rendered = views()
+    keys = [
+        (questionnaire, question_index)
+        for questionnaire in registry.all_questionnaires()
+        for question_index in range(len(questionnaire.questions))
+    ]
+    n = len(keys)
+
+    def rebuild(i):
+        questionnaire, question_index = keys[i % n]
+        question_text, options = questionnaire.questions[question_index]
+        text = f"*Question {question_index + 1}/{len(questionnaire.questions)}*:\n\n{question_text}"
+        return text, question_keyboard(questionnaire.id, question_index, options, rendered.cancel_button)
+
+    def cached(i):
+        return rendered.question(*keys[i % n])
+
+    print(f"{n} questions en cache, {args.iterations} itérations\n")
+    before = bench("question (reconstruction)", rebuild, args.iterations)
+    after = bench("question (cache)", cached, args.iterations)
+    print(f"{'gain':<32}{before - after:>10.2f} µs/mise à jour\n")
+
+    before = bench("menu principal (reconstruction)", lambda i: build_main_menu(), args.iterations)
+    after = bench("menu principal (cache)", lambda i: views().main_menu, args.iterations)
+    print(f"{'gain':<32}{before - after:>10.2f} µs/mise à jour")
+
+
+if __name__ == '__main__':
+    main()
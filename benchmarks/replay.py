@@ -0,0 +1,237 @@
+"""Rejoue un journal de mises à jour enregistré (``bot/recorder.py``).
+
+L'application est construite par ``main.build_application`` (comme en
+production) contre le faux serveur Telegram (``benchmarks.fake_telegram``),
+et les mises à jour du journal sont mises dans sa file :
+
+- à la vitesse d'origine (``--speed 1``), N fois plus vite (``--speed N``)
+  ou sans attendre (``--speed 0``, par défaut) ;
+- traitées une à une dans l'ordre du journal, ou en parallèle comme en
+  production avec ``--concurrent-updates N`` : celles d'un même
+  utilisateur restent alors dans l'ordre (``PerUserUpdateProcessor``),
+  mais chaque handler attend aussi les autres, ce qui rend ses durées
+  moins stables d'un rejeu à l'autre.
+
+Les sessions de chaque utilisateur ne dépendent que de ses propres mises
+à jour : l'état final de ``user_states`` est le même d'un rejeu à l'autre,
+à toute vitesse. L'expiration des sessions inactives, qui dépend de
+l'horloge, est désactivée, comme les limites d'envoi, les rappels,
+l'historique et les journaux.
+
+Le rapport donne p50/p95/p99 par handler (``benchmarks.load_test``), la
+durée de traitement d'une mise à jour et son attente dans la file, le
+débit et les appels à l'API, et peut être enregistré en JSON
+(``--output``), avec les sessions finales. ``--compare`` le compare à un
+rapport de référence : le programme sort avec le code 1 si les sessions
+finales diffèrent, ou si le p95 d'un handler dépasse celui de la référence
+de plus de ``--max-regression`` pour cent.
+
+Usage :
+    python -m benchmarks.replay updates/*.ndjson.gz --output reference.json
+    python -m benchmarks.replay updates/*.ndjson.gz --compare reference.json --max-regression 25
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+
+from benchmarks.fake_telegram import FakeTelegramAPI
+from benchmarks.load_test import HANDLERS, git_commit, instrument, peak_rss_mib, summarize
+from bot.recorder import read_log
+
+# Configuration du rejeu : rien qui dépende de l'horloge ou écrive sur disque
+REPLAY_ENVIRONMENT = {
+    'OUTBOUND_SCHEDULER': '0', 'SESSION_STORE': 'memory', 'SESSION_IDLE_TIMEOUT': '0',
+    'STATELESS_SESSIONS': '0', 'REMINDERS': '0', 'HISTORY_DB_PATH': '', 'HISTORY_EXPORT_PORT': '',
+    'RESULT_LOG_DIR': '', 'POPULATION_DIR': '', 'UPDATE_LOG_DIR': '', 'METRICS_PORT': '',
+}
+
+
+def time_updates(application, namespace: int, queued: dict, timings: dict) -> None:
+    """Chronomètre l'attente (file, utilisateur occupé) et le traitement de chaque mise à jour."""
+    original = application.process_update
+
+    async def process_update(update):
+        started = time.perf_counter()
+        timings['wait'].append(started - queued.pop((namespace, update.update_id), started))
+        try:
+            return await original(update)
+        finally:
+            timings['update'].append(time.perf_counter() - started)
+
+    application.process_update = process_update
+
+
+def final_sessions(user_states) -> dict:
+    """Sessions ouvertes à la fin du rejeu, par clé, dans un ordre stable."""
+    return {str(key): user_states[key].to_dict() for key in sorted(user_states)}
+
+
+def fingerprint(sessions: dict) -> str:
+    return hashlib.sha256(json.dumps(sessions, sort_keys=True).encode()).hexdigest()
+
+
+async def feed(applications: dict, entries, speed: float, queued: dict) -> int:
+    """Met les mises à jour du journal dans la file de leur bot ; retourne leur nombre."""
+    from telegram import Update
+
+    count = 0
+    origin = None
+    started = time.perf_counter()
+    for offset, namespace, data in entries:
+        if speed:
+            origin = offset if origin is None else origin
+            delay = (offset - origin) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        application = applications.get(namespace)
+        if application is None:
+            continue
+        update = Update.de_json(data, application.bot)
+        queued[namespace, update.update_id] = time.perf_counter()
+        await application.update_queue.put(update)
+        count += 1
+        if not speed and count % 1000 == 0:
+            # Laisse les handlers avancer pendant la lecture du journal
+            await asyncio.sleep(0)
+    return count
+
+
+async def run(args) -> dict:
+    os.environ.update(REPLAY_ENVIRONMENT)
+    api = FakeTelegramAPI(latency=args.api_latency)
+    await api.start()
+    os.environ['TELEGRAM_API_URL'] = api.base_url
+
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+    timings = defaultdict(list)
+    instrument(main, timings)
+    namespaces = sorted({namespace for _, namespace, _ in read_log(args.logs)} | {0})
+    applications = {
+        namespace: main.build_application(f'{namespace + 1}:replay', concurrent_updates=args.concurrent_updates,
+                                          namespace=namespace)
+        for namespace in namespaces
+    }
+    queued = {}
+    for namespace, application in applications.items():
+        time_updates(application, namespace, queued, timings)
+
+    for application in applications.values():
+        await application.initialize()
+        await application.start()
+    started = time.perf_counter()
+    count = await feed(applications, read_log(args.logs), args.speed, queued)
+    # stop() n'attend pas les mises à jour encore en file quand elles sont traitées en parallèle
+    while len(timings['update']) < count:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    for application in applications.values():
+        await application.stop()
+    sessions = final_sessions(main.user_states)
+    for application in applications.values():
+        await application.shutdown()
+    await api.stop()
+
+    return {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': {
+            'logs': args.logs, 'updates': count, 'speed': args.speed,
+            'concurrent_updates': args.concurrent_updates, 'api_latency': args.api_latency,
+        },
+        'elapsed_s': elapsed,
+        'updates_per_s': count / elapsed,
+        'peak_rss_mib': peak_rss_mib(),
+        'api_calls': dict(sorted(api.calls.items())),
+        'update': summarize(timings['update']),
+        'wait': summarize(timings['wait']),
+        'handlers': {name: summarize(timings[name]) for name in HANDLERS if timings[name]},
+        'sessions_fingerprint': fingerprint(sessions),
+        'sessions': sessions,
+    }
+
+
+def report(result: dict, baseline: dict = None, max_regression: float = None) -> bool:
+    """Affiche le rapport ; retourne ``False`` si le rejeu s'écarte de ``baseline``."""
+    parameters = result['parameters']
+    speed = f"× {parameters['speed']:g}" if parameters['speed'] else "sans attente"
+    print(f"commit {result['commit']} : {parameters['updates']} mises à jour, vitesse {speed}, "
+          f"latence API {parameters['api_latency'] * 1000:.0f} ms")
+    print(f"débit {result['updates_per_s']:.0f} mises à jour/s en {result['elapsed_s']:.1f} s, "
+          f"pic RSS {result['peak_rss_mib']:.1f} Mio, sessions ouvertes {len(result['sessions'])}\n")
+
+    rows = [('traitement d\'une mise à jour', result['update'], baseline and baseline['update']),
+            ('attente dans la file', result['wait'], None)]
+    rows += [(name, stats, baseline and baseline['handlers'].get(name)) for name, stats in result['handlers'].items()]
+    print(f"{'':<30}{'nombre':>8}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}"
+          + (f"{'Δ p95':>10}" if baseline else ''))
+    regressions = []
+    for name, stats, previous in rows:
+        line = (f"{name:<30}{stats['count']:>8}{stats['p50_ms']:>10.2f}"
+                f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+        if previous and previous['p95_ms']:
+            change = (stats['p95_ms'] / previous['p95_ms'] - 1) * 100
+            line += f"{change:>+9.0f}%"
+            if max_regression is not None and change > max_regression and name in result['handlers']:
+                regressions.append(name)
+        print(line)
+    if baseline is None:
+        return True
+
+    print(f"\ndébit par rapport à {baseline['commit']} : "
+          f"{(result['updates_per_s'] / baseline['updates_per_s'] - 1) * 100:+.0f} %")
+    calls = sorted(set(result['api_calls']) | set(baseline['api_calls']))
+    changed = [f"{method} {baseline['api_calls'].get(method, 0)} → {result['api_calls'].get(method, 0)}"
+               for method in calls if result['api_calls'].get(method) != baseline['api_calls'].get(method)]
+    if changed:
+        print("appels à l'API modifiés : " + ', '.join(changed))
+    ok = not regressions
+    if regressions:
+        print(f"p95 au-delà de +{max_regression:g} % : {', '.join(regressions)}")
+    if result['sessions_fingerprint'] != baseline['sessions_fingerprint']:
+        ok = False
+        keys = set(result['sessions']) | set(baseline['sessions'])
+        different = sorted(key for key in keys if result['sessions'].get(key) != baseline['sessions'].get(key))
+        print(f"sessions finales différentes pour {len(different)} utilisateurs, par exemple : "
+              + ', '.join(different[:5]))
+    else:
+        print(f"sessions finales identiques ({len(result['sessions'])})")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='+', help="journaux *.ndjson.gz, rejoués dans l'ordre")
+    parser.add_argument('--speed', type=float, default=0.0, help="1 : vitesse d'origine, N : N fois plus vite, "
+                                                                  "0 : sans attendre")
+    parser.add_argument('--concurrent-updates', type=int, default=0, help="0 : une mise à jour à la fois")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="latence simulée de l'API (s)")
+    parser.add_argument('--output', help="enregistre le rapport JSON")
+    parser.add_argument('--compare', help="rapport JSON de référence")
+    parser.add_argument('--max-regression', type=float, help="hausse maximale du p95 d'un handler (%%)")
+    args = parser.parse_args()
+    args.logs = [path for pattern in args.logs for path in sorted(glob.glob(pattern)) or [pattern]]
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+    ok = report(result, baseline, args.max_regression)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(result, handle, indent=2, ensure_ascii=False)
+        print(f"\nrapport enregistré dans {args.output}")
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
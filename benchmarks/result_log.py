@@ -0,0 +1,151 @@
+"""Coût du journal des résultats à l'écriture et à la lecture.
+
+Trois mesures :
+
+- ``ResultLog.record`` sur le chemin des résultats (thread d'écriture
+  actif), en nanosecondes par appel ;
+- le débit du thread d'écriture (calcul des scores, pseudonymisation,
+  écriture) ;
+- la lecture : un journal synthétique de ``--records`` enregistrements
+  (réponses tirées au hasard, scores calculés par ``psy``) est agrégé par
+  ``bot.results.summarize`` via ``np.memmap``, puis, pour comparaison, un
+  échantillon de ``--python-records`` est décodé en tuples Python avec
+  ``struct.iter_unpack``.
+
+Usage :
+    python -m benchmarks.result_log --records 20000000
+"""
+
+import argparse
+import os
+import random
+import resource
+import struct
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from bot import results
+from psy import registry
+
+
+def thousands(value: float) -> str:
+    return f'{value:,.0f}'.replace(',', ' ')
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss est en Kio sous Linux, en octets sous macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def measure_record(directory: str, calls: int, seed: int) -> None:
+    rng = random.Random(seed)
+    questionnaires = registry.all_questionnaires()
+    log = results.ResultLog(directory, b'benchmark', questionnaires, flush_interval=0.05)
+    samples = []
+    for _ in range(1024):
+        questionnaire = rng.choice(questionnaires)
+        samples.append((questionnaire.id, bytearray(rng.randrange(len(options)) for _, options in questionnaire.questions)))
+
+    started = time.perf_counter()
+    for index in range(calls):
+        test_id, responses = samples[index & 1023]
+        log.record(index, test_id, responses)
+    elapsed = time.perf_counter() - started
+    flushing = time.perf_counter()
+    log.close()
+    flushed = time.perf_counter() - flushing
+    print(f"record : {elapsed / calls * 1e9:.0f} ns/appel ({calls} appels, thread d'écriture actif)")
+    print(f"écriture : {log.written} enregistrements de {log.record_size} octets, "
+          f"dernier lot vidé en {flushed * 1000:.0f} ms")
+
+
+def write_synthetic(path: str, records: int, seed: int, chunk_size: int = 1_000_000) -> None:
+    """Journal de ``records`` résultats, écrit bloc par bloc sans passer par ``record``."""
+    generator = np.random.default_rng(seed)
+    questionnaires = [questionnaire for questionnaire in registry.all_questionnaires() if questionnaire.score]
+    header = results.describe(questionnaires)
+    dtype = results.record_dtype(header['answer_slots'], header['score_slots'])
+    with open(path, 'wb') as handle:
+        handle.write(results.encode_header(header))
+        for start in range(0, records, chunk_size):
+            count = min(chunk_size, records - start)
+            chunk = np.zeros(count, dtype=dtype)
+            chunk['user'] = generator.integers(0, 2**63, size=count, dtype=np.uint64) % max(1, records // 3)
+            chunk['time'] = 1_700_000_000 + np.sort(generator.integers(0, 86_400 * 365, size=count))
+            tests = generator.integers(0, len(questionnaires), size=count)
+            for code, questionnaire in enumerate(questionnaires):
+                rows = np.flatnonzero(tests == code)
+                counts = [len(options) for _, options in questionnaire.questions]
+                answers = generator.integers(0, counts, size=(len(rows), len(counts)), dtype=np.int16)
+                chunk['test'][rows] = code
+                chunk['count'][rows] = len(counts)
+                chunk['answers'][rows, :len(counts)] = answers
+                for column, values in enumerate(questionnaire.score(answers).values()):
+                    chunk['scores'][rows, column] = values
+            handle.write(chunk.tobytes())
+
+
+def python_decode(path: str, records: int) -> float:
+    """Agrégat équivalent (moyenne par test) en décodant chaque enregistrement en tuple."""
+    header, mapped = results.open_log(path)
+    size = mapped.dtype.itemsize
+    offset = os.path.getsize(path) - len(mapped) * size
+    fields = f"<QIBB{header['score_slots']}f{header['answer_slots']}B"
+    layout = struct.Struct(f"{fields}{size - struct.calcsize(fields)}x")
+    del mapped
+    started = time.perf_counter()
+    sums = defaultdict(float)
+    counts = defaultdict(int)
+    with open(path, 'rb') as handle:
+        handle.seek(offset)
+        data = handle.read(records * size)
+    for record in layout.iter_unpack(data):
+        sums[record[2]] += record[4]
+        counts[record[2]] += 1
+    return time.perf_counter() - started
+
+
+def run(args) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        measure_record(os.path.join(directory, 'record'), args.calls, args.seed)
+
+        path = os.path.join(directory, 'synthetique.rlog')
+        started = time.perf_counter()
+        write_synthetic(path, args.records, args.seed)
+        print(f"\njournal synthétique : {args.records} enregistrements, "
+              f"{os.path.getsize(path) / 2**20:.0f} Mio, écrit en {time.perf_counter() - started:.1f} s")
+
+        rss_before = peak_rss_mib()
+        started = time.perf_counter()
+        summary = results.summarize([path])
+        elapsed = time.perf_counter() - started
+        # Le pic RSS compte aussi les pages du fichier projetées par memmap, libérables par le noyau
+        print(f"summarize (memmap) : {elapsed:.2f} s, {thousands(args.records / elapsed)} enregistrements/s, "
+              f"pic RSS +{max(0.0, peak_rss_mib() - rss_before):.0f} Mio (pages du fichier comprises)")
+        for test_id, test in summary.items():
+            print(f"  {test_id:<12}{test['count']:>12} résultats{test['users']:>12} utilisateurs")
+
+        sample = min(args.python_records, args.records)
+        elapsed = python_decode(path, sample)
+        print(f"struct.iter_unpack (tuples Python, {sample} enregistrements) : "
+              f"{thousands(sample / elapsed)} enregistrements/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500_000, help="appels à record mesurés")
+    parser.add_argument('--records', type=int, default=20_000_000, help="taille du journal synthétique")
+    parser.add_argument('--python-records', type=int, default=1_000_000,
+                        help="enregistrements décodés en tuples Python, pour comparaison")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Temps de bout en bout d'un PHQ-9 complet selon le nombre d'allers-retours API.
+
+Les handlers réels de ``main.py`` traitent la commande ``/depression`` puis
+neuf clics, face à un faux serveur Telegram dont chaque réponse est retardée
+de ``--api-latency``. On compare le mode historique (réponse au callback puis
+modification, résultats puis message de suite) au mode ``LOW_ROUND_TRIP``.
+
+Le rate limiter est désactivé pour ne mesurer que les allers-retours réseau.
+
+Usage :
+    python -m benchmarks.round_trips --runs 20 --api-latency 0.05
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from benchmarks.fake_telegram import FakeTelegramAPI, UpdateFactory, percentile
+
+
+async def complete_run(application, factory, user_id) -> None:
+    from telegram import Update
+
+    await application.process_update(Update.de_json(factory.command(user_id, '/depression'), application.bot))
+    for question_index in range(9):
+        data = f'1:a:depression:{question_index}:{question_index % 4}'
+        await application.process_update(Update.de_json(factory.callback(user_id, data), application.bot))
+
+
+async def run_mode(label: str, low_round_trip: bool, args, api) -> None:
+    import main
+
+    main.LOW_ROUND_TRIP = low_round_trip
+    application = main.build_application('123456:roundtrips')
+    # Identifiants distincts par mode : le bot ignore les callbacks déjà vus
+    factory = UpdateFactory(start_id=1 if low_round_trip else 1_000_000)
+    durations = []
+    calls_before = sum(api.calls.values())
+    async with application:
+        for index in range(args.runs):
+            started = time.perf_counter()
+            await complete_run(application, factory, 40_000 + index)
+            durations.append(time.perf_counter() - started)
+    calls = sum(api.calls.values()) - calls_before - 1  # getMe à l'initialisation
+    durations.sort()
+    print(f"{label:<26}{percentile(durations, 50) * 1000:>10.0f}{percentile(durations, 95) * 1000:>10.0f}"
+          f"{calls / args.runs:>14.1f}")
+
+
+async def run(args) -> None:
+    api = FakeTelegramAPI(latency=args.api_latency)
+    await api.start()
+    os.environ['TELEGRAM_API_URL'] = api.base_url
+    os.environ['OUTBOUND_SCHEDULER'] = '0'
+    import main  # noqa: F401  (configure le logging)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"latence API simulée : {args.api_latency * 1000:.0f} ms, {args.runs} PHQ-9 complets par mode\n")
+    print(f"{'mode':<26}{'p50 (ms)':>10}{'p95 (ms)':>10}{'appels/test':>14}")
+    try:
+        await run_mode("historique", False, args, api)
+        await run_mode("LOW_ROUND_TRIP", True, args, api)
+    finally:
+        await api.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--api-latency', type=float, default=0.05, help="latence simulée de l'API (s)")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Coût des plans de calcul compilés selon la taille du questionnaire.
+
+On génère des définitions synthétiques au format de ``psy/definitions`` :
+une banque de type BFI (44 questions, 5 traits, 5 options, un tiers des
+questions inversées) et une banque de type MBTI (70 questions, 4
+dimensions, 2 options), à côté des définitions livrées avec le bot. Pour
+chacune, on mesure :
+
+- le chargement à froid (lecture du JSON, compilation, écriture du cache)
+  et à chaud (plan relu depuis le cache ``marshal``) ;
+- le débit de ``ScoringPlan.score`` sur ``--rows`` lignes de réponses.
+
+Usage :
+    python -m benchmarks.scoring_plans --rows 1000000
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from psy import plans
+
+LIKERT = ["Fortement en désaccord", "En désaccord", "Neutre", "D'accord", "Fortement d'accord"]
+
+
+def bfi_definition(rng: random.Random, item_count: int = 44) -> dict:
+    traits = ['extraversion', 'agreeableness', 'conscientiousness', 'neuroticism', 'openness']
+    return {
+        'id': 'bfi_synthetique', 'label': 'BFI synthétique',
+        'option_sets': {'accord': LIKERT},
+        'subscales': [{'id': trait, 'label': trait} for trait in traits],
+        'items': [
+            {'text': f'Question {index + 1}', 'options': 'accord', 'subscale': traits[index % len(traits)],
+             'reverse': rng.random() < 1 / 3}
+            for index in range(item_count)
+        ],
+    }
+
+
+def mbti_definition(rng: random.Random, item_count: int = 70) -> dict:
+    dimensions = [('EI', 'E', 'I'), ('SN', 'S', 'N'), ('TF', 'T', 'F'), ('JP', 'J', 'P')]
+    return {
+        'id': 'mbti_synthetique', 'label': 'MBTI synthétique',
+        'subscales': [{'id': name, 'poles': [first, second]} for name, first, second in dimensions],
+        'items': [
+            # Dimension tirée au hasard : le plan ne dépend pas de l'ordre des questions
+            {'text': f'Question {index + 1}', 'options': ['A', 'B'], 'subscale': rng.choice(dimensions)[0],
+             'reverse': rng.random() < 0.5}
+            for index in range(item_count)
+        ],
+    }
+
+
+def timed_load(name: str, directory: Path, cache_directory: Path, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        plans.load(name, directory, cache_directory)
+    return (time.perf_counter() - started) / repeat
+
+
+def run(args) -> None:
+    rng = random.Random(args.seed)
+    generator = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = Path(temporary) / 'definitions'
+        directory.mkdir()
+        names = []
+        for source in plans.DEFINITIONS_DIR.glob('*.json'):
+            (directory / source.name).write_bytes(source.read_bytes())
+            names.append(source.stem)
+        for definition in (bfi_definition(rng), mbti_definition(rng)):
+            (directory / f"{definition['id']}.json").write_text(json.dumps(definition, ensure_ascii=False))
+            names.append(definition['id'])
+
+        print(f"{args.rows} lignes par questionnaire\n")
+        print(f"{'questionnaire':<20}{'questions':>10}{'à froid (µs)':>14}{'à chaud (µs)':>14}"
+              f"{'lignes/s':>14}{'ns/réponse':>12}")
+        for name in sorted(names):
+            cold = 0.0
+            for attempt in range(args.repeat):
+                cache_directory = Path(temporary) / f'froid-{name}-{attempt}'
+                cold += timed_load(name, directory, cache_directory, 1)
+            cold /= args.repeat
+            warm = timed_load(name, directory, cache_directory, args.repeat)
+
+            definition = plans.load(name, directory, cache_directory)
+            counts = definition.plan.option_counts
+            matrix = generator.integers(0, counts, size=(args.rows, len(counts)), dtype=np.int16)
+            started = time.perf_counter()
+            definition.plan.score(matrix)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<20}{len(counts):>10}{cold * 1e6:>14.0f}{warm * 1e6:>14.0f}"
+                  f"{args.rows / elapsed:>14,.0f}{elapsed / matrix.size * 1e9:>12.2f}".replace(',', ' '))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=50, help="chargements mesurés par questionnaire")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
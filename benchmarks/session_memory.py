@@ -0,0 +1,119 @@
+"""Mémoire des sessions : ancien dictionnaire à quatre clés contre ``Session``.
+
+On crée ``--sessions`` sessions simultanées (tests en cours, à une question
+tirée au hasard), d'abord avec l'ancienne représentation (``dict`` avec
+``current_test``, ``current_question``, ``responses`` en liste et
+``test_started``), puis avec ``Session`` (``__slots__`` et réponses dans un
+``bytearray``). ``tracemalloc`` mesure les octets par session ; on rejoue
+ensuite la mise à jour de session de ``handle_answer`` sur toutes les
+sessions et on relève les blocs et octets alloués par réponse.
+
+Usage :
+    python -m benchmarks.session_memory --sessions 1000000
+"""
+
+import argparse
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from bot.sessions import Session
+
+TESTS = (('mbti', 4), ('big_five', 5), ('depression', 9), ('anxiety', 7))
+
+
+def dict_session(test_id: str, responses: list) -> dict:
+    return {
+        'current_test': test_id,
+        'current_question': len(responses),
+        'responses': list(responses),
+        'test_started': True
+    }
+
+
+def dict_answer(user_states: dict, user_id: int, answer: int) -> None:
+    """Mise à jour de session de ``handle_answer`` avant ``Session``."""
+    if user_id not in user_states or not user_states[user_id]['test_started']:
+        return
+    user_state = user_states[user_id]
+    user_state['responses'].append(answer)
+    user_state['current_question'] += 1
+    user_states[user_id] = user_state
+
+
+def slots_answer(user_states: dict, user_id: int, answer: int) -> None:
+    """Mise à jour de session de ``handle_answer`` avec ``Session``."""
+    user_state = user_states.get(user_id)
+    if user_state is None:
+        return
+    user_state.answer(answer)
+    user_states[user_id] = user_state
+
+
+LAYOUTS = (
+    ('dict (historique)', dict_session, dict_answer),
+    ('Session (__slots__)', Session, slots_answer),
+)
+
+
+def population(count: int, seed: int) -> list:
+    """(test, réponses déjà données) de chaque session simulée."""
+    rng = random.Random(seed)
+    sessions = []
+    for _ in range(count):
+        test_id, question_count = TESTS[rng.randrange(len(TESTS))]
+        sessions.append((test_id, [rng.randrange(2) for _ in range(rng.randrange(question_count))]))
+    return sessions
+
+
+def measure(label: str, make_session, answer, sessions: list) -> None:
+    """Octets par session, puis coût d'une réponse sur chaque session."""
+    gc.collect()
+    tracemalloc.start()
+    user_states = {}
+    base = tracemalloc.get_traced_memory()[0]
+    for user_id, (test_id, responses) in enumerate(sessions):
+        user_states[user_id] = make_session(test_id, responses)
+    created = tracemalloc.get_traced_memory()[0]
+    # Le dictionnaire des sessions (clés et table) est commun aux deux représentations
+    table = sys.getsizeof(user_states) + sum(sys.getsizeof(user_id) for user_id in user_states)
+    per_session = (created - base - table) / len(sessions)
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for user_id in range(len(sessions)):
+        answer(user_states, user_id, user_id & 1)
+    elapsed = time.perf_counter() - started
+    blocks = (sys.getallocatedblocks() - blocks_before) / len(sessions)
+    grown = (tracemalloc.get_traced_memory()[0] - memory_before) / len(sessions)
+    tracemalloc.stop()
+
+    print(f"{label:<22}{per_session:>14.1f}{per_session * len(sessions) / 2**20:>12.1f}"
+          f"{blocks:>14.3f}{grown:>14.1f}{elapsed / len(sessions) * 1e9:>12.0f}")
+    del user_states
+    gc.collect()
+
+
+def run(args) -> None:
+    sessions = population(args.sessions, args.seed)
+    print(f"{args.sessions} sessions simultanées\n")
+    print(f"{'représentation':<22}{'octets/session':>14}{'total (Mio)':>12}"
+          f"{'blocs/réponse':>14}{'octets/rép.':>14}{'ns/réponse':>12}")
+    for label, make_session, answer in LAYOUTS:
+        measure(label, make_session, answer, sessions)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Endurance du store de sessions en mémoire face aux tests abandonnés.
+
+Des utilisateurs virtuels démarrent un test, répondent à quelques
+questions puis disparaissent sans terminer ni annuler, comme la plupart des
+utilisateurs d'un bot très fréquenté. On suit la mémoire du processus (RSS)
+au fil des sessions abandonnées :
+
+- store non borné (comportement historique) : la mémoire croît avec le
+  nombre de sessions ;
+- store borné (``SESSION_IDLE_TIMEOUT`` court et ``SESSION_MAX_ENTRIES``) :
+  la mémoire reste stable.
+
+Usage :
+    python -m benchmarks.session_soak --sessions 2000000 --rate 100000
+"""
+
+import argparse
+import gc
+import os
+import random
+import resource
+import time
+
+from bot.sessions import MemorySessionStore, Session
+
+TESTS = (('mbti', 4), ('big_five', 5), ('depression', 9), ('anxiety', 7))
+
+
+def rss_mib() -> float:
+    """Mémoire résidente actuelle du processus (Mio)."""
+    try:
+        with open('/proc/self/statm') as handle:
+            pages = int(handle.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        # Hors Linux : pic de mémoire seulement
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def abandon(store, rng, user_id) -> None:
+    """Démarre un test, répond à quelques questions et ne revient jamais."""
+    test_id, question_count = TESTS[rng.randrange(len(TESTS))]
+    store[user_id] = Session(test_id)
+    for _ in range(rng.randrange(question_count)):
+        state = store[user_id]
+        state.answer(rng.randrange(2))
+        store[user_id] = state
+
+
+def soak(label: str, store, sessions: int, rate: float, samples: int, seed: int) -> None:
+    rng = random.Random(seed)
+    gc.collect()
+    baseline = rss_mib()
+    step = max(1, sessions // samples)
+    print(f"\n== {label}")
+    print(f"{'sessions':>12}{'actives':>10}{'expirées':>10}{'évincées':>10}{'RSS (Mio)':>11}{'+ (Mio)':>9}")
+    started = time.monotonic()
+    for user_id in range(sessions):
+        abandon(store, rng, 100_000_000 + user_id)
+        if (user_id + 1) % step == 0:
+            # Cadence réelle des arrivées, pour que l'expiration par inactivité s'applique
+            ahead = (user_id + 1) / rate - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+            stats = store.stats()
+            current = rss_mib()
+            print(f"{user_id + 1:>12}{stats['active']:>10}{stats.get('expired', 0):>10}"
+                  f"{stats.get('evicted', 0):>10}{current:>11.1f}{current - baseline:>9.1f}")
+
+
+def run(args) -> None:
+    print(f"{args.rate:.0f} sessions abandonnées par seconde")
+    soak("store non borné (historique)", MemorySessionStore(), args.unbounded_sessions, args.rate,
+         args.samples, args.seed)
+    bounded = MemorySessionStore(max_entries=args.max_entries, idle_timeout=args.idle_timeout)
+    soak(f"store borné (inactivité {args.idle_timeout:g} s, {args.max_entries} entrées max)", bounded,
+         args.sessions, args.rate, args.samples, args.seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=2_000_000, help="sessions abandonnées, store borné")
+    parser.add_argument('--unbounded-sessions', type=int, default=500_000,
+                        help="sessions abandonnées, store non borné (sa mémoire croît sans limite)")
+    parser.add_argument('--rate', type=float, default=100_000, help="sessions abandonnées par seconde")
+    parser.add_argument('--idle-timeout', type=float, default=1.0)
+    parser.add_argument('--max-entries', type=int, default=200_000)
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark des stores de sessions : réponses traitées par seconde.
+
+Rejoue le cycle de vie d'une session tel que le font les handlers de
+``main.py`` (création au démarrage du test, lecture/modification/écriture à
+chaque réponse, suppression à l'affichage des résultats) pour chaque backend.
+
+Usage :
+    python -m benchmarks.session_store --users 20000 --questions 9
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from bot.sessions import MemorySessionStore, Session, SQLiteSessionStore
+
+
+class SyncSQLiteSessionStore(SQLiteSessionStore):
+    """Variante sans écriture différée : une transaction (et un fsync) par écriture.
+
+    Sert de référence pour mesurer le gain du write-behind.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, flush_interval=3600)
+        with self._db_lock:
+            self._conn.execute("PRAGMA synchronous=FULL")
+
+    def __setitem__(self, user_id, state):
+        super().__setitem__(user_id, state)
+        self.flush()
+
+    def __delitem__(self, user_id):
+        super().__delitem__(user_id)
+        self.flush()
+
+
+def run_sessions(store, users: int, questions: int) -> float:
+    """Joue ``users`` tests complets et retourne le nombre de réponses par seconde."""
+    start = time.perf_counter()
+    for user_id in range(users):
+        store[user_id] = Session('depression')
+        for answer in range(questions):
+            if user_id not in store:
+                break
+            state = store[user_id]
+            state.answer(answer % 4)
+            store[user_id] = state
+        del store[user_id]
+    elapsed = time.perf_counter() - start
+    return users * questions / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--questions', type=int, default=9)
+    parser.add_argument('--sync-users', type=int, default=500,
+                        help="utilisateurs simulés pour le backend SQLite synchrone (lent)")
+    args = parser.parse_args()
+
+    print(f"SQLite {sqlite3.sqlite_version}, {args.questions} questions par test\n")
+    print(f"{'backend':<24}{'utilisateurs':>14}{'réponses/s':>14}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [
+            ('memory', lambda: MemorySessionStore(), args.users),
+            ('sqlite (write-behind)', lambda: SQLiteSessionStore(os.path.join(tmp, 'wb.db')), args.users),
+            ('sqlite (synchrone)', lambda: SyncSQLiteSessionStore(os.path.join(tmp, 'sync.db')), args.sync_users),
+        ]
+        for name, factory, users in backends:
+            store = factory()
+            try:
+                rate = run_sessions(store, users, args.questions)
+            finally:
+                store.close()
+            print(f"{name:<24}{users:>14}{rate:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
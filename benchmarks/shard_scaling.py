@@ -0,0 +1,159 @@
+"""Débit du mode multi-processus selon le nombre de workers.
+
+Pour chaque valeur de ``--workers``, lance ``main.py`` en polling raccordé
+au faux serveur Telegram (``benchmarks.fake_telegram``), avec
+``SHARD_WORKERS`` workers (``0`` : processus unique historique). Des
+utilisateurs virtuels passent ensuite un test complet : chaque mise à jour
+est publiée dans ``getUpdates`` et l'utilisateur attend la réponse du bot
+avant de cliquer à nouveau. Le rapport donne le débit et la latence de
+chaque configuration, et l'accélération par rapport à la première.
+
+``--kill-after`` tue un worker en cours de route pour vérifier sa relance.
+Les mises à jour qu'il avait déjà reçues sont perdues : leurs utilisateurs
+restent sans réponse et abandonnent (comptés en délais dépassés). Sans
+temps de réflexion, cela concerne presque tous les utilisateurs du worker
+tué ; les autres workers ne sont pas ralentis.
+
+Le faux serveur tourne dans le processus du benchmark et occupe un cœur :
+sur une machine à N cœurs, l'accélération est mesurable jusqu'à N - 1
+workers environ.
+
+Usage :
+    python -m benchmarks.shard_scaling --workers 0,1,2,4 --users 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+
+from benchmarks.fake_telegram import FakeTelegramAPI, UpdateFactory, buttons, percentile
+from psy import registry
+
+
+def first_worker_pid(pid: int):
+    """Premier worker lancé par le superviseur ``pid`` (Linux), ou None."""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as handle:
+            children = sorted(int(child) for child in handle.read().split())
+        for child in children:
+            # Les workers sont lancés avant l'ingestion ; écarter le resource_tracker
+            with open(f'/proc/{child}/cmdline', 'rb') as handle:
+                if b'spawn_main' in handle.read():
+                    return child
+    except OSError:
+        pass
+    return None
+
+
+async def virtual_user(api, factory, user_id, command, latencies, rng, timeout) -> None:
+    """Passe un test complet : la commande, puis un clic par question."""
+    update = factory.command(user_id, command)
+    while update is not None:
+        expected = len(api.replies(user_id)) + 1
+        started = time.perf_counter()
+        api.push_update(update)
+        try:
+            replies = await api.wait_for_replies(user_id, expected, timeout=timeout)
+        except asyncio.TimeoutError:
+            latencies['timeouts'] += 1
+            return
+        latencies['update'].append(time.perf_counter() - started)
+
+        _, _, params = replies[-1]
+        answers = [data for data in buttons(params) if data.split(':')[1] in ('a', 'p')]
+        update = factory.callback(user_id, rng.choice(answers)) if answers else None
+
+
+async def measure(args, workers: int) -> dict:
+    api = FakeTelegramAPI(latency=args.api_latency)
+    await api.start()
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN='123456:benchmark',
+        TELEGRAM_API_URL=api.base_url,
+        TELEGRAM_MODE='polling',
+        SHARD_WORKERS=str(workers),
+        CONCURRENT_UPDATES=str(args.concurrent_updates),
+        # Les limites de Telegram masqueraient le coût du traitement
+        OUTBOUND_SCHEDULER='0',
+        HTTP_POOL_SIZE=str(args.pool_size),
+    )
+    bot = subprocess.Popen([sys.executable, 'main.py'], env=env, stderr=subprocess.DEVNULL)
+    command = '/' + registry.get(args.test).command
+    factory = UpdateFactory()
+    rng = random.Random(args.seed)
+    latencies = {'update': [], 'timeouts': 0}
+    try:
+        # Premier échange : attendre que tous les processus soient prêts
+        await virtual_user(api, factory, 1, command, {'update': [], 'timeouts': 0}, rng, 60.0)
+
+        async def kill_worker():
+            await asyncio.sleep(args.kill_after)
+            worker = first_worker_pid(bot.pid)
+            if worker is not None:
+                os.kill(worker, signal.SIGKILL)
+
+        killer = asyncio.ensure_future(kill_worker()) if args.kill_after and workers else None
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            virtual_user(api, factory, 10_000 + user, command, latencies, rng, args.timeout)
+            for user in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+        if killer is not None:
+            killer.cancel()
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        # Le faux serveur doit continuer à répondre pendant l'arrêt du bot
+        await asyncio.get_running_loop().run_in_executor(None, bot.wait)
+        await api.stop()
+
+    values = sorted(latencies['update'])
+    return {
+        'workers': workers,
+        'updates': len(values),
+        'updates_per_s': len(values) / elapsed,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'timeouts': latencies['timeouts'],
+    }
+
+
+def run(args) -> None:
+    print(f"{args.users} utilisateurs simultanés, test {args.test}, {os.cpu_count()} cœurs, "
+          f"latence API simulée {args.api_latency * 1000:.0f} ms\n")
+    print(f"{'workers':>8}{'mises à jour':>14}{'débit (/s)':>12}{'p50 (ms)':>10}{'p99 (ms)':>10}"
+          f"{'délais':>8}{'accélération':>14}")
+    reference = None
+    for workers in args.workers:
+        result = asyncio.run(measure(args, workers))
+        reference = reference or result['updates_per_s']
+        label = workers if workers else '0 (un processus)'
+        print(f"{label!s:>8}{result['updates']:>14}{result['updates_per_s']:>12.0f}{result['p50_ms']:>10.1f}"
+              f"{result['p99_ms']:>10.1f}{result['timeouts']:>8}{result['updates_per_s'] / reference:>13.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=lambda text: [int(value) for value in text.split(',')], default=[0, 1, 2, 4],
+                        help="nombres de workers à comparer, séparés par des virgules")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--test', default='depression', help="identifiant du test (psy.registry)")
+    parser.add_argument('--concurrent-updates', type=int, default=256)
+    # La gestion du pool de httpcore coûte d'autant plus cher qu'il a de connexions
+    parser.add_argument('--pool-size', type=int, default=32, help="HTTP_POOL_SIZE, partagé entre les workers")
+    parser.add_argument('--api-latency', type=float, default=0.005, help="latence simulée de l'API (s)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="attente maximale d'une réponse (s)")
+    parser.add_argument('--kill-after', type=float, default=0.0, help="tue un worker après ce délai (s)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
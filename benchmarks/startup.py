@@ -0,0 +1,129 @@
+"""Temps de démarrage d'un worker, comparé à un budget.
+
+Chaque mesure lance un interpréteur neuf, ``--runs`` fois (médiane) :
+
+- ``python -X importtime -c "import main"`` : temps d'import total, et
+  temps propre des modules cumulé par paquet de premier niveau (la somme
+  des paquets fait le total) ;
+- les phases d'un démarrage, dans un même processus : ``import main``,
+  ``main.build_application`` (clients HTTP, handlers), puis ce que coûte
+  la première mise à jour de chaque sorte : premier menu d'une langue
+  (catalogue, claviers), premier test ouvert (module du test, numpy,
+  plan), premier résultat (calcul, statistiques de population). Les
+  mêmes phases sont mesurées avec ``PRELOAD_TESTS=1`` (tout chargé par
+  ``build_application``).
+
+Les catalogues et les plans sont en cache sur disque après la première
+exécution : la médiane mesure un démarrage à cache chaud, cas d'un worker
+lancé depuis une image où ``python -m locales`` a déjà tourné.
+
+Le démarrage (import + ``build_application``, chargement à la demande)
+est comparé à ``--budget-ms`` : au-delà, le code de sortie est 1, pour un
+contrôle en intégration continue.
+
+Usage :
+    python -m benchmarks.startup --runs 7 --budget-ms 600
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+PHASES = r'''
+import json, sys, time
+started = time.perf_counter()
+timings = {}
+def phase(name):
+    global started
+    now = time.perf_counter()
+    timings[name] = (now - started) * 1000
+    started = now
+import main
+phase('import main')
+main.build_application('123456:startup-benchmark')
+phase('build_application')
+timings['numpy au démarrage'] = 'numpy' in sys.modules
+from bot.render import views
+from psy import registry
+rendered = views('en')
+phase('premier menu (en)')
+questionnaire = registry.get('big_five')
+rendered.question(questionnaire, 0)
+phase('premier test ouvert')
+questionnaire.calculate_result([0] * len(questionnaire.questions), rendered.messages)
+main.open_result_stores()
+phase('premier résultat')
+print(json.dumps(timings))
+'''
+
+
+def importtime(environment: dict) -> tuple:
+    """Temps d'import de ``main`` (ms) et temps propre par paquet de premier niveau."""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                               env=environment, capture_output=True, text=True, check=True)
+    packages = defaultdict(float)
+    total = 0.0
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(own) / 1000
+        if name.strip() == 'main':
+            total = int(cumulative) / 1000
+    return total, packages
+
+
+def phases(environment: dict) -> dict:
+    completed = subprocess.run([sys.executable, '-c', PHASES], env=environment,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def median_phases(runs: list) -> dict:
+    return {name: statistics.median(run[name] for run in runs) for name in runs[0] if name != 'numpy au démarrage'}
+
+
+def run(args) -> bool:
+    environment = dict(os.environ, PYTHONPATH=os.getcwd(), METRICS_PORT='', RESULT_LOG_DIR='')
+    # Premier lancement : remplit les caches (plans, catalogues, bytecode)
+    phases(environment)
+
+    imports = [importtime(environment) for _ in range(args.runs)]
+    total = statistics.median(total for total, _ in imports)
+    packages = {name: statistics.median(run[name] for _, run in imports) for name in imports[0][1]}
+    print(f"import main : {total:.0f} ms (médiane de {args.runs})\n")
+    print(f"{'paquet':<24}{'ms':>8}")
+    for name, elapsed in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<24}{elapsed:>8.1f}")
+
+    lazy_runs = [phases(environment) for _ in range(args.runs)]
+    preload = median_phases([phases(dict(environment, PRELOAD_TESTS='1')) for _ in range(args.runs)])
+    lazy = median_phases(lazy_runs)
+    print(f"\n{'phase':<24}{'à la demande':>14}{'PRELOAD_TESTS=1':>18}")
+    for name in lazy:
+        print(f"{name:<24}{lazy[name]:>11.1f} ms{preload[name]:>15.1f} ms")
+    print(f"numpy chargé par import main : {'oui' if lazy_runs[0]['numpy au démarrage'] else 'non'}")
+
+    startup = lazy['import main'] + lazy['build_application']
+    within = startup <= args.budget_ms
+    print(f"\ndémarrage (import + build_application) : {startup:.0f} ms, budget {args.budget_ms:.0f} ms : "
+          f"{'OK' if within else 'DÉPASSÉ'}")
+    return within
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--top', type=int, default=12, help="paquets affichés")
+    parser.add_argument('--budget-ms', type=float, default=600.0)
+    args = parser.parse_args()
+    if not run(args):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Test de charge des clics dupliqués avec traitement concurrent des mises à jour.
+
+Chaque utilisateur virtuel passe le PHQ-9 ; ses clics sont envoyés avec des
+doublons (renvoi du même callback par Telegram, double clic produisant un
+nouveau callback sur le même bouton), et les flux de tous les utilisateurs
+sont entrelacés aléatoirement. Le script vérifie ensuite que chaque
+utilisateur a reçu exactement un résultat, avec le score attendu, et que
+toutes les sessions ont été libérées.
+
+Usage :
+    python -m benchmarks.stress_duplicates --users 500
+    python -m benchmarks.stress_duplicates --unsafe   # sans sérialisation ni dé-duplication
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+from benchmarks.fake_telegram import FakeTelegramAPI, UpdateFactory
+
+
+def user_stream(factory, rng, user_id, question_count, duplicate_rate):
+    """Mises à jour d'un utilisateur, doublons compris, et son score attendu."""
+    answers = [rng.randrange(4) for _ in range(question_count)]
+    stream = [factory.command(user_id, '/depression')]
+    for question_index, answer in enumerate(answers):
+        data = f'1:a:depression:{question_index}:{answer}'
+        tap = factory.callback(user_id, data)
+        stream.append(tap)
+        if rng.random() < duplicate_rate:
+            # Renvoi par Telegram : même callback, même identifiant
+            stream.append(dict(tap, update_id=tap['update_id'] + 1_000_000))
+        if rng.random() < duplicate_rate:
+            # Double clic : nouveau callback sur le même bouton
+            stream.append(factory.callback(user_id, data))
+    return stream, sum(answers)
+
+
+def interleave(rng, streams):
+    """Fusionne les flux au hasard en conservant l'ordre de chaque utilisateur."""
+    cursors = [0] * len(streams)
+    pending = list(range(len(streams)))
+    merged = []
+    while pending:
+        slot = rng.randrange(len(pending))
+        index = pending[slot]
+        merged.append(streams[index][cursors[index]])
+        cursors[index] += 1
+        if cursors[index] == len(streams[index]):
+            pending[slot] = pending[-1]
+            pending.pop()
+    return merged
+
+
+async def run(args) -> bool:
+    api = FakeTelegramAPI(latency=args.api_latency)
+    await api.start()
+    os.environ['TELEGRAM_API_URL'] = api.base_url
+
+    import main
+    from telegram import Update
+    if args.unsafe:
+        from telegram.ext import SimpleUpdateProcessor
+        main.PerUserUpdateProcessor = SimpleUpdateProcessor
+        main.recent_callbacks.seen = lambda item_id: False
+
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    application = main.build_application('123456:stress', concurrent_updates=args.concurrent_updates)
+    application.add_error_handler(on_error)
+
+    rng = random.Random(args.seed)
+    factory = UpdateFactory()
+    expected = {}
+    streams = []
+    for user in range(args.users):
+        user_id = 20_000 + user
+        stream, expected[user_id] = user_stream(factory, rng, user_id, 9, args.duplicate_rate)
+        streams.append(stream)
+    updates = interleave(rng, streams)
+
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        for update in updates:
+            await application.update_queue.put(Update.de_json(update, application.bot))
+        # Attendre que chaque utilisateur ait reçu son résultat, dans la limite du délai
+        # Question 1, 8 modifications, résultats (et message de suite hors LOW_ROUND_TRIP)
+        reply_count = 10 if main.LOW_ROUND_TRIP else 11
+        deadline = time.monotonic() + args.timeout
+        for user_id in expected:
+            try:
+                await api.wait_for_replies(user_id, reply_count, timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+        while application.update_queue.qsize():
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.2)
+        elapsed = time.perf_counter() - started
+        await application.stop()
+
+    await api.stop()
+
+    wrong = 0
+    for user_id, score in expected.items():
+        results = [params['text'] for _, _, params in api.replies(user_id) if 'PHQ-9 est' in params['text']]
+        if len(results) != 1 or not results[0].startswith(f"Votre score PHQ-9 est: {score}/27"):
+            wrong += 1
+
+    print(f"{len(updates)} mises à jour ({len(updates) - args.users * 10} doublons) "
+          f"pour {args.users} utilisateurs en {elapsed:.2f} s")
+    print(f"utilisateurs avec un résultat incorrect ou absent : {wrong}")
+    print(f"sessions restantes : {len(main.user_states)}")
+    print(f"exceptions dans les handlers : {len(errors)}")
+    return wrong == 0 and not errors and len(main.user_states) == 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--duplicate-rate', type=float, default=0.5,
+                        help="probabilité de chaque type de doublon par clic")
+    parser.add_argument('--concurrent-updates', type=int, default=256)
+    parser.add_argument('--api-latency', type=float, default=0.005, help="latence simulée de l'API (s)")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--unsafe', action='store_true',
+                        help="désactive la sérialisation par utilisateur et la dé-duplication")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    ok = asyncio.run(run(args))
+    print("OK" if ok else "ÉCHEC")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
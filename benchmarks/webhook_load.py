@@ -0,0 +1,132 @@
+"""Charge synthétique sur le mode webhook, entièrement hors ligne.
+
+Démarre un faux serveur Telegram (``benchmarks.fake_telegram``), lance
+``main.py`` en mode webhook raccordé à ce serveur, puis simule des
+utilisateurs qui passent un test en parallèle : chaque mise à jour est
+POSTée au webhook et sa latence est mesurée jusqu'à ce que le bot ait
+répondu (message envoyé ou modifié) au faux serveur.
+
+Usage :
+    python -m benchmarks.webhook_load --users 1000 --test depression
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.fake_telegram import FakeTelegramAPI, UpdateFactory, buttons, percentile
+from psy import registry
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_listening(port: int, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def virtual_user(client, api, factory, user_id, command, latencies, rng) -> None:
+    """Passe un test complet : la commande, puis un clic par question."""
+    update = factory.command(user_id, command)
+    while update is not None:
+        expected = len(api.replies(user_id)) + 1
+        started = time.perf_counter()
+        response = await client.post('', json=update)
+        response.raise_for_status()
+        replies = await api.wait_for_replies(user_id, expected)
+        latencies.append(time.perf_counter() - started)
+
+        # Cliquer sur une réponse de la dernière question affichée
+        _, _, params = replies[-1]
+        answers = [data for data in buttons(params) if data.split(':')[1] in ('a', 'p')]
+        update = factory.callback(user_id, rng.choice(answers)) if answers else None
+
+
+async def run(args) -> None:
+    api = FakeTelegramAPI(latency=args.api_latency)
+    await api.start()
+
+    port = free_port()
+    secret = secrets.token_hex(16)
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN='123456:benchmark',
+        TELEGRAM_API_URL=api.base_url,
+        TELEGRAM_MODE='webhook',
+        WEBHOOK_URL=f'http://127.0.0.1:{port}',
+        WEBHOOK_LISTEN='127.0.0.1',
+        WEBHOOK_PORT=str(port),
+        WEBHOOK_SECRET=secret,
+        CONCURRENT_UPDATES=str(args.concurrent_updates),
+        OUTBOUND_SCHEDULER='0',
+    )
+    bot = subprocess.Popen([sys.executable, 'main.py'], env=env, stderr=subprocess.DEVNULL)
+    try:
+        await wait_until_listening(port)
+        command = '/' + registry.get(args.test).command
+        factory = UpdateFactory()
+        rng = random.Random(args.seed)
+        latencies = []
+        limits = httpx.Limits(max_connections=args.connections)
+        async with httpx.AsyncClient(
+            base_url=f'http://127.0.0.1:{port}/webhook',
+            headers={'X-Telegram-Bot-Api-Secret-Token': secret},
+            limits=limits,
+            timeout=60.0,
+        ) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                virtual_user(client, api, factory, 10_000 + user, command, latencies, rng)
+                for user in range(args.users)
+            ))
+            elapsed = time.perf_counter() - started
+    finally:
+        bot.terminate()
+        bot.wait()
+        await api.stop()
+
+    latencies.sort()
+    print(f"{args.users} utilisateurs simultanés, test {args.test}, "
+          f"latence API simulée {args.api_latency * 1000:.0f} ms")
+    print(f"mises à jour traitées : {len(latencies)} en {elapsed:.2f} s "
+          f"({len(latencies) / elapsed:,.0f}/s)")
+    for q in (50, 95, 99):
+        print(f"p{q} : {percentile(latencies, q) * 1000:8.1f} ms")
+    print(f"max : {latencies[-1] * 1000:8.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--test', default='depression', help="identifiant du test (psy.registry)")
+    parser.add_argument('--concurrent-updates', type=int, default=256)
+    parser.add_argument('--connections', type=int, default=100,
+                        help="connexions simultanées vers le webhook (max_connections côté Telegram)")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="latence simulée de l'API (s)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Format versionné et compact des ``callback_data`` des boutons.
+
+Un callback s'écrit ``<version>:<action>[:<argument>...]``, par exemple
+``1:a:depression:3:2`` pour la réponse 2 à la question 3 du PHQ-9. L'action
+est un code d'une lettre qui sert de clé de dispatch dans ``main.py``.
+
+Les boutons déjà envoyés avec l'ancien format (``mbti``, ``answer_2``,
+``cancel_test``…) restent reconnus.
+"""
+
+VERSION = '1'
+
+# Actions
+MENU = 'm'
+START_TEST = 's'
+ANSWER = 'a'
+# Réponse portant tout l'état du test (voir bot/stateless.py)
+PACKED_ANSWER = 'p'
+CANCEL = 'c'
+# Rappel de refaire un test : ``r:<test>:on`` ou ``r:<test>:off``
+REMIND = 'r'
+
+# Correspondance des anciens callback_data vers le nouveau format
+_LEGACY = {
+    'start': (MENU, ('start',)),
+    'help': (MENU, ('help',)),
+    'new_test': (MENU, ('new_test',)),
+    'cancel_test': (CANCEL, ()),
+    'mbti': (START_TEST, ('mbti',)),
+    'big_five': (START_TEST, ('big_five',)),
+    'depression': (START_TEST, ('depression',)),
+    'anxiety': (START_TEST, ('anxiety',)),
+}
+
+
+def encode(action: str, *args) -> str:
+    """Construit le ``callback_data`` d'une action et de ses arguments."""
+    return ':'.join((VERSION, action, *map(str, args)))
+
+
+def parse(data: str, arguments: dict = None):
+    """Décode un ``callback_data`` en ``(action, arguments)``.
+
+    Retourne ``None`` si le format ou la version ne sont pas reconnus, ou,
+    avec ``arguments`` (nombre d'arguments attendu par action), si l'action
+    n'y figure pas ou n'a pas ce nombre d'arguments.
+    """
+    version, _, rest = data.partition(':')
+    if version == VERSION and rest:
+        action, *args = rest.split(':')
+        parsed = action, tuple(args)
+    elif data in _LEGACY:
+        parsed = _LEGACY[data]
+    elif data.startswith('answer_'):
+        # Ancien bouton de réponse : ni test ni question, seulement l'option
+        parsed = ANSWER, (None, None, data[len('answer_'):])
+    else:
+        return None
+    if arguments is not None and arguments.get(parsed[0]) != len(parsed[1]):
+        return None
+    return parsed
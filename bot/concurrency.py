@@ -0,0 +1,118 @@
+"""Outils de concurrence pour le traitement parallèle des mises à jour.
+
+Quand ``concurrent_updates`` est activé, deux clics d'un même utilisateur
+peuvent être traités en même temps et corrompre sa session. On conserve donc
+l'ordre par utilisateur (``PerUserUpdateProcessor``) tout en laissant les
+utilisateurs différents progresser en parallèle, et on écarte les callbacks
+déjà vus (``RecentIds``).
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class KeyedLock:
+    """Verrous asyncio par clé, libérés dès que plus personne ne les tient ni ne les attend.
+
+    La table ne contient donc que les clés actives : un utilisateur inactif
+    ne coûte aucune mémoire.
+    """
+
+    def __init__(self):
+        # clé -> [verrou, nombre de détenteurs et d'attentes]
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class RecentIds:
+    """Mémoire bornée des derniers identifiants vus (callbacks, mises à jour).
+
+    Avec ``ttl``, un identifiant est oublié ``ttl`` secondes après avoir été vu.
+    """
+
+    def __init__(self, maxlen: int = 65536, ttl: float = None):
+        self.maxlen = maxlen
+        self.ttl = ttl
+        # identifiant -> instant où il a été vu, du plus ancien au plus récent
+        self._ids = OrderedDict()
+
+    def seen(self, item_id) -> bool:
+        """Enregistre ``item_id`` et indique s'il avait déjà été vu."""
+        now = time.monotonic()
+        if self.ttl is not None:
+            while self._ids:
+                oldest, seen_at = next(iter(self._ids.items()))
+                if now - seen_at < self.ttl:
+                    break
+                del self._ids[oldest]
+        if item_id in self._ids:
+            return True
+        self._ids[item_id] = now
+        if len(self._ids) > self.maxlen:
+            self._ids.popitem(last=False)
+        return False
+
+    def __len__(self):
+        return len(self._ids)
+
+
+# Borne passée à BaseUpdateProcessor : la limite réelle est appliquée par
+# PerUserUpdateProcessor, après le verrou de l'utilisateur
+_UNBOUNDED = 2**31 - 1
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Traite les mises à jour en parallèle, mais dans l'ordre pour un même utilisateur.
+
+    Le verrou de l'utilisateur est pris avant l'une des ``limit`` places
+    (``slots``) : les mises à jour qui attendent leur tour n'en occupent
+    aucune, et un utilisateur qui envoie des centaines de clics n'en tient
+    jamais qu'une. Le sémaphore de ``BaseUpdateProcessor``, pris avant
+    ``do_process_update``, est réglé assez haut pour ne jamais retenir une
+    mise à jour.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates doit être strictement positif")
+        super().__init__(_UNBOUNDED)
+        self.limit = max_concurrent_updates
+        self.slots = asyncio.Semaphore(max_concurrent_updates)
+        self.locks = KeyedLock()
+
+    async def do_process_update(self, update, coroutine) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self.slots:
+                await coroutine
+            return
+        async with self.locks.hold(user.id):
+            async with self.slots:
+                await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,328 @@
+"""Historique des résultats par utilisateur : ``/history`` et export.
+
+Activé par ``HISTORY_DB_PATH`` : chaque test terminé ajoute une ligne à la
+table SQLite ``results`` (utilisateur, test, date, colonnes calculées en
+JSON, sans les réponses). La clé primaire ``(user_id, test_id,
+completed_at)`` range la table dans l'ordre utilisateur, test, date
+(``WITHOUT ROWID``) : les résultats d'un utilisateur pour un test sont
+contigus et se lisent en O(log n) plus leur nombre, quelle que soit la
+taille de la table.
+
+Comme les sessions SQLite, les écritures sont accumulées puis appliquées
+par lots, toutes les ``flush_interval`` secondes, par un thread ; une
+lecture vide d'abord les écritures en attente.
+
+L'export parcourt la table par pages (pagination sur la clé primaire) et
+produit des lignes CSV ou NDJSON au fil de l'eau, sans jamais charger la
+table. Il est servi en HTTP (``serve_export``, ``HISTORY_EXPORT_PORT``)
+ou en ligne de commande :
+    python -m bot.history --format csv --test depression > depression.csv
+"""
+
+import argparse
+import asyncio
+import csv
+import hmac
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from psy import registry
+
+logger = logging.getLogger(__name__)
+
+# Clé de départ de la pagination : avant tout résultat
+_START = (-2**63, '', float('-inf'))
+
+FORMATS = ('csv', 'ndjson')
+
+
+class ResultHistory:
+    """Résultats des tests terminés, dans SQLite (WAL), par utilisateur, test et date."""
+
+    def __init__(self, path: str, flush_interval: float = 1.0, max_batch: int = 1024):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " user_id INTEGER NOT NULL,"
+            " test_id TEXT NOT NULL,"
+            " completed_at REAL NOT NULL,"
+            " scores TEXT NOT NULL,"
+            " PRIMARY KEY (user_id, test_id, completed_at)) WITHOUT ROWID"
+        )
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="history-flusher", daemon=True)
+        self._flusher.start()
+
+    def record(self, user_id: int, test_id: str, scored: dict, completed_at: float = None) -> None:
+        """Ajoute un résultat (colonnes de ``Questionnaire.scored``) à la prochaine écriture."""
+        row = (user_id, test_id, time.time() if completed_at is None else completed_at,
+               json.dumps(scored, separators=(',', ':')))
+        with self._lock:
+            self._pending.append(row)
+            backlog = len(self._pending)
+        if backlog >= self.max_batch:
+            self._wakeup.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+        committed = False
+        with self._db_lock:
+            try:
+                self._conn.execute("BEGIN")
+                # Deux résultats à la même date : le dernier l'emporte
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO results (user_id, test_id, completed_at, scores) VALUES (?, ?, ?, ?)",
+                    batch)
+                self._conn.execute("COMMIT")
+                committed = True
+            except sqlite3.Error:
+                logger.exception("Échec de l'écriture de %d résultats dans l'historique", len(batch))
+            finally:
+                if not committed:
+                    # Le lot d'abord : ROLLBACK peut échouer à son tour
+                    with self._lock:
+                        self._pending[:0] = batch
+                    # SQLite a pu annuler la transaction lui-même (disque plein…)
+                    if self._conn.in_transaction:
+                        self._conn.execute("ROLLBACK")
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Échec de l'écriture de l'historique")
+
+    def recent(self, user_id: int, test_id: str, limit: int = 12) -> list:
+        """Derniers ``(completed_at, colonnes)`` de ``user_id`` pour ``test_id``, du plus ancien au plus récent."""
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT completed_at, scores FROM results WHERE user_id = ? AND test_id = ?"
+                " ORDER BY completed_at DESC LIMIT ?", (user_id, test_id, limit)).fetchall()
+        return [(completed_at, json.loads(scores)) for completed_at, scores in reversed(rows)]
+
+    def page(self, after: tuple = _START, limit: int = 1000, test_id: str = None, user_id: int = None) -> list:
+        """Résultats ``(user_id, test_id, completed_at, scores)`` de clé supérieure à ``after``, dans l'ordre de la clé."""
+        self.flush()
+        if user_id is not None:
+            # Préfixe de la clé primaire : pas de parcours de la table
+            if after[0] > user_id:
+                return []
+            start = after[1:] if after[0] == user_id else _START[1:]
+            conditions, arguments = ["user_id = ?", "(test_id, completed_at) > (?, ?)"], [user_id, *start]
+        else:
+            conditions, arguments = ["(user_id, test_id, completed_at) > (?, ?, ?)"], list(after)
+        if test_id is not None:
+            conditions.append("test_id = ?")
+            arguments.append(test_id)
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT user_id, test_id, completed_at, scores FROM results WHERE " + " AND ".join(conditions)
+                + " ORDER BY user_id, test_id, completed_at LIMIT ?", (*arguments, limit)).fetchall()
+
+    def export(self, test_id: str = None, user_id: int = None, after: tuple = _START, page_size: int = 1000):
+        """Tous les résultats à partir de ``after``, page par page (générateur)."""
+        while True:
+            rows = self.page(after, page_size, test_id, user_id)
+            yield from rows
+            if len(rows) < page_size:
+                return
+            after = rows[-1][:3]
+
+    def count(self) -> int:
+        self.flush()
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+# -- Mise en forme de l'export ------------------------------------------------
+
+def _columns(test_id: str) -> tuple:
+    """Colonnes calculées du test et libellés des colonnes codées."""
+    questionnaire = registry.get(test_id)
+    if questionnaire is None:
+        return (), {}
+    columns = list(questionnaire.score_maximums)
+    columns += [column for column in questionnaire.result_levels if column not in columns]
+    return tuple(columns), questionnaire.result_levels
+
+
+def _decoded(test_id: str, scores: str, layouts: dict) -> dict:
+    layout = layouts.get(test_id)
+    if layout is None:
+        layout = layouts[test_id] = _columns(test_id)
+    _, levels = layout
+    values = json.loads(scores)
+    for column, labels in levels.items():
+        code = values.get(column)
+        if isinstance(code, int) and 0 <= code < len(labels):
+            values[column] = labels[code]
+    return values
+
+
+def format_rows(rows, output_format: str, test_id: str = None):
+    """Lignes de texte (en-tête CSV compris) des résultats ``rows``, au fil de l'eau.
+
+    Sans ``test_id``, le CSV garde les colonnes calculées en une colonne
+    ``scores`` (JSON), les tests n'ayant pas les mêmes.
+    """
+    layouts = {}
+    if output_format == 'ndjson':
+        for user_id, test, completed_at, scores in rows:
+            yield json.dumps({'user_id': user_id, 'test': test, 'completed_at': completed_at,
+                              **_decoded(test, scores, layouts)}, ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    columns = _columns(test_id)[0] if test_id is not None else ('scores',)
+    writer.writerow(('user_id', 'test', 'completed_at', *columns))
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for user_id, test, completed_at, scores in rows:
+        if test_id is None:
+            writer.writerow((user_id, test, repr(completed_at), scores))
+        else:
+            values = _decoded(test, scores, layouts)
+            writer.writerow((user_id, test, repr(completed_at), *(values.get(column, '') for column in columns)))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def parse_cursor(value: str) -> tuple:
+    """Clé ``user_id,test,completed_at`` d'un résultat déjà reçu : l'export reprend après."""
+    user_id, test_id, completed_at = value.split(',')
+    return int(user_id), test_id, float(completed_at)
+
+
+# -- Export HTTP ----------------------------------------------------------------
+
+async def serve_export(history: ResultHistory, host: str, port: int, token: str, page_size: int = 1000):
+    """Sert ``GET /export`` (``Authorization: Bearer <token>``) ; retourne le serveur asyncio.
+
+    Paramètres : ``format`` (``csv``, ``ndjson``), ``test``, ``user`` et
+    ``after`` (voir ``parse_cursor``). Le corps est écrit page par page, en
+    attendant que le client lise chaque page avant de lire la suivante.
+    """
+
+    async def respond(writer, status: bytes, body: bytes) -> None:
+        writer.write(b'HTTP/1.1 %s\r\nContent-Type: text/plain; charset=utf-8\r\n'
+                     b'Content-Length: %d\r\nConnection: close\r\n\r\n' % (status, len(body)) + body)
+        await writer.drain()
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            parts = request_line.decode('latin-1').split()
+            url = urlsplit(parts[1]) if len(parts) >= 2 else None
+            if url is None or parts[0] != 'GET' or url.path != '/export':
+                await respond(writer, b'404 Not Found', b'not found\n')
+                return
+            if not hmac.compare_digest(headers.get('authorization', ''), f'Bearer {token}'):
+                await respond(writer, b'401 Unauthorized', b'unauthorized\n')
+                return
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            try:
+                output_format = query.get('format', 'ndjson')
+                if output_format not in FORMATS:
+                    raise ValueError(output_format)
+                test_id = query.get('test')
+                user_id = int(query['user']) if 'user' in query else None
+                after = parse_cursor(query['after']) if 'after' in query else _START
+            except (ValueError, KeyError):
+                await respond(writer, b'400 Bad Request', b'bad request\n')
+                return
+
+            content_type = b'text/csv' if output_format == 'csv' else b'application/x-ndjson'
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: %s; charset=utf-8\r\nConnection: close\r\n\r\n'
+                         % content_type)
+            header_sent = False
+            while True:
+                rows = await asyncio.to_thread(history.page, after, page_size, test_id, user_id)
+                lines = format_rows(rows, output_format, test_id)
+                if output_format == 'csv' and header_sent:
+                    next(lines)
+                header_sent = True
+                writer.write(''.join(lines).encode())
+                await writer.drain()
+                if len(rows) < page_size:
+                    break
+                after = rows[-1][:3]
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("Échec de l'export de l'historique")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("Export de l'historique sur http://%s:%d/export", host, port)
+    return server
+
+
+def create_history():
+    """Historique configuré par ``HISTORY_DB_PATH`` et ``HISTORY_FLUSH_INTERVAL``, ou ``None``."""
+    path = os.getenv('HISTORY_DB_PATH')
+    if not path:
+        return None
+    return ResultHistory(path, flush_interval=float(os.getenv('HISTORY_FLUSH_INTERVAL', '1')))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('HISTORY_DB_PATH', 'history.db'))
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--test', help="un seul test (colonnes du test en CSV)")
+    parser.add_argument('--user', type=int, help="un seul utilisateur")
+    parser.add_argument('--after', type=parse_cursor, default=_START, help="reprendre après user_id,test,completed_at")
+    args = parser.parse_args()
+
+    history = ResultHistory(args.db)
+    try:
+        rows = history.export(args.test, args.user, args.after)
+        sys.stdout.writelines(format_rows(rows, args.format, args.test))
+    finally:
+        history.close()
+
+
+if __name__ == '__main__':
+    main()
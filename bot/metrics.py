@@ -0,0 +1,335 @@
+"""Métriques du bot au format Prometheus.
+
+Activées par ``METRICS_PORT`` : le bot sert alors ``/metrics`` sur ce port
+(``METRICS_LISTEN``, ``127.0.0.1`` par défaut) avec :
+
+- ``psychobot_handler_duration_seconds`` : durée de chaque handler ;
+- ``psychobot_telegram_api_duration_seconds`` et
+  ``psychobot_telegram_api_errors_total`` : appels sortants par méthode ;
+- ``psychobot_active_sessions`` : sessions en cours par test ;
+- ``psychobot_questions_answered_total``, ``psychobot_tests_completed_total``
+  et ``psychobot_tests_abandoned_total`` : progression dans chaque test, par
+  question, et raison des abandons ;
+- ``psychobot_event_loop_lag_seconds`` : retard de la boucle asyncio.
+- ``psychobot_population_results`` et ``psychobot_population_users`` :
+  distributions des résultats par test (voir ``bot.population``).
+- ``psychobot_outbound_queue_depth`` et ``psychobot_outbound_wait_p95_seconds`` :
+  appels en file et attente récente dans l'ordonnanceur des envois, par bot
+  et par voie (voir ``bot.outbound``).
+
+Tout tourne dans le thread de la boucle asyncio : les compteurs n'ont pas
+besoin de verrou. Sur le chemin d'un clic, une observation est une
+recherche dichotomique dans des bornes fixes puis l'incrément d'une case
+d'une liste préallouée ; les séries (combinaisons d'étiquettes) sont
+créées à l'avance ou au premier usage, jamais à chaque observation.
+"""
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Bornes des histogrammes de latence (secondes)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Une série d'histogramme : compte par tranche, somme et total."""
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        # Une case par borne, plus la dernière pour +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Counter:
+    """Une série de compteur."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class _Family:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._children = {}
+
+    def labels(self, *values):
+        """Série des étiquettes ``values``, créée au premier appel."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class HistogramFamily(_Family):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), bounds: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.bounds = tuple(bounds)
+
+    def _new_child(self) -> Histogram:
+        return Histogram(self.bounds)
+
+    def _render_child(self, values: tuple, child: Histogram) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), child.counts):
+            cumulative += count
+            le = 'le="%s"' % ('+Inf' if bound == float('inf') else repr(bound))
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}')
+        labels = _format_labels(self.label_names, values)
+        lines.append(f'{self.name}_sum{labels} {child.sum!r}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class CounterFamily(_Family):
+    kind = 'counter'
+
+    def _new_child(self) -> Counter:
+        return Counter()
+
+    def _render_child(self, values: tuple, child: Counter) -> list:
+        return [f'{self.name}{_format_labels(self.label_names, values)} {child.value}']
+
+
+class GaugeFamily(_Family):
+    """Jauge calculée au moment de la collecte par ``collect() -> {étiquettes: valeur}``."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple, collect):
+        super().__init__(name, documentation, label_names)
+        self.collect = collect
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, values)} {value}')
+        return lines
+
+
+class Metrics:
+    """Ensemble des métriques du bot.
+
+    ``questionnaires`` (id -> nombre de questions) permet de créer à
+    l'avance les séries par question, consultées ensuite par indice.
+    """
+
+    def __init__(self, questionnaires: dict, active_sessions=None):
+        self.handler_seconds = HistogramFamily(
+            'psychobot_handler_duration_seconds', "Durée des handlers de mises à jour.", ('handler',))
+        self.api_seconds = HistogramFamily(
+            'psychobot_telegram_api_duration_seconds', "Durée des appels à l'API Telegram.", ('method',))
+        self.api_errors = CounterFamily(
+            'psychobot_telegram_api_errors_total', "Appels à l'API Telegram en erreur.", ('method', 'error'))
+        self.answered = CounterFamily(
+            'psychobot_questions_answered_total', "Réponses enregistrées, par question.", ('test', 'question'))
+        self.completed = CounterFamily(
+            'psychobot_tests_completed_total', "Tests menés jusqu'aux résultats.", ('test',))
+        self.abandoned = CounterFamily(
+            'psychobot_tests_abandoned_total', "Tests interrompus, par question atteinte et raison.",
+            ('test', 'question', 'reason'))
+        self.loop_lag = HistogramFamily(
+            'psychobot_event_loop_lag_seconds', "Retard de réveil de la boucle asyncio.", (), LAG_BUCKETS)
+        self.families = [self.handler_seconds, self.api_seconds, self.api_errors, self.answered,
+                         self.completed, self.abandoned, self.loop_lag]
+        if active_sessions is not None:
+            self.families.append(GaugeFamily(
+                'psychobot_active_sessions', "Sessions en cours, par test.", ('test',),
+                lambda: {(test_id,): count for test_id, count in active_sessions().items()}))
+
+        # Séries du chemin d'un clic, indexées sans construire d'étiquettes
+        self._handlers = {}
+        self._answered = {
+            test_id: [self.answered.labels(test_id, str(index)) for index in range(count)]
+            for test_id, count in questionnaires.items()
+        }
+        self._completed = {test_id: self.completed.labels(test_id) for test_id in questionnaires}
+        self._lag = self.loop_lag.labels()
+        # Ordonnanceurs des envois, par espace de bot (voir track_outbound)
+        self._outbound = {}
+
+    def track_population(self, population) -> None:
+        """Ajoute les distributions fusionnées de ``population`` (voir bot/population.py)."""
+        def results():
+            return {
+                (test_id, name, label): count
+                for test_id, test in population.distributions().items()
+                for name, counts in test['levels'].items()
+                for label, count in counts.items()
+            }
+
+        self.families.append(GaugeFamily(
+            'psychobot_population_results', "Résultats par niveau (tranche, type), tous processus confondus.",
+            ('test', 'column', 'level'), results))
+        self.families.append(GaugeFamily(
+            'psychobot_population_users', "Utilisateurs distincts estimés (HyperLogLog), par test.", ('test',),
+            lambda: {(test_id,): test['users'] for test_id, test in population.distributions().items()}))
+
+    def track_outbound(self, namespace: int, scheduler) -> None:
+        """Ajoute les files de ``scheduler`` (``bot.outbound.OutboundScheduler``) du bot ``namespace``."""
+        if not self._outbound:
+            def collect(key):
+                return lambda: {
+                    (str(bot), lane): value
+                    for bot, stats in ((bot, scheduler.stats()) for bot, scheduler in self._outbound.items())
+                    for lane, value in stats[key].items()
+                }
+
+            self.families.append(GaugeFamily(
+                'psychobot_outbound_queue_depth', "Appels sortants en file, par bot et par voie.",
+                ('bot', 'lane'), collect('queue_depth_by_lane')))
+            self.families.append(GaugeFamily(
+                'psychobot_outbound_wait_p95_seconds', "p95 de l'attente des derniers appels sortants.",
+                ('bot', 'lane'), collect('wait_seconds_p95')))
+        self._outbound[namespace] = scheduler
+
+    # -- Chemin d'un clic -------------------------------------------------------
+
+    def _handler_series(self, name: str) -> Histogram:
+        series = self._handlers.get(name)
+        if series is None:
+            series = self._handlers[name] = self.handler_seconds.labels(name)
+        return series
+
+    def observe_handler(self, name: str, seconds: float) -> None:
+        self._handler_series(name).observe(seconds)
+
+    def timed(self, callback):
+        """Enveloppe le handler ``callback`` pour mesurer sa durée."""
+        series = self._handler_series(callback.__name__)
+
+        async def timed_callback(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                series.observe(time.perf_counter() - started)
+
+        timed_callback.__name__ = callback.__name__
+        return timed_callback
+
+    def question_answered(self, test_id: str, question_index: int) -> None:
+        series = self._answered.get(test_id)
+        if series is not None and question_index < len(series):
+            series[question_index].inc()
+
+    def test_completed(self, test_id: str) -> None:
+        series = self._completed.get(test_id)
+        if series is not None:
+            series.inc()
+
+    def test_abandoned(self, test_id: str, question_index: int, reason: str) -> None:
+        self.abandoned.labels(test_id, str(question_index), reason).inc()
+
+    def observe_loop_lag(self, seconds: float) -> None:
+        self._lag.observe(seconds)
+
+    # -- Collecte ---------------------------------------------------------------
+
+    def render(self) -> str:
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """Client HTTP qui mesure chaque appel à l'API Telegram."""
+
+    def __init__(self, metrics: Metrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as exc:
+            self.metrics.api_errors.labels(endpoint, type(exc).__name__).inc()
+            raise
+        finally:
+            self.metrics.api_seconds.labels(endpoint).observe(time.perf_counter() - started)
+        if code >= 300:
+            self.metrics.api_errors.labels(endpoint, str(code)).inc()
+        return code, payload
+
+
+async def watch_event_loop(metrics: Metrics, interval: float = 0.5) -> None:
+    """Mesure le retard de la boucle : écart entre le réveil prévu et le réveil réel."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        metrics.observe_loop_lag(max(0.0, loop.time() - expected))
+
+
+async def serve(metrics: Metrics, host: str, port: int):
+    """Sert ``GET /metrics`` ; retourne le serveur asyncio."""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?', 1)[0] == '/metrics':
+                status, body = b'200 OK', metrics.render().encode()
+            else:
+                status, body = b'404 Not Found', b'not found\n'
+            writer.write(
+                b'HTTP/1.1 %s\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                b'Content-Length: %d\r\nConnection: close\r\n\r\n' % (status, len(body)) + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("Échec de la collecte des métriques")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("Métriques Prometheus sur http://%s:%d/metrics", host, port)
+    return server
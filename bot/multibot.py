@@ -0,0 +1,199 @@
+"""Plusieurs bots dans un seul processus et une seule boucle asyncio.
+
+Avec ``BOTS_FILE``, ``main.py`` sert tous les bots décrits dans ce fichier
+JSON, par exemple un bot par marque ou par langue ::
+
+    [
+      {"name": "psychotest", "token_env": "TELEGRAM_TOKEN"},
+      {"name": "psychotest_en", "token_env": "PSYCHOTEST_EN_TOKEN", "language": "en"}
+    ]
+
+``token_env`` nomme la variable d'environnement qui contient le token
+(``token`` le donne directement). ``language`` impose la langue des
+messages du bot, quelle que soit celle de l'utilisateur.
+
+Chaque bot a son ``Application`` (handlers, limites d'envoi propres à son
+token), mais tout le reste n'existe qu'une fois : code et plans des tests,
+catalogues et claviers rendus (``bot/render.py``), contexte TLS, store des
+sessions, rappels, journal des résultats et statistiques de population.
+
+Chaque bot garde en revanche son pool de connexions, de
+``HTTP_POOL_SIZE / N`` connexions : le total reste celui d'un bot seul.
+Un pool commun économiserait quelques connexions, mais httpcore parcourt
+toutes les connexions du pool pour chaque requête en attente : avec 16
+bots, un pool commun de 256 connexions coûtait 60 % de CPU de plus que 16
+pools de 16 (``benchmarks/multibot.py``).
+
+Un même utilisateur peut passer un test sur deux bots à la fois : les
+sessions de chaque bot sont dans leur propre espace de ``user_states``.
+La clé d'une session est ``session_key(espace, user_id)`` : l'espace
+(l'index du bot dans le fichier) occupe les bits au-dessus des 52 bits
+d'un identifiant Telegram, ce qui garde une clé entière pour le store
+SQLite et les rappels. Le premier bot a l'espace 0, où la clé est
+l'identifiant lui-même : passer d'un bot seul à plusieurs conserve ses
+sessions et ses rappels.
+
+En mode webhook, un seul serveur reçoit les mises à jour de tous les
+bots, chacun sur ``/<WEBHOOK_PATH>/<name>``.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import re
+import signal
+from dataclasses import dataclass
+from typing import Optional
+
+import tornado.web
+from telegram import Update
+
+from bot.http import get_updates_request, request_from_env
+
+logger = logging.getLogger(__name__)
+
+# Bits d'un identifiant d'utilisateur Telegram ; l'espace du bot est au-dessus
+USER_ID_BITS = 52
+_USER_ID_MASK = (1 << USER_ID_BITS) - 1
+# Clés entières signées sur 64 bits (SQLite)
+MAX_BOTS = 1 << (63 - USER_ID_BITS)
+
+_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+@dataclass(frozen=True)
+class BotConfig:
+    """Un bot servi par le processus."""
+
+    # Identifiant du bot dans les journaux et le chemin de son webhook
+    name: str
+    token: str
+    # Langue imposée des messages (voir locales/), ``None`` : celle de l'utilisateur
+    language: Optional[str] = None
+
+
+def session_key(namespace: int, user_id: int) -> int:
+    """Clé de la session de ``user_id`` dans l'espace du bot ``namespace``."""
+    return namespace << USER_ID_BITS | user_id
+
+
+def split_key(key: int) -> tuple:
+    """``(espace, user_id)`` d'une clé de ``session_key``."""
+    return key >> USER_ID_BITS, key & _USER_ID_MASK
+
+
+def load_configs(path: str) -> list:
+    """Lit la liste des bots de ``path`` ; lève ``ValueError`` si elle est invalide."""
+    with open(path, encoding='utf-8') as source:
+        entries = json.load(source)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} : liste de bots attendue")
+    if len(entries) > MAX_BOTS:
+        raise ValueError(f"{path} : au plus {MAX_BOTS} bots")
+    configs = []
+    for entry in entries:
+        name = entry.get('name', '')
+        if not _NAME.match(name) or any(config.name == name for config in configs):
+            raise ValueError(f"{path} : nom de bot invalide ou en double : {name!r}")
+        token = entry.get('token') or os.getenv(entry.get('token_env', ''), '')
+        if not token:
+            raise ValueError(f"{path} : pas de token pour le bot {name}")
+        configs.append(BotConfig(name, token, entry.get('language')))
+    return configs
+
+
+def build_applications(configs: list, build_application, concurrent_updates: int = 0, metrics=None) -> list:
+    """Construit l'application de chaque bot, chacune avec sa part du pool de connexions."""
+    return [
+        build_application(config.token, concurrent_updates=concurrent_updates, namespace=namespace,
+                          language=config.language,
+                          requests=(request_from_env(metrics, clients=len(configs)), get_updates_request()))
+        for namespace, config in enumerate(configs)
+    ]
+
+
+class _WebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, bot_application, secret: str):
+        self.bot_application = bot_application
+        self.secret = secret
+
+    async def post(self):
+        token = self.request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(token, self.secret):
+            self.send_error(403)
+            return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.send_error(400)
+            return
+        await self.bot_application.update_queue.put(Update.de_json(data, self.bot_application.bot))
+
+
+async def _serve_webhook(configs: list, applications: list, stopping: asyncio.Event) -> None:
+    url_path = os.getenv('WEBHOOK_PATH', 'webhook')
+    secret = os.getenv('WEBHOOK_SECRET')
+    web_app = tornado.web.Application([
+        (rf'/{url_path}/{config.name}/?', _WebhookHandler, dict(bot_application=application, secret=secret))
+        for config, application in zip(configs, applications)
+    ])
+    server = web_app.listen(int(os.getenv('WEBHOOK_PORT', '8443')), address=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'))
+    try:
+        for config, application in zip(configs, applications):
+            await application.bot.set_webhook(
+                url=f"{os.getenv('WEBHOOK_URL').rstrip('/')}/{url_path}/{config.name}",
+                secret_token=secret,
+                max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '100')),
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await stopping.wait()
+    finally:
+        server.stop()
+        await server.close_all_connections()
+
+
+async def _serve(configs: list, applications: list, mode: str, on_start, on_stop) -> None:
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    for application in applications:
+        await application.initialize()
+    # Tâches de fond communes : lancées une fois, pour tous les bots
+    await on_start(applications[0])
+    try:
+        for application in applications:
+            await application.start()
+        logger.info("%d bots servis : %s", len(configs), ', '.join(config.name for config in configs))
+        if mode == 'webhook':
+            await _serve_webhook(configs, applications, stopping)
+        else:
+            for application in applications:
+                await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await stopping.wait()
+    finally:
+        for application in applications:
+            if application.updater.running:
+                await application.updater.stop()
+        # stop() traite les mises à jour déjà reçues ; les clients partagés
+        # ne sont fermés qu'une fois tous les bots arrêtés
+        for application in applications:
+            if application.running:
+                await application.stop()
+        for application in applications:
+            await application.shutdown()
+        await on_stop(applications[0])
+
+
+def serve(configs: list, build_application, mode: str, on_start, on_stop, metrics=None) -> None:
+    """Sert tous les bots de ``configs`` jusqu'à SIGINT ou SIGTERM."""
+    if mode == 'webhook' and not (os.getenv('WEBHOOK_URL') and os.getenv('WEBHOOK_SECRET')):
+        raise ValueError("Le mode webhook nécessite WEBHOOK_URL et WEBHOOK_SECRET")
+    default = '256' if mode == 'webhook' else '0'
+    applications = build_applications(configs, build_application,
+                                      concurrent_updates=int(os.getenv('CONCURRENT_UPDATES', default)),
+                                      metrics=metrics)
+    asyncio.run(_serve(configs, applications, mode, on_start, on_stop))
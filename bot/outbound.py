@@ -0,0 +1,382 @@
+"""Ordonnanceur des appels sortants vers l'API Telegram.
+
+Telegram limite un bot à environ 30 messages par seconde au total et à
+environ un message par seconde dans une même conversation, et répond
+``RetryAfter`` (HTTP 429) au-delà. ``OutboundScheduler`` s'insère dans
+python-telegram-bot comme ``rate_limiter`` et fait passer chaque appel par :
+
+- un seau à jetons global et un seau par conversation ;
+- une file par conversation (les messages d'une conversation partent dans
+  l'ordre, un seul à la fois) ;
+- une priorité absolue pour ``answerCallbackQuery``, qui arrête le sablier
+  du bouton et n'est pas soumis aux limites de messages ;
+- la fusion des modifications en attente d'un même message : seule la plus
+  récente (la dernière question affichée) est envoyée ;
+- une pause automatique de la conversation (ou du bot) sur ``RetryAfter``,
+  suivie d'une nouvelle tentative.
+
+``stats()`` expose la profondeur des files et les temps d'attente, par
+voie (réponses aux boutons, messages) ; ``Metrics.track_outbound`` les
+publie sur ``/metrics`` (voir bot/metrics.py).
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Priorités (la plus petite passe en premier)
+PRIORITY_CALLBACK_ANSWER = 0
+PRIORITY_MESSAGE = 1
+
+# Nom de la voie de chaque priorité, pour la supervision
+LANES = ('callback_answer', 'message')
+
+# Attentes récentes conservées par voie pour le p95 de ``stats()``
+_RECENT_WAITS = 1024
+
+# Méthodes dont seule la dernière version en attente est utile
+_EDIT_METHODS = frozenset({'editMessageText', 'editMessageReplyMarkup'})
+
+# Intervalle de nettoyage des conversations inactives (s)
+_PRUNE_INTERVAL = 30.0
+
+
+def _resolve(future, result=None, exception=None) -> None:
+    """Termine ``future`` sauf si l'appelant a déjà abandonné (annulation)."""
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+def _p95(values) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(0.95 * (len(values) - 1)))]
+
+
+class TokenBucket:
+    """Seau à jetons : ``rate`` jetons par seconde, au plus ``capacity`` en réserve."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Temps d'attente avant qu'un jeton soit disponible."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('callback', 'args', 'kwargs', 'endpoint', 'chat_id', 'edit_key',
+                 'priority', 'future', 'enqueued', 'retries')
+
+    def __init__(self, callback, args, kwargs, endpoint, chat_id, edit_key, priority, future, enqueued):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.endpoint = endpoint
+        self.chat_id = chat_id
+        self.edit_key = edit_key
+        self.priority = priority
+        self.future = future
+        self.enqueued = enqueued
+        self.retries = 0
+
+
+class _Lane:
+    """File d'une conversation."""
+
+    __slots__ = ('queue', 'edits', 'bucket', 'busy', 'scheduled', 'paused_until')
+
+    def __init__(self, bucket: TokenBucket):
+        self.queue = deque()
+        # Modifications encore en file, par message
+        self.edits = {}
+        self.bucket = bucket
+        self.busy = False
+        self.scheduled = False
+        self.paused_until = 0.0
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Rate limiter de python-telegram-bot respectant les limites de Telegram."""
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0,
+                 chat_burst: float = 3.0, global_burst: float = 1.0, max_retries: int = 3):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        # Réserve globale réduite : le débit global reste lissé sur chaque seconde
+        self._global = TokenBucket(global_rate, global_burst, time.monotonic())
+        self._paused_until = 0.0
+        self._lanes = {}
+        # Conversations en attente de leur seau : (instant prêt, conversation)
+        self._waiting = []
+        # Appels prêts à partir : (priorité, numéro d'ordre, appel)
+        self._runnable = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._last_prune = time.monotonic()
+
+        # Statistiques
+        self._queued = 0
+        self._in_flight = 0
+        self._sent = 0
+        self._merged = 0
+        self._retried = 0
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent_waits = tuple(deque(maxlen=_RECENT_WAITS) for _ in LANES)
+
+    async def initialize(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name='outbound-scheduler')
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Les appels encore en file ne partiront plus
+        for _, _, job in self._runnable:
+            job.future.cancel()
+        for lane in self._lanes.values():
+            for job in lane.queue:
+                job.future.cancel()
+        self._runnable.clear()
+        self._waiting.clear()
+        self._lanes.clear()
+        self._queued = 0
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if endpoint == 'answerCallbackQuery':
+            priority = PRIORITY_CALLBACK_ANSWER
+        elif chat_id is not None:
+            priority = PRIORITY_MESSAGE
+        else:
+            # getMe, getUpdates, setWebhook… ne sont pas des messages
+            return await callback(*args, **kwargs)
+
+        if self._task is None:
+            return await callback(*args, **kwargs)
+
+        now = time.monotonic()
+        edit_key = None
+        if endpoint in _EDIT_METHODS and data.get('message_id') is not None:
+            edit_key = (endpoint, data['message_id'])
+        job = _Job(callback, args, kwargs, endpoint, chat_id, edit_key, priority,
+                   asyncio.get_running_loop().create_future(), now)
+
+        if priority == PRIORITY_CALLBACK_ANSWER:
+            self._push_runnable(job)
+        else:
+            self._enqueue(job, now)
+        self._wakeup.set()
+        return await job.future
+
+    # -- Files ----------------------------------------------------------------
+
+    def _push_runnable(self, job: _Job) -> None:
+        self._queued += 1
+        heapq.heappush(self._runnable, (job.priority, next(self._sequence), job))
+
+    def _lane(self, chat_id, now: float) -> _Lane:
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _Lane(TokenBucket(self.chat_rate, self.chat_burst, now))
+        return lane
+
+    def _enqueue(self, job: _Job, now: float) -> None:
+        lane = self._lane(job.chat_id, now)
+        pending = lane.edits.get(job.edit_key) if job.edit_key else None
+        if pending is not None:
+            # Une version plus récente remplace la modification encore en file
+            _resolve(pending.future, True)
+            pending.callback, pending.args, pending.kwargs = job.callback, job.args, job.kwargs
+            pending.future = job.future
+            self._merged += 1
+            return
+        lane.queue.append(job)
+        if job.edit_key:
+            lane.edits[job.edit_key] = job
+        self._queued += 1
+        self._schedule(job.chat_id, lane, now)
+
+    def _schedule(self, chat_id, lane: _Lane, now: float) -> None:
+        """Programme l'envoi du prochain message d'une conversation inactive."""
+        if lane.busy or lane.scheduled or not lane.queue:
+            return
+        lane.scheduled = True
+        ready = now + max(lane.bucket.delay(now), lane.paused_until - now)
+        heapq.heappush(self._waiting, (ready, next(self._sequence), chat_id))
+
+    def _promote(self, chat_id) -> None:
+        lane = self._lanes[chat_id]
+        lane.scheduled = False
+        job = lane.queue.popleft()
+        if job.edit_key:
+            lane.edits.pop(job.edit_key, None)
+        lane.busy = True
+        self._queued -= 1
+        self._push_runnable(job)
+
+    # -- Boucle d'envoi -------------------------------------------------------
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._waiting)
+                self._promote(chat_id)
+
+            timeout = None
+            if self._runnable:
+                _, _, job = self._runnable[0]
+                delay = self._paused_until - now
+                if job.priority != PRIORITY_CALLBACK_ANSWER:
+                    delay = max(delay, self._global.delay(now))
+                if delay <= 0:
+                    heapq.heappop(self._runnable)
+                    self._queued -= 1
+                    self._dispatch(job, now)
+                    continue
+                timeout = delay
+            if self._waiting:
+                next_ready = self._waiting[0][0] - now
+                timeout = next_ready if timeout is None else min(timeout, next_ready)
+
+            if now - self._last_prune > _PRUNE_INTERVAL:
+                self._prune(now)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, job: _Job, now: float) -> None:
+        if job.priority != PRIORITY_CALLBACK_ANSWER:
+            self._global.take(now)
+            self._lanes[job.chat_id].bucket.take(now)
+        waited = now - job.enqueued
+        self._wait_count += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        self._recent_waits[job.priority].append(waited)
+        self._in_flight += 1
+        asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: _Job) -> None:
+        retry = False
+        try:
+            result = await job.callback(*job.args, **job.kwargs)
+        except RetryAfter as exc:
+            delay = exc.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            logger.warning("Limite Telegram atteinte (%s), pause de %.1f s", job.endpoint, delay)
+            pause_until = time.monotonic() + delay
+            if job.chat_id is not None:
+                self._lanes[job.chat_id].paused_until = pause_until
+            else:
+                self._paused_until = max(self._paused_until, pause_until)
+            job.retries += 1
+            self._retried += 1
+            if job.retries > self.max_retries:
+                _resolve(job.future, exception=exc)
+            else:
+                retry = True
+        except Exception as exc:
+            _resolve(job.future, exception=exc)
+        else:
+            self._sent += 1
+            _resolve(job.future, result)
+        finally:
+            self._in_flight -= 1
+
+        now = time.monotonic()
+        if job.chat_id is None:
+            if retry:
+                self._push_runnable(job)
+        else:
+            lane = self._lanes[job.chat_id]
+            lane.busy = False
+            if retry:
+                # En tête de file pour conserver l'ordre de la conversation
+                lane.queue.appendleft(job)
+                self._queued += 1
+            self._schedule(job.chat_id, lane, now)
+        self._wakeup.set()
+
+    def _prune(self, now: float) -> None:
+        """Oublie les conversations inactives dont le seau est plein."""
+        self._last_prune = now
+        idle = [
+            chat_id for chat_id, lane in self._lanes.items()
+            if not lane.queue and not lane.busy and lane.paused_until <= now and lane.bucket.is_full(now)
+        ]
+        for chat_id in idle:
+            del self._lanes[chat_id]
+
+    # -- Supervision ----------------------------------------------------------
+
+    def stats(self) -> dict:
+        """Instantané des files et des temps d'attente, pour la supervision.
+
+        ``wait_seconds_p95`` porte sur les ``_RECENT_WAITS`` derniers envois
+        de chaque voie.
+        """
+        answers = sum(1 for priority, _, _ in self._runnable if priority == PRIORITY_CALLBACK_ANSWER)
+        return {
+            'queue_depth': self._queued,
+            'queue_depth_by_lane': {'callback_answer': answers, 'message': self._queued - answers},
+            'in_flight': self._in_flight,
+            'active_chats': len(self._lanes),
+            'sent': self._sent,
+            'merged_edits': self._merged,
+            'retried': self._retried,
+            'wait_count': self._wait_count,
+            'wait_seconds_total': self._wait_total,
+            'wait_seconds_max': self._wait_max,
+            'wait_seconds_avg': self._wait_total / self._wait_count if self._wait_count else 0.0,
+            'wait_seconds_p95': {lane: _p95(waits) for lane, waits in zip(LANES, self._recent_waits)},
+        }
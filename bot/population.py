@@ -0,0 +1,372 @@
+"""Statistiques de population des résultats, tenues en flux.
+
+Chaque test terminé met à jour les esquisses de son test, sans conserver
+de ligne :
+
+- un histogramme par colonne de score (``Questionnaire.score_maximums``) :
+  exact, une case par valeur, pour les scores entiers (PHQ-9 : 0 à 27,
+  GAD-7 : 0 à 21, traits du Big Five) ; à ``RESOLUTION`` cases de largeur
+  fixe sur ``[0, maximum]`` pour les scores fractionnaires (poids non
+  entiers dans une définition) ;
+- un histogramme exact par colonne codée (tranche de sévérité, type MBTI),
+  pour les distributions ;
+- un HyperLogLog des utilisateurs distincts (``HLL_PRECISION`` bits
+  d'index, 4 Kio, erreur type d'environ 1,6 %).
+
+Toutes ces esquisses se fusionnent exactement : les histogrammes
+s'additionnent, les registres HyperLogLog se combinent par maximum. Le
+rang d'un score (``Population.percentile``) est une lecture dans une table
+de rangs cumulés, reconstruite au plus une fois par ``RANK_REFRESH``
+secondes (une somme cumulée sur quelques dizaines de cases) : le rang
+affiché peut ignorer les résultats de la dernière seconde, jamais plus.
+
+Avec ``POPULATION_DIR``, chaque processus écrit ses propres esquisses dans
+``population-<nom>.npz`` toutes les ``POPULATION_SNAPSHOT_INTERVAL``
+secondes, relit celles des autres processus (workers du mode
+multi-processus, autres instances) et les ajoute à sa vue. Au redémarrage,
+un processus repart de son fichier. Les processus sont nommés par
+``SHARD_INDEX`` (``main`` hors mode multi-processus) : deux processus ne
+doivent pas partager un nom.
+
+Usage (distributions fusionnées de tous les processus) :
+    python -m bot.population population/
+"""
+
+import argparse
+import hashlib
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from psy import registry
+
+logger = logging.getLogger(__name__)
+
+# Cases des histogrammes de scores fractionnaires
+RESOLUTION = 1024
+# Bits d'index des HyperLogLog : 2**12 registres d'un octet
+HLL_PRECISION = 12
+_HLL_REGISTERS = 1 << HLL_PRECISION
+_HLL_TAIL_BITS = 64 - HLL_PRECISION
+_HLL_TAIL_MASK = (1 << _HLL_TAIL_BITS) - 1
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / _HLL_REGISTERS)
+# Âge maximal (secondes) d'une table de rangs
+RANK_REFRESH = 1.0
+
+
+class ScoreHistogram:
+    """Histogramme fusionnable d'une colonne, sur ``[0, maximum]``."""
+
+    __slots__ = ('scale', 'counts', 'external', '_ranks', '_total', '_built')
+
+    def __init__(self, maximum, integral: bool = True):
+        if integral:
+            self.scale = 1
+            bins = int(maximum) + 1
+        else:
+            self.scale = RESOLUTION / maximum if maximum else 1
+            bins = RESOLUTION + 1
+        # Résultats de ce processus : liste, incrémentée sans passer par numpy
+        self.counts = [0] * bins
+        # Somme des autres processus (instantanés relus), ou None
+        self.external = None
+        self._ranks = None
+        self._total = 0
+        self._built = 0.0
+
+    def bin(self, value) -> int:
+        index = int(value * self.scale)
+        return min(max(index, 0), len(self.counts) - 1)
+
+    def add(self, value) -> None:
+        self.counts[self.bin(value)] += 1
+
+    def merged(self) -> np.ndarray:
+        """Effectifs de tous les processus connus."""
+        counts = np.array(self.counts, dtype=np.int64)
+        if self.external is not None:
+            counts += self.external
+        return counts
+
+    def set_external(self, counts) -> None:
+        self.external = counts
+        self._ranks = None
+
+    def _rank_table(self):
+        # Rang médian de chaque case : inférieurs + moitié des ex æquo
+        counts = self.merged()
+        below = np.cumsum(counts) - counts
+        self._total = int(counts.sum())
+        self._ranks = ((below + counts / 2) / max(self._total, 1) * 100).tolist()
+        self._built = time.monotonic()
+        return self._ranks
+
+    def percentile(self, value):
+        """``(rang centile, effectif)`` de ``value`` dans la population."""
+        ranks = self._ranks
+        if ranks is None or time.monotonic() - self._built >= RANK_REFRESH:
+            ranks = self._rank_table()
+        return ranks[self.bin(value)], self._total
+
+    def quantile(self, fraction: float) -> float:
+        """Plus petite valeur dont le rang cumulé atteint ``fraction`` (borne de case)."""
+        cumulative = np.cumsum(self.merged())
+        if not cumulative[-1]:
+            return math.nan
+        index = int(np.searchsorted(cumulative, fraction * cumulative[-1]))
+        return index / self.scale
+
+
+class HyperLogLog:
+    """Estimation du nombre d'utilisateurs distincts, fusionnable."""
+
+    __slots__ = ('registers', 'external')
+
+    def __init__(self):
+        self.registers = bytearray(_HLL_REGISTERS)
+        self.external = None
+
+    def add(self, user_id: int) -> None:
+        digest = hashlib.blake2b(user_id.to_bytes(8, 'little', signed=True), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'little')
+        index = hashed >> _HLL_TAIL_BITS
+        # Position du premier bit à 1 dans les bits restants
+        rank = _HLL_TAIL_BITS - (hashed & _HLL_TAIL_MASK).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merged(self) -> np.ndarray:
+        registers = np.frombuffer(self.registers, dtype=np.uint8).copy()
+        if self.external is not None:
+            np.maximum(registers, self.external, out=registers)
+        return registers
+
+    def estimate(self) -> int:
+        registers = self.merged()
+        raw = _HLL_ALPHA * _HLL_REGISTERS ** 2 / np.ldexp(1.0, -registers.astype(np.int32)).sum()
+        zeros = int(np.count_nonzero(registers == 0))
+        # Petits effectifs : comptage linéaire des registres vides
+        if raw <= 2.5 * _HLL_REGISTERS and zeros:
+            return round(_HLL_REGISTERS * math.log(_HLL_REGISTERS / zeros))
+        return round(raw)
+
+
+class _TestStats:
+    """Esquisses d'un test."""
+
+    __slots__ = ('columns', 'levels', 'labels', 'users', 'count', 'external_count')
+
+    def __init__(self, questionnaire):
+        self.columns = {
+            name: ScoreHistogram(maximum, isinstance(maximum, int))
+            for name, maximum in questionnaire.score_maximums.items()
+        }
+        self.levels = {name: ScoreHistogram(len(labels) - 1) for name, labels in questionnaire.result_levels.items()}
+        self.labels = questionnaire.result_levels
+        self.users = HyperLogLog()
+        self.count = 0
+        self.external_count = 0
+
+    def add(self, user_id: int, scored: dict) -> None:
+        self.count += 1
+        for name, histogram in self.columns.items():
+            histogram.add(scored[name])
+        for name, histogram in self.levels.items():
+            histogram.add(scored[name])
+        self.users.add(user_id)
+
+    def total(self) -> int:
+        return self.count + self.external_count
+
+    def arrays(self, prefix: str) -> dict:
+        """Esquisses de ce processus, à écrire dans un instantané."""
+        arrays = {f'{prefix}count': np.array([self.count], dtype=np.int64),
+                  f'{prefix}users': np.frombuffer(self.users.registers, dtype=np.uint8).copy()}
+        for kind, histograms in (('columns', self.columns), ('levels', self.levels)):
+            for name, histogram in histograms.items():
+                arrays[f'{prefix}{kind}/{name}'] = np.array(histogram.counts, dtype=np.int64)
+        return arrays
+
+
+class Population:
+    """Esquisses de tous les tests, et leurs instantanés dans ``directory``."""
+
+    def __init__(self, questionnaires: list, directory: str = None, name: str = 'main', min_results: int = 100):
+        self.tests = {
+            questionnaire.id: _TestStats(questionnaire)
+            for questionnaire in questionnaires if questionnaire.score is not None
+        }
+        self.directory = Path(directory) if directory else None
+        self.name = name
+        self.min_results = min_results
+        # Un instantané périodique annulé continue dans son thread : pas deux écritures à la fois
+        self._snapshot_lock = threading.Lock()
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._load_own()
+            self.refresh()
+
+    @property
+    def path(self) -> Path:
+        return self.directory / f'population-{self.name}.npz'
+
+    # -- Chemin des résultats ---------------------------------------------------
+
+    def record(self, user_id: int, test_id: str, responses) -> dict:
+        """Ajoute un résultat ; retourne ses colonnes calculées (``{}`` si le test n'est pas suivi)."""
+        stats = self.tests.get(test_id)
+        if stats is None:
+            return {}
+        scored = registry.get(test_id).scored(responses)
+        stats.add(user_id, scored)
+        return scored
+
+    def percentile(self, test_id: str, column: str, value):
+        """``(rang centile, effectif)`` de ``value``, ou ``None`` sous ``min_results`` résultats."""
+        stats = self.tests.get(test_id)
+        if stats is None or column not in stats.columns or stats.total() < self.min_results:
+            return None
+        return stats.columns[column].percentile(value)
+
+    # -- Instantanés ------------------------------------------------------------
+
+    def snapshot(self) -> None:
+        """Écrit les esquisses de ce processus, puis relit celles des autres.
+
+        Peut être appelé depuis un thread : les esquisses sont copiées avant
+        l'écriture, pendant que la boucle continue d'en ajouter.
+        """
+        if self.directory is None:
+            return
+        with self._snapshot_lock:
+            arrays = {}
+            for test_id, stats in self.tests.items():
+                arrays.update(stats.arrays(f'{test_id}/'))
+            temporary = self.path.with_suffix('.tmp.npz')
+            np.savez(temporary, **arrays)
+            os.replace(temporary, self.path)
+            self.refresh()
+
+    def _load_own(self) -> None:
+        if not self.path.exists():
+            return
+        for test_id, arrays in _read(self.path).items():
+            stats = self.tests.get(test_id)
+            if stats is None:
+                continue
+            stats.count = int(arrays['count'][0])
+            stats.users.registers[:] = arrays['users'].tobytes()
+            for kind, histograms in (('columns', stats.columns), ('levels', stats.levels)):
+                for name, histogram in histograms.items():
+                    counts = arrays.get(f'{kind}/{name}')
+                    if counts is not None and len(counts) == len(histogram.counts):
+                        histogram.counts = counts.tolist()
+        logger.info("Statistiques de population reprises de %s", self.path)
+
+    def refresh(self) -> None:
+        """Remplace la part des autres processus par la somme de leurs instantanés."""
+        totals = {}
+        for path in sorted(self.directory.glob('population-*.npz')):
+            if path == self.path or path.name.endswith('.tmp.npz'):
+                continue
+            try:
+                snapshot = _read(path)
+            except (OSError, ValueError) as exc:
+                logger.warning("Instantané illisible %s : %s", path, exc)
+                continue
+            _accumulate(totals, snapshot)
+
+        for test_id, stats in self.tests.items():
+            arrays = totals.get(test_id, {})
+            stats.external_count = int(arrays['count'][0]) if 'count' in arrays else 0
+            stats.users.external = arrays.get('users')
+            for kind, histograms in (('columns', stats.columns), ('levels', stats.levels)):
+                for name, histogram in histograms.items():
+                    counts = arrays.get(f'{kind}/{name}')
+                    # Un processus qui a d'autres bornes (définition modifiée) est ignoré
+                    if counts is not None and len(counts) != len(histogram.counts):
+                        logger.warning("Instantané incompatible pour %s/%s, ignoré", test_id, name)
+                        counts = None
+                    histogram.set_external(counts)
+
+    # -- Lecture ----------------------------------------------------------------
+
+    def distributions(self) -> dict:
+        """Vue fusionnée par test : résultats, utilisateurs, histogrammes des scores, effectifs par niveau."""
+        return {
+            test_id: {
+                'count': stats.total(),
+                'users': stats.users.estimate(),
+                'columns': {name: histogram for name, histogram in stats.columns.items()},
+                'levels': {
+                    name: dict(zip(stats.labels[name], histogram.merged().tolist()))
+                    for name, histogram in stats.levels.items()
+                },
+            }
+            for test_id, stats in self.tests.items()
+        }
+
+
+def _read(path) -> dict:
+    """Instantané ``path`` : test -> {nom de tableau: tableau}."""
+    tests = {}
+    with np.load(path) as archive:
+        for key in archive.files:
+            test_id, _, name = key.partition('/')
+            tests.setdefault(test_id, {})[name] = archive[key]
+    return tests
+
+
+def _accumulate(totals: dict, snapshot: dict) -> None:
+    for test_id, arrays in snapshot.items():
+        target = totals.setdefault(test_id, {})
+        for name, values in arrays.items():
+            if name not in target:
+                target[name] = values.copy()
+            elif name == 'users':
+                np.maximum(target[name], values, out=target[name])
+            elif len(target[name]) == len(values):
+                target[name] += values
+
+
+def create_population(questionnaires: list):
+    """Statistiques configurées par ``POPULATION_*``, ou ``None`` si ``POPULATION_STATS=0``."""
+    if os.getenv('POPULATION_STATS', '1') != '1':
+        return None
+    return Population(
+        questionnaires,
+        directory=os.getenv('POPULATION_DIR') or None,
+        name=os.getenv('SHARD_INDEX') or 'main',
+        min_results=int(os.getenv('POPULATION_MIN_RESULTS', '100')),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help="répertoire POPULATION_DIR")
+    args = parser.parse_args()
+
+    if not any(Path(args.directory).glob('population-*.npz')):
+        sys.exit(f"Aucun instantané dans {args.directory}")
+    # Vue d'un lecteur sans résultats propres : tous les fichiers sont « externes »
+    population = Population(registry.all_questionnaires(), args.directory, name='-', min_results=0)
+    for test_id, test in population.distributions().items():
+        print(f"{test_id} : {test['count']} résultats, ~{test['users']} utilisateurs")
+        for name, histogram in test['columns'].items():
+            quartiles = '  '.join(f"{histogram.quantile(fraction):g}" for fraction in (0.25, 0.5, 0.75))
+            print(f"  {name:<20} quartiles {quartiles}")
+        for name, counts in test['levels'].items():
+            print(f"  {name} :")
+            for label, count in counts.items():
+                share = count / test['count'] * 100 if test['count'] else 0.0
+                print(f"    {label:<30}{count:>10}{share:>7.1f} %")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Enregistrement des mises à jour reçues, pour les rejouer hors ligne.
+
+Activé par ``UPDATE_LOG_DIR`` : chaque mise à jour traitée par le bot est
+ajoutée, avec son instant de réception, à un journal NDJSON compressé
+(gzip) de ce répertoire. ``benchmarks/replay.py`` rejoue ensuite ce
+journal dans les handlers réels, contre le faux serveur Telegram, pour
+reproduire un bug ou comparer les performances de deux commits sur le
+même trafic.
+
+Le journal ne garde que ce que les handlers lisent :
+
+- les identifiants d'utilisateur et de conversation sont remplacés par un
+  HMAC-SHA256 tronqué à 48 bits (clé ``UPDATE_LOG_SECRET``, par défaut le
+  token), stable d'un fichier à l'autre ;
+- prénom, nom et nom d'utilisateur disparaissent, la langue reste ;
+- d'un message, seule la commande est gardée (sans ses arguments) ; d'un
+  clic, les données du bouton et l'identifiant du message, sans son texte ;
+- les autres types de mises à jour ne sont pas enregistrés.
+
+Les boutons des sessions sans état (``bot/stateless.py``) sont signés
+avec le véritable identifiant de l'utilisateur : ils ne se rejouent pas.
+
+Comme le journal des résultats, ``record`` ne fait qu'ajouter la mise à
+jour à une liste ; un thread la réduit, la compresse et l'écrit toutes les
+``UPDATE_LOG_FLUSH_INTERVAL`` secondes. Un nouveau fichier est ouvert
+au-delà de ``UPDATE_LOG_MAX_BYTES`` octets compressés ; chaque processus
+écrit ses propres fichiers. La première ligne d'un fichier est un en-tête
+(``{"format": 1, ...}``), chaque ligne suivante une mise à jour :
+``{"t": secondes depuis le début de l'enregistrement, "b": espace du bot
+(omis pour le premier, voir bot/multibot.py), "u": mise à jour}``.
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def _command(text: str) -> dict:
+    command = text.split()[0]
+    return {'text': command, 'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]}
+
+
+class UpdateRecorder:
+    """Écrit les mises à jour reçues dans ``directory``, par lots et en arrière-plan."""
+
+    def __init__(self, directory: str, secret: bytes, max_bytes: int = 64 * 2**20, flush_interval: float = 1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._key = hashlib.sha256(secret).digest()
+        self._started = time.monotonic()
+        self._started_at = time.time()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._raw = None
+        self._file = None
+        self._sequence = 0
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="update-recorder-flusher", daemon=True)
+        self._flusher.start()
+
+    def record(self, update, namespace: int = 0) -> None:
+        """Ajoute ``update`` (``telegram.Update``, immuable) au prochain lot."""
+        entry = (time.monotonic() - self._started, namespace, update)
+        with self._lock:
+            self._pending.append(entry)
+
+    async def handle(self, update, context) -> None:
+        """Callback d'un ``TypeHandler(Update)`` du groupe -1, avant tous les autres."""
+        self.record(update, context.bot_data.get('namespace', 0))
+
+    # -- Réduction et pseudonymisation ----------------------------------------
+
+    def pseudonym(self, identifier) -> int:
+        """Identifiant stable et positif à la place de ``identifier``, non réversible sans le secret."""
+        if isinstance(identifier, int):
+            identifier = identifier.to_bytes(8, 'little', signed=True)
+        else:
+            identifier = str(identifier).encode()
+        return int.from_bytes(hmac.digest(self._key, identifier, 'sha256')[:6], 'little') + 1
+
+    def _user(self, user) -> dict:
+        reduced = {'id': self.pseudonym(user.id), 'is_bot': user.is_bot, 'first_name': 'User'}
+        if user.language_code:
+            reduced['language_code'] = user.language_code
+        return reduced
+
+    def _message(self, message, content: bool) -> dict:
+        # Message inaccessible (trop ancien) : date 0, comme dans l'API
+        date = message.date.timestamp() if message.date else 0
+        reduced = {'message_id': message.message_id, 'date': int(date),
+                   'chat': {'id': self.pseudonym(message.chat.id), 'type': message.chat.type}}
+        if getattr(message, 'from_user', None) is not None:
+            reduced['from'] = self._user(message.from_user)
+        if content and message.text and message.text.startswith('/'):
+            reduced.update(_command(message.text))
+        return reduced
+
+    def reduce(self, update):
+        """Forme JSON réduite et pseudonymisée de ``update`` (``telegram.Update``), ou ``None``.
+
+        Lit directement les attributs utiles : ``Update.to_dict`` coûterait
+        dix fois plus.
+        """
+        if update.message is not None:
+            return {'update_id': update.update_id, 'message': self._message(update.message, True)}
+        query = update.callback_query
+        if query is None:
+            return None
+        reduced = {'id': query.id, 'from': self._user(query.from_user),
+                   'chat_instance': str(self.pseudonym(query.chat_instance)), 'data': query.data or ''}
+        if query.message is not None:
+            reduced['message'] = self._message(query.message, False)
+        return {'update_id': update.update_id, 'callback_query': reduced}
+
+    # -- Écriture -----------------------------------------------------------
+
+    def _line(self, entry: dict) -> bytes:
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+    def _open(self) -> None:
+        self._sequence += 1
+        name = f"updates-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._sequence}.ndjson.gz"
+        path = os.path.join(self.directory, name)
+        self._raw = open(path, 'wb')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+        self._file.write(self._line({'format': FORMAT_VERSION, 'started': self._started_at}))
+        logger.info("Journal des mises à jour : %s", path)
+
+    def _close_file(self) -> None:
+        self._file.close()
+        self._raw.close()
+        self._file = self._raw = None
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+        lines = []
+        for offset, namespace, update in batch:
+            reduced = self.reduce(update)
+            if reduced is not None:
+                entry = {'t': round(offset, 4), 'u': reduced}
+                if namespace:
+                    entry['b'] = namespace
+                lines.append(self._line(entry))
+        if not lines:
+            return
+        with self._file_lock:
+            if self._file is not None and self._raw.tell() > self.max_bytes:
+                self._close_file()
+            if self._file is None:
+                self._open()
+            self._file.write(b''.join(lines))
+            # Bloc compressé complet : le fichier reste lisible si le processus s'arrête
+            self._file.flush()
+            self.written += len(lines)
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Échec de l'écriture du journal des mises à jour")
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join()
+        self.flush()
+        with self._file_lock:
+            if self._file is not None:
+                self._close_file()
+
+
+def read_log(paths):
+    """``(t, espace du bot, mise à jour)`` des journaux ``paths``, dans l'ordre des fichiers.
+
+    Un fichier tronqué (processus arrêté pendant une écriture) est lu
+    jusqu'à son dernier bloc complet.
+    """
+    for path in paths:
+        try:
+            with gzip.open(path, 'rb') as source:
+                for line in source:
+                    entry = json.loads(line)
+                    if 'format' in entry:
+                        if entry['format'] != FORMAT_VERSION:
+                            raise ValueError(f"{path} : format {entry['format']} non pris en charge")
+                        continue
+                    yield entry['t'], entry.get('b', 0), entry['u']
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError) as exc:
+            logger.warning("%s tronqué, lu jusqu'au dernier bloc complet : %s", path, exc)
+
+
+def create_recorder(default_secret: str):
+    """Enregistreur configuré par ``UPDATE_LOG_*``, ou ``None`` sans ``UPDATE_LOG_DIR``."""
+    directory = os.getenv('UPDATE_LOG_DIR')
+    if not directory:
+        return None
+    return UpdateRecorder(
+        directory,
+        (os.getenv('UPDATE_LOG_SECRET') or default_secret).encode(),
+        max_bytes=int(os.getenv('UPDATE_LOG_MAX_BYTES', str(64 * 2**20))),
+        flush_interval=float(os.getenv('UPDATE_LOG_FLUSH_INTERVAL', '1')),
+    )
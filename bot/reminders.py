@@ -0,0 +1,267 @@
+"""Rappels de dépistage : proposer de refaire un test quelques jours plus tard.
+
+Le PHQ-9 et le GAD-7 se refont toutes les deux semaines. Après leurs
+résultats, l'utilisateur peut demander un rappel (``follow_up_days`` de la
+définition du test). Les rappels sont gardés dans SQLite
+(``REMINDER_DB_PATH``), un par utilisateur et par test, indexés par
+échéance : des millions de rappels en attente ne coûtent que de la place
+sur disque.
+
+Seuls les rappels de la prochaine fenêtre (``window`` secondes, au plus
+``max_heap``) sont en mémoire, dans un tas trié par échéance. Le tas est
+rechargé par pages (pagination sur la clé ``(échéance, utilisateur,
+test)``) quand la fenêtre avance ; un rappel programmé dans la fenêtre y
+est ajouté directement. Une seule tâche asyncio attend la prochaine
+échéance : pas de minuterie par utilisateur.
+
+Les rappels échus partent par lots de ``batch_size``, à ``rate`` rappels
+par seconde au plus, pour laisser la limite d'envoi de Telegram au trafic
+interactif (voir ``bot/outbound.py``). Chaque lot est d'abord réclamé :
+ses lignes sont supprimées de la base, sous condition que l'échéance n'ait
+pas changé, dans une transaction. Un rappel reprogrammé ou annulé entre-
+temps reste dans le tas mais n'est pas réclamé. Après un redémarrage, les
+rappels échus pendant l'arrêt partent au premier lot ; un rappel n'est
+jamais envoyé deux fois, y compris par deux processus sur la même base,
+au prix de la perte des envois en cours si le processus s'arrête entre la
+réclamation et l'envoi.
+
+En mode multi-processus, tous les workers partagent la base et chacun
+n'envoie que les rappels de ses utilisateurs (``owns``) : le filtre est
+appliqué par la requête de chargement, et le tas d'un worker ne contient
+que ses propres rappels.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Clé de départ de la pagination : avant tout rappel
+_START = (float('-inf'), -2**63, '')
+
+
+class Reminder(NamedTuple):
+    """Rappel en attente ; l'ordre des champs est celui du tas."""
+
+    due: float
+    user_id: int
+    test_id: str
+    # Langue des messages (voir locales/)
+    language: str
+
+
+class ReminderStore:
+    """Rappels persistés dans SQLite (WAL), un par couple (utilisateur, test)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reminders ("
+            " user_id INTEGER NOT NULL,"
+            " test_id TEXT NOT NULL,"
+            " due REAL NOT NULL,"
+            " language TEXT NOT NULL,"
+            " PRIMARY KEY (user_id, test_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS reminders_due ON reminders (due, user_id, test_id)")
+
+    def schedule(self, reminders) -> None:
+        """Programme des rappels ; remplace ceux déjà prévus pour le même test."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO reminders (due, user_id, test_id, language) VALUES (?, ?, ?, ?)", reminders)
+            self._conn.execute("COMMIT")
+
+    def cancel(self, user_id: int, test_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM reminders WHERE user_id = ? AND test_id = ?", (user_id, test_id))
+            return cursor.rowcount > 0
+
+    def page(self, after: tuple, until: float, limit: int, owns=None) -> list:
+        """Rappels de clé ``(due, user_id, test_id)`` après ``after`` et d'échéance avant ``until``.
+
+        Avec ``owns(user_id)``, seulement ceux des utilisateurs retenus : la
+        limite porte sur ces rappels-là.
+        """
+        query = ("SELECT due, user_id, test_id, language FROM reminders"
+                 " WHERE (due, user_id, test_id) > (?, ?, ?) AND due < ?")
+        with self._lock:
+            if owns is not None:
+                self._conn.create_function('owned', 1, owns, deterministic=True)
+                query += " AND owned(user_id)"
+            rows = self._conn.execute(
+                query + " ORDER BY due, user_id, test_id LIMIT ?", (*after, until, limit)).fetchall()
+        return [Reminder(*row) for row in rows]
+
+    def claim(self, reminders: list) -> list:
+        """Supprime les rappels encore prévus à la même échéance ; retourne ceux-là seulement."""
+        claimed = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for reminder in reminders:
+                    cursor = self._conn.execute(
+                        "DELETE FROM reminders WHERE user_id = ? AND test_id = ? AND due = ?",
+                        (reminder.user_id, reminder.test_id, reminder.due))
+                    if cursor.rowcount:
+                        claimed.append(reminder)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM reminders").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ReminderScheduler:
+    """Tas des rappels de la prochaine fenêtre, au-dessus d'un ``ReminderStore``."""
+
+    def __init__(self, store: ReminderStore, owns=None, window: float = 3600.0, max_heap: int = 100_000,
+                 batch_size: int = 50, rate: float = 10.0):
+        self.store = store
+        self.owns = owns
+        self.window = window
+        self.max_heap = max_heap
+        self.batch_size = batch_size
+        self.rate = rate
+        self.sent = 0
+        self.failed = 0
+        self._heap = []
+        # Tous les rappels de clé inférieure ou égale sont dans le tas (ou déjà partis)
+        self._cursor = _START
+        # Borne de la page en cours de lecture (thread), pour ne pas perdre un
+        # rappel programmé pendant la lecture
+        self._loading = _START[0]
+        self._wakeup = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    async def schedule(self, user_id: int, test_id: str, due: float, language: str) -> Reminder:
+        """Programme (ou reprogramme) le rappel de ``test_id`` pour ``user_id``.
+
+        Seule l'écriture SQLite passe par un thread : le tas et l'événement
+        de réveil ne sont modifiés que dans la boucle asyncio.
+        """
+        reminder = Reminder(due, user_id, test_id, language)
+        await asyncio.to_thread(self.store.schedule, [reminder])
+        # Dans la partie chargée ou en cours de chargement : le tas le prend
+        # tout de suite (un doublon ne serait pas réclamé deux fois)
+        owned = self.owns is None or self.owns(user_id)
+        if owned and due <= max(self._cursor[0], self._loading):
+            heapq.heappush(self._heap, reminder)
+            if self._wakeup is not None and self._heap[0] is reminder:
+                self._wakeup.set()
+        return reminder
+
+    async def cancel(self, user_id: int, test_id: str) -> bool:
+        # L'entrée du tas, s'il y en a une, ne sera pas réclamée
+        return await asyncio.to_thread(self.store.cancel, user_id, test_id)
+
+    def _refill(self, until: float) -> list:
+        room = self.max_heap - len(self._heap)
+        if room <= 0:
+            return []
+        rows = self.store.page(self._cursor, until, room, self.owns)
+        # Page incomplète : tout ce qui échoit avant ``until`` est chargé
+        self._cursor = rows[-1][:3] if len(rows) == room else (until, _START[1], _START[2])
+        return rows
+
+    def load(self, now: float = None) -> int:
+        """Charge la fenêtre qui commence à ``now`` ; retourne le nombre de rappels ajoutés au tas."""
+        rows = self._refill((time.time() if now is None else now) + self.window)
+        for row in rows:
+            heapq.heappush(self._heap, row)
+        return len(rows)
+
+    def due(self, now: float) -> list:
+        """Retire du tas jusqu'à ``batch_size`` rappels échus."""
+        batch = []
+        while self._heap and self._heap[0].due <= now and len(batch) < self.batch_size:
+            batch.append(heapq.heappop(self._heap))
+        return batch
+
+    async def _deliver(self, send, reminder: Reminder) -> None:
+        try:
+            await send(reminder)
+            self.sent += 1
+        except Exception as exc:
+            # Utilisateur qui a bloqué le bot, compte supprimé… : rappel perdu
+            self.failed += 1
+            logger.info("Rappel %s non remis à %s : %s", reminder.test_id, reminder.user_id, exc)
+
+    async def fire(self, send, now: float) -> int:
+        """Réclame et envoie un lot de rappels échus ; retourne le nombre d'envois tentés."""
+        batch = self.due(now)
+        if not batch:
+            return 0
+        claimed = await asyncio.to_thread(self.store.claim, batch)
+        started = time.monotonic()
+        await asyncio.gather(*(self._deliver(send, reminder) for reminder in claimed))
+        # Au plus ``rate`` rappels par seconde, lot après lot
+        await asyncio.sleep(max(0.0, len(claimed) / self.rate - (time.monotonic() - started)))
+        return len(claimed)
+
+    async def run(self, send) -> None:
+        """Envoie les rappels à leur échéance avec ``send(reminder)``, jusqu'à annulation."""
+        self._wakeup = asyncio.Event()
+        while True:
+            now = time.time()
+            if self._cursor[0] < now + self.window / 2 and len(self._heap) < self.max_heap:
+                self._loading = now + self.window
+                try:
+                    rows = await asyncio.to_thread(self._refill, self._loading)
+                finally:
+                    self._loading = _START[0]
+                for row in rows:
+                    heapq.heappush(self._heap, row)
+            if self._heap and self._heap[0].due <= now:
+                await self.fire(send, now)
+                continue
+            # Prochaine échéance, ou avancée de la fenêtre s'il reste de la place dans le tas
+            delay = self.window / 4
+            if len(self._heap) < self.max_heap:
+                delay = min(delay, max(self._cursor[0] - self.window / 2 - now, 0.0))
+            if self._heap:
+                delay = min(delay, self._heap[0].due - now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0.001))
+            except asyncio.TimeoutError:
+                pass
+
+    def close(self) -> None:
+        self.store.close()
+
+
+def create_reminders(owns=None):
+    """Rappels configurés par ``REMINDER_*``, ou ``None`` sauf si ``REMINDERS=1``."""
+    if os.getenv('REMINDERS', '0') != '1':
+        return None
+    return ReminderScheduler(
+        ReminderStore(os.getenv('REMINDER_DB_PATH', 'reminders.db')),
+        owns=owns,
+        window=float(os.getenv('REMINDER_WINDOW', '3600')),
+        max_heap=int(os.getenv('REMINDER_MAX_HEAP', '100000')),
+        batch_size=int(os.getenv('REMINDER_BATCH', '50')),
+        rate=float(os.getenv('REMINDER_RATE', '10')),
+    )
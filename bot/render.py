@@ -0,0 +1,187 @@
+"""Cache immuable des messages rendus par le bot.
+
+Le texte et le clavier de chaque question ne dépendent que de la langue,
+du test et de l'index de la question : ils sont construits à la première
+demande puis partagés par tous les utilisateurs de cette langue. Pour un
+test adaptatif (``psy.cat``), la question posée dépend des réponses : les
+vues sont indexées par rang et question de la banque, un même clavier
+servant à tous les rangs. Les objets ``InlineKeyboardMarkup`` de
+python-telegram-bot sont immuables, ce qui rend ce partage sûr.
+
+Rien n'est construit à l'import : le menu d'une langue l'est avec sa
+première vue (``views``), la vue d'une question à son premier affichage,
+ce qui ne charge que les tests réellement passés (voir ``psy.registry``).
+"""
+
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import locales
+from bot import callbacks
+from psy import registry
+
+SPARK_LEVELS = '▁▂▃▄▅▆▇█'
+
+
+def question_keyboard(test_id: str, question_index: int, options, cancel_button) -> InlineKeyboardMarkup:
+    """Boutons des options d'une question, puis le bouton d'annulation."""
+    keyboard = [
+        [InlineKeyboardButton(option, callback_data=callbacks.encode(callbacks.ANSWER, test_id, question_index, i))]
+        for i, option in enumerate(options)
+    ]
+    keyboard.append([cancel_button])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def sparkline(values, maximum: float) -> str:
+    """Une barre par valeur, de ``▁`` (0) à ``█`` (``maximum``)."""
+    top = len(SPARK_LEVELS) - 1
+    return ''.join(SPARK_LEVELS[max(0, min(top, round(value / maximum * top)))] for value in values)
+
+
+def localized_questions(questionnaire, messages) -> list:
+    """Questions ``[(texte, options)]`` du test dans la langue de ``messages``.
+
+    La traduction du catalogue n'est retenue que si elle a autant de
+    questions, et d'options par question, que la définition.
+    """
+    translated = messages.get(f'{questionnaire.id}.questions')
+    if translated is None or len(translated) != len(questionnaire.questions) or any(
+        len(options) != len(expected) for (_, options), (_, expected) in zip(translated, questionnaire.questions)
+    ):
+        return questionnaire.questions
+    return translated
+
+
+class Views:
+    """Messages rendus d'une langue."""
+
+    def __init__(self, messages: locales.Catalog):
+        self.messages = messages
+        self.cancel_button = InlineKeyboardButton(
+            messages['test.cancel_button'], callback_data=callbacks.encode(callbacks.CANCEL))
+        menu_button = InlineKeyboardButton(messages['menu.main'], callback_data=callbacks.encode(callbacks.MENU, 'start'))
+        help_button = InlineKeyboardButton(messages['menu.help'], callback_data=callbacks.encode(callbacks.MENU, 'help'))
+
+        # Boutons du menu principal : les tests deux par deux, puis l'aide
+        test_buttons = [
+            InlineKeyboardButton(self.label(listing),
+                                 callback_data=callbacks.encode(callbacks.START_TEST, listing.id))
+            for listing in registry.available()
+        ]
+        self.main_menu = InlineKeyboardMarkup(
+            [test_buttons[i:i + 2] for i in range(0, len(test_buttons), 2)] + [[help_button]]
+        )
+        # Clavier proposé après l'affichage des résultats
+        self._after_results_rows = [
+            [InlineKeyboardButton(messages['menu.new_test'], callback_data=callbacks.encode(callbacks.MENU, 'new_test'))],
+            [menu_button]
+        ]
+        self.after_results = InlineKeyboardMarkup(self._after_results_rows)
+        # Clavier proposé après l'annulation d'un test
+        self.cancelled = InlineKeyboardMarkup([[menu_button], [help_button]])
+        self._menu_button = menu_button
+        self._questions = {}
+        self._reminders = {}
+
+    def label(self, questionnaire) -> str:
+        """Libellé d'un test (questionnaire ou en-tête du registre)."""
+        return self.messages.get(f'{questionnaire.id}.label', questionnaire.label)
+
+    def follow_up(self, listing) -> InlineKeyboardMarkup:
+        """Clavier d'après les résultats, avec l'offre d'un rappel dans ``listing.follow_up_days`` jours."""
+        key = ('offer', listing.id)
+        markup = self._reminders.get(key)
+        if markup is None:
+            offer = InlineKeyboardButton(self.messages.format('reminders.offer', days=listing.follow_up_days),
+                                         callback_data=callbacks.encode(callbacks.REMIND, listing.id, 'on'))
+            markup = self._reminders[key] = InlineKeyboardMarkup([[offer], *self._after_results_rows])
+        return markup
+
+    def reminder_cancel(self, test_id: str) -> InlineKeyboardMarkup:
+        """Clavier de la confirmation d'un rappel : l'annuler."""
+        key = ('cancel', test_id)
+        markup = self._reminders.get(key)
+        if markup is None:
+            cancel = InlineKeyboardButton(self.messages['reminders.cancel_button'],
+                                          callback_data=callbacks.encode(callbacks.REMIND, test_id, 'off'))
+            markup = self._reminders[key] = InlineKeyboardMarkup([[cancel]])
+        return markup
+
+    def reminder_due(self, test_id: str) -> InlineKeyboardMarkup:
+        """Clavier d'un rappel échu : refaire le test, ou le menu principal."""
+        key = ('due', test_id)
+        markup = self._reminders.get(key)
+        if markup is None:
+            markup = self._reminders[key] = InlineKeyboardMarkup([
+                [InlineKeyboardButton(self.messages['reminders.start_button'],
+                                      callback_data=callbacks.encode(callbacks.START_TEST, test_id))],
+                [self._menu_button]
+            ])
+        return markup
+
+    def history_entry(self, questionnaire, results: list) -> str:
+        """Évolution des derniers résultats ``[(date, colonnes)]`` d'un test (voir bot/history.py).
+
+        Une courbe par colonne numérique ; pour un test sans score (MBTI),
+        la suite des derniers types.
+        """
+        messages = self.messages
+        names = messages.get('history.columns', {})
+        date = time.strftime(messages['history.date_format'], time.localtime(results[-1][0]))
+        text = messages.format('history.test', name=self.label(questionnaire), count=len(results), date=date)
+        for column, maximum in questionnaire.score_maximums.items():
+            values = [scores[column] for _, scores in results if column in scores]
+            if values:
+                text += messages.format('history.trend', label=names.get(column, column),
+                                        sparkline=sparkline(values, maximum), last=values[-1], maximum=maximum)
+        if not questionnaire.score_maximums:
+            for column, labels in questionnaire.result_levels.items():
+                values = [labels[scores[column]] for _, scores in results if column in scores]
+                if values:
+                    text += messages.format('history.levels', label=names.get(column, column),
+                                            levels=' → '.join(values[-4:]))
+        return text
+
+    def question(self, questionnaire, question_index: int) -> tuple:
+        """``(texte, clavier)`` d'une question d'un test complet."""
+        key = (questionnaire.id, question_index)
+        view = self._questions.get(key)
+        if view is None:
+            questions = localized_questions(questionnaire, self.messages)
+            question_text, options = questions[question_index]
+            text = self.messages.format('test.question', number=question_index + 1, total=len(questions),
+                                        text=question_text)
+            view = self._questions[key] = (
+                text, question_keyboard(questionnaire.id, question_index, options, self.cancel_button))
+        return view
+
+    def adaptive_question(self, questionnaire, position: int, item: int) -> tuple:
+        """``(texte, clavier)`` de la question ``item`` de la banque, posée au rang ``position``.
+
+        Le clavier porte l'indice de la question dans la banque, pas son rang.
+        """
+        key = (questionnaire.id, position, item)
+        view = self._questions.get(key)
+        if view is None:
+            question_text, options = localized_questions(questionnaire, self.messages)[item]
+            markup = self._questions.get((questionnaire.id, None, item))
+            if markup is None:
+                markup = self._questions[questionnaire.id, None, item] = question_keyboard(
+                    questionnaire.id, item, options, self.cancel_button)
+            text = self.messages.format('test.adaptive_question', number=position + 1, text=question_text)
+            view = self._questions[key] = (text, markup)
+        return view
+
+
+_views = {}
+
+
+def views(language_code=None) -> Views:
+    """Messages rendus de la langue de ``language_code`` (voir ``locales.catalog``)."""
+    messages = locales.catalog(language_code)
+    rendered = _views.get(messages.code)
+    if rendered is None:
+        rendered = _views[messages.code] = Views(messages)
+    return rendered
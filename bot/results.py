@@ -0,0 +1,350 @@
+"""Journal des résultats de tests terminés.
+
+Activé par ``RESULT_LOG_DIR`` : chaque test terminé y est ajouté sous
+forme d'un enregistrement binaire de taille fixe (utilisateur
+pseudonymisé, test, date, réponses brutes, scores). Un fichier commence par
+un en-tête JSON qui décrit la disposition de ses enregistrements ; la suite
+du fichier est un tableau ``numpy`` que le lecteur projette en mémoire
+(``np.memmap``) sans créer d'objet Python par enregistrement.
+
+Sur le chemin des résultats, ``ResultLog.record`` ne fait qu'ajouter un
+tuple à une liste. Un thread d'arrière-plan calcule les scores par lots
+(fonctions ``score`` vectorisées de ``psy``), pseudonymise les
+utilisateurs (HMAC-SHA256 tronqué, clé ``RESULT_LOG_SECRET``) et ajoute le
+lot au fichier courant. Un nouveau fichier est ouvert au-delà de
+``RESULT_LOG_MAX_BYTES`` ; chaque processus écrit ses propres fichiers.
+
+Usage (agrégats sur un ou plusieurs fichiers) :
+    python -m bot.results results/*.rlog
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PSYRLOG1'
+FORMAT_VERSION = 1
+# Les enregistrements commencent à un multiple de cette taille
+HEADER_ALIGN = 64
+_HEADER_PREFIX = struct.Struct('<8sI')
+
+
+def record_dtype(answer_slots: int, score_slots: int) -> np.dtype:
+    """Disposition d'un enregistrement, alignée sur 8 octets."""
+    fields = [
+        ('user', '<u8'),
+        ('time', '<u4'),
+        ('test', 'u1'),
+        ('count', 'u1'),
+        ('scores', '<f4', (score_slots,)),
+        ('answers', 'u1', (answer_slots,)),
+    ]
+    packed = np.dtype(fields)
+    return np.dtype({
+        'names': packed.names,
+        'formats': [packed.fields[name][0] for name in packed.names],
+        'offsets': [packed.fields[name][1] for name in packed.names],
+        'itemsize': -(-packed.itemsize // 8) * 8,
+    })
+
+
+def describe(questionnaires: list) -> dict:
+    """En-tête d'un fichier : tests (code = position), colonnes de score et libellés."""
+    tests = []
+    for questionnaire in questionnaires:
+        columns = list(questionnaire.score(np.zeros((0, len(questionnaire.questions)), dtype=np.int16)))
+        tests.append({
+            'id': questionnaire.id,
+            'questions': len(questionnaire.questions),
+            'columns': columns,
+            'levels': {name: list(levels) for name, levels in questionnaire.result_levels.items()},
+        })
+    return {
+        'version': FORMAT_VERSION,
+        'tests': tests,
+        'answer_slots': max((test['questions'] for test in tests), default=0),
+        'score_slots': max((len(test['columns']) for test in tests), default=0),
+    }
+
+
+def encode_header(header: dict) -> bytes:
+    """En-tête binaire : signature, taille totale puis JSON, complété jusqu'à ``HEADER_ALIGN``."""
+    body = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode()
+    size = -(-(_HEADER_PREFIX.size + len(body)) // HEADER_ALIGN) * HEADER_ALIGN
+    return (_HEADER_PREFIX.pack(MAGIC, size) + body).ljust(size, b' ')
+
+
+class ResultLog:
+    """Écrit les résultats terminés dans ``directory``, par lots et en arrière-plan."""
+
+    def __init__(self, directory: str, secret: bytes, questionnaires: list,
+                 max_bytes: int = 256 * 2**20, flush_interval: float = 1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._key = hashlib.sha256(secret).digest()
+        self._questionnaires = [q for q in questionnaires if q.score is not None]
+        self._codes = {questionnaire.id: code for code, questionnaire in enumerate(self._questionnaires)}
+        self._question_counts = {questionnaire.id: len(questionnaire.questions) for questionnaire in self._questionnaires}
+        self._header = describe(self._questionnaires)
+        self._dtype = record_dtype(self._header['answer_slots'], self._header['score_slots'])
+        self._pending = []
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._file = None
+        self._file_size = 0
+        self._sequence = 0
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="result-log-flusher", daemon=True)
+        self._flusher.start()
+
+    @property
+    def record_size(self) -> int:
+        return self._dtype.itemsize
+
+    def record(self, user_id: int, test_id: str, responses) -> None:
+        """Ajoute un test terminé au prochain lot (sans calcul ni écriture)."""
+        if self._question_counts.get(test_id) == len(responses):
+            entry = (user_id, test_id, int(time.time()), bytes(responses))
+            with self._lock:
+                self._pending.append(entry)
+
+    def pseudonym(self, user_id: int) -> int:
+        """Clé stable de ``user_id``, non réversible sans le secret."""
+        digest = hmac.new(self._key, user_id.to_bytes(8, 'little', signed=True), hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], 'little')
+
+    # -- Écriture -----------------------------------------------------------
+
+    def _pack(self, batch: list) -> np.ndarray:
+        records = np.zeros(len(batch), dtype=self._dtype)
+        records['user'] = [self.pseudonym(user_id) for user_id, *_ in batch]
+        records['time'] = [timestamp for _, _, timestamp, _ in batch]
+        for test_id, code in self._codes.items():
+            rows = [index for index, entry in enumerate(batch) if entry[1] == test_id]
+            if not rows:
+                continue
+            questionnaire = self._questionnaires[code]
+            question_count = len(questionnaire.questions)
+            answers = np.frombuffer(b''.join(batch[index][3] for index in rows), dtype=np.uint8)
+            answers = answers.reshape(len(rows), question_count)
+            columns = questionnaire.score(answers.astype(np.int16))
+            records['test'][rows] = code
+            records['count'][rows] = question_count
+            records['answers'][rows, :question_count] = answers
+            for column, values in enumerate(columns.values()):
+                records['scores'][rows, column] = values
+        return records
+
+    def _open(self) -> None:
+        self._sequence += 1
+        name = f"results-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._sequence}.rlog"
+        path = os.path.join(self.directory, name)
+        self._file = open(path, 'ab')
+        header = encode_header(self._header)
+        self._file.write(header)
+        self._file_size = len(header)
+        logger.info("Journal des résultats : %s", path)
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+        records = self._pack(batch).tobytes()
+        with self._file_lock:
+            if self._file is None or self._file_size + len(records) > self.max_bytes:
+                if self._file is not None:
+                    self._file.close()
+                self._open()
+            self._file.write(records)
+            self._file.flush()
+            self._file_size += len(records)
+            self.written += len(batch)
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Échec de l'écriture du journal des résultats")
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join()
+        self.flush()
+        with self._file_lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+
+def create_result_log(questionnaires: list):
+    """Journal configuré par ``RESULT_LOG_*``, ou ``None`` sans ``RESULT_LOG_DIR``.
+
+    La clé des pseudonymes, ``RESULT_LOG_SECRET``, est obligatoire : le
+    token du bot ne convient pas, puisque qui le détient pourrait retrouver
+    les utilisateurs du journal, et qu'en changer changerait tous les
+    pseudonymes.
+    """
+    directory = os.getenv('RESULT_LOG_DIR')
+    if not directory:
+        return None
+    secret = os.getenv('RESULT_LOG_SECRET')
+    if not secret:
+        raise ValueError("RESULT_LOG_DIR nécessite RESULT_LOG_SECRET")
+    return ResultLog(
+        directory,
+        secret.encode(),
+        questionnaires,
+        max_bytes=int(os.getenv('RESULT_LOG_MAX_BYTES', str(256 * 2**20))),
+        flush_interval=float(os.getenv('RESULT_LOG_FLUSH_INTERVAL', '1')),
+    )
+
+
+# -- Lecture ----------------------------------------------------------------
+
+def open_log(path: str):
+    """En-tête et enregistrements d'un fichier, projetés en mémoire (lecture seule)."""
+    with open(path, 'rb') as handle:
+        magic, size = _HEADER_PREFIX.unpack(handle.read(_HEADER_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} n'est pas un journal de résultats")
+        header = json.loads(handle.read(size - _HEADER_PREFIX.size))
+    dtype = record_dtype(header['answer_slots'], header['score_slots'])
+    # Un enregistrement incomplet (arrêt brutal pendant l'écriture) est ignoré
+    count = (os.path.getsize(path) - size) // dtype.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode='r', offset=size, shape=(count,))
+
+
+class _TestTotals:
+    """Accumulateurs d'un test, fusionnés d'un fichier et d'un bloc à l'autre."""
+
+    def __init__(self, test: dict):
+        self.columns = test['columns']
+        self.levels = test['levels']
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.sums = np.zeros(len(self.columns))
+        self.squares = np.zeros(len(self.columns))
+        self.minimums = np.full(len(self.columns), np.inf)
+        self.maximums = np.full(len(self.columns), -np.inf)
+        self.level_counts = {name: np.zeros(len(levels), dtype=np.int64) for name, levels in self.levels.items()}
+        self.users = []
+
+    def add(self, scores: np.ndarray, users: np.ndarray, times: np.ndarray) -> None:
+        scores = scores[:, :len(self.columns)].astype(np.float64)
+        self.count += len(scores)
+        self.first = int(times.min()) if self.first is None else min(self.first, int(times.min()))
+        self.last = int(times.max()) if self.last is None else max(self.last, int(times.max()))
+        self.sums += scores.sum(axis=0)
+        self.squares += np.einsum('ij,ij->j', scores, scores)
+        self.minimums = np.minimum(self.minimums, scores.min(axis=0))
+        self.maximums = np.maximum(self.maximums, scores.max(axis=0))
+        for name, counts in self.level_counts.items():
+            codes = scores[:, self.columns.index(name)].astype(np.intp)
+            counts += np.bincount(codes, minlength=len(counts))[:len(counts)]
+        self.users.append(users)
+
+    def distinct_users(self) -> int:
+        # Un tri puis un comptage des ruptures : bien plus rapide que np.unique sur des clés aléatoires
+        users = np.concatenate(self.users)
+        users.sort()
+        return int(len(users) and 1 + np.count_nonzero(users[1:] != users[:-1]))
+
+    def summary(self) -> dict:
+        means = self.sums / self.count
+        stds = np.sqrt(np.maximum(self.squares / self.count - means * means, 0.0))
+        return {
+            'count': self.count,
+            'users': self.distinct_users(),
+            'first': self.first,
+            'last': self.last,
+            'columns': {
+                name: {'mean': means[index], 'std': stds[index], 'min': self.minimums[index],
+                       'max': self.maximums[index]}
+                for index, name in enumerate(self.columns) if name not in self.levels
+            },
+            'levels': {
+                name: dict(zip(self.levels[name], counts.tolist())) for name, counts in self.level_counts.items()
+            },
+        }
+
+
+def summarize(paths: list, chunk_size: int = 1 << 20) -> dict:
+    """Agrégats par test sur tous les fichiers, lus par blocs de ``chunk_size`` enregistrements.
+
+    Seules les colonnes utiles sont copiées, test par test ; la mémoire
+    nécessaire est celle d'un bloc plus huit octets par résultat pour
+    compter les utilisateurs distincts.
+    """
+    totals = {}
+    for path in paths:
+        header, records = open_log(path)
+        for test in header['tests']:
+            totals.setdefault(test['id'], _TestTotals(test))
+        for start in range(0, len(records), chunk_size):
+            chunk = np.asarray(records[start:start + chunk_size])
+            tests, scores, users, times = chunk['test'], chunk['scores'], chunk['user'], chunk['time']
+            for code, test in enumerate(header['tests']):
+                selected = tests == code
+                if selected.any():
+                    totals[test['id']].add(scores[selected], users[selected], times[selected])
+        del records
+    return {test_id: total.summary() for test_id, total in totals.items() if total.count}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m bot.results', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help="fichiers du journal (.rlog)")
+    parser.add_argument('--json', action='store_true', help="agrégats au format JSON")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    summary = summarize(args.paths)
+    elapsed = time.perf_counter() - started
+    if args.json:
+        json.dump(summary, sys.stdout, ensure_ascii=False, indent=2, default=float)
+        print()
+        return
+    total = sum(test['count'] for test in summary.values())
+    print(f"{total} résultats lus en {elapsed:.2f} s\n")
+    for test_id, test in summary.items():
+        period = ' → '.join(time.strftime('%Y-%m-%d', time.gmtime(moment)) for moment in (test['first'], test['last']))
+        print(f"{test_id} : {test['count']} résultats, {test['users']} utilisateurs ({period})")
+        for name, stats in test['columns'].items():
+            print(f"  {name:<20} moyenne {stats['mean']:7.2f}  écart-type {stats['std']:6.2f}  "
+                  f"min {stats['min']:g}  max {stats['max']:g}")
+        for name, counts in test['levels'].items():
+            print(f"  {name} :")
+            for level, count in counts.items():
+                print(f"    {level:<28}{count:>10}  {count / test['count'] * 100:5.1f} %")
+
+
+if __name__ == '__main__':
+    main()
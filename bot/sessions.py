@@ -0,0 +1,601 @@
+"""Stockage des sessions de questionnaire (``user_states``).
+
+Deux backends partagent la même interface de dictionnaire :
+
+- ``MemorySessionStore`` : un dictionnaire en mémoire, borné (nombre d'entrées,
+  taille estimée) avec éviction LRU et expiration des sessions inactives ;
+- ``SQLiteSessionStore`` : une base SQLite en mode WAL, avec écriture différée
+  (write-behind) et un cache LRU borné. Les écritures sont coalescées par
+  utilisateur et vidées par lots depuis un thread d'arrière-plan, de sorte
+  que la latence d'un clic n'inclut jamais de fsync ; ce thread fait aussi
+  expirer les sessions inactives.
+
+Une session est un ``Session`` : l'identifiant du test et les réponses
+dans un ``bytearray`` (un octet par réponse). Les handlers modifient la
+session puis la réassignent (``user_states[user_id] = session``) pour
+signaler la modification au store.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
+
+logger = logging.getLogger(__name__)
+
+# Marqueur d'une suppression en attente dans le lot d'écritures
+_DELETED = None
+
+# Session absente du cache et des écritures en attente : à lire en base
+_MISSING = object()
+
+# Raisons passées à ``on_evict``
+EVICTED_IDLE = 'idle'
+EVICTED_CAPACITY = 'capacity'
+
+
+class Session:
+    """Test en cours d'un utilisateur.
+
+    Environ 110 octets par session contre 260 pour l'ancien
+    dictionnaire à quatre clés : pas de ``__dict__``, identifiant de test
+    partagé (``sys.intern``) et un octet par réponse. La question courante
+    est le nombre de réponses déjà données.
+    """
+
+    __slots__ = ('test_id', 'responses')
+
+    def __init__(self, test_id: str, responses=b''):
+        self.test_id = sys.intern(test_id)
+        # Indices des options choisies ; ``calculate_result`` accepte tout
+        # itérable d'entiers, bytearray compris
+        self.responses = bytearray(responses)
+
+    @property
+    def current_question(self) -> int:
+        return len(self.responses)
+
+    def answer(self, answer_index: int) -> None:
+        self.responses.append(answer_index)
+
+    def to_dict(self) -> dict:
+        """Forme JSON historique, utilisée par le backend SQLite."""
+        return {
+            'current_test': self.test_id,
+            'current_question': len(self.responses),
+            'responses': list(self.responses),
+            'test_started': True
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Session':
+        return cls(data['current_test'], data['responses'])
+
+    def __eq__(self, other):
+        if not isinstance(other, Session):
+            return NotImplemented
+        return self.test_id == other.test_id and self.responses == other.responses
+
+    def __repr__(self):
+        return f"Session({self.test_id!r}, {list(self.responses)!r})"
+
+
+class SessionStore(MutableMapping):
+    """Interface commune des stores de sessions, indexés par ``user_id``."""
+
+    def flush(self) -> None:
+        """Rend durables les écritures en attente."""
+
+    def close(self) -> None:
+        """Vide les écritures en attente et libère les ressources."""
+        self.flush()
+
+    def stats(self) -> dict:
+        """Compteurs pour la supervision."""
+        return {'active': len(self)}
+
+    def count_by_test(self) -> Counter:
+        """Nombre de sessions en cours par test."""
+        return Counter(self[user_id].test_id for user_id in list(self))
+
+
+def estimate_size(state) -> int:
+    """Taille approximative d'une session en mémoire (octets)."""
+    size = sys.getsizeof(state)
+    if isinstance(state, Session):
+        return size + sys.getsizeof(state.responses)
+    if isinstance(state, dict):
+        # Les petits entiers et les identifiants de tests sont partagés par
+        # l'interpréteur : seuls les conteneurs comptent
+        size += sum(sys.getsizeof(value) for value in state.values())
+    return size
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions conservées uniquement en mémoire du processus.
+
+    Les entrées sont rangées de la moins récemment utilisée à la plus
+    récente : une lecture ou une écriture replace la session en fin de file.
+    Cet ordre sert à la fois à l'éviction LRU et à l'expiration, puisque les
+    sessions inactives depuis le plus longtemps sont en tête.
+
+    - ``max_entries`` / ``max_bytes`` : au-delà, les sessions les moins
+      récentes sont évincées (la taille est estimée par ``estimate_size``) ;
+    - ``idle_timeout`` : ``expire()`` retire les sessions inactives depuis
+      plus longtemps ; il est appelé périodiquement et à chaque écriture ;
+    - ``on_evict(user_id, state, reason)`` est appelé pour chaque session
+      retirée par le store (``EVICTED_IDLE`` ou ``EVICTED_CAPACITY``).
+
+    Sans paramètre, le store n'est pas borné (comportement historique).
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None,
+                 idle_timeout: float = None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict
+        # user_id -> [session, dernier accès, taille estimée]
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._expired = 0
+        self._evicted = 0
+
+    def __getitem__(self, user_id):
+        entry = self._data[user_id]
+        now = time.monotonic()
+        if self._is_idle(entry, now):
+            # Pas encore balayée : les sessions plus anciennes le sont aussi
+            self.expire(now)
+            raise KeyError(user_id)
+        entry[1] = now
+        self._data.move_to_end(user_id)
+        return entry[0]
+
+    def __setitem__(self, user_id, state):
+        now = time.monotonic()
+        size = estimate_size(state) if self.max_bytes else 0
+        entry = self._data.get(user_id)
+        if entry is None:
+            self._data[user_id] = [state, now, size]
+        else:
+            self._bytes -= entry[2]
+            entry[0], entry[1], entry[2] = state, now, size
+            self._data.move_to_end(user_id)
+        self._bytes += size
+        self.expire(now)
+        self._enforce_capacity()
+
+    def __delitem__(self, user_id):
+        entry = self._data.pop(user_id)
+        self._bytes -= entry[2]
+
+    def __contains__(self, user_id):
+        try:
+            self[user_id]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    # -- Bornes ---------------------------------------------------------------
+
+    def _is_idle(self, entry, now: float) -> bool:
+        return self.idle_timeout is not None and now - entry[1] > self.idle_timeout
+
+    def _evict_oldest(self, reason: str) -> None:
+        user_id, (state, _, size) = self._data.popitem(last=False)
+        self._bytes -= size
+        if reason == EVICTED_IDLE:
+            self._expired += 1
+        else:
+            self._evicted += 1
+        if self.on_evict is not None:
+            try:
+                self.on_evict(user_id, state, reason)
+            except Exception:
+                logger.exception("Échec du rappel d'éviction pour l'utilisateur %s", user_id)
+
+    def expire(self, now: float = None) -> int:
+        """Retire les sessions inactives depuis plus de ``idle_timeout`` ; retourne leur nombre."""
+        if self.idle_timeout is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        count = 0
+        while self._data:
+            oldest = next(iter(self._data.values()))
+            if not self._is_idle(oldest, now):
+                break
+            self._evict_oldest(EVICTED_IDLE)
+            count += 1
+        return count
+
+    def _enforce_capacity(self) -> None:
+        while self.max_entries is not None and len(self._data) > self.max_entries:
+            self._evict_oldest(EVICTED_CAPACITY)
+        # Toujours garder la session qui vient d'être écrite
+        while self.max_bytes and self._bytes > self.max_bytes and len(self._data) > 1:
+            self._evict_oldest(EVICTED_CAPACITY)
+
+    def count_by_test(self) -> Counter:
+        return Counter(entry[0].test_id for entry in self._data.values())
+
+    def stats(self) -> dict:
+        return {
+            'active': len(self._data),
+            'bytes': self._bytes if self.max_bytes else None,
+            'expired': self._expired,
+            'evicted': self._evicted,
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions persistées dans SQLite (WAL) avec écriture différée par lots.
+
+    Les lectures sont servies depuis un cache LRU local alimenté à la
+    demande (``max_cached`` sessions au plus). Les écritures sont
+    accumulées dans ``_pending`` (une seule entrée par utilisateur, la plus
+    récente) puis appliquées en une transaction toutes les
+    ``flush_interval`` secondes, ou dès que ``max_batch`` utilisateurs ont
+    des modifications en attente. Le lot en cours d'écriture reste visible
+    (``_flushing``) jusqu'au COMMIT : une lecture ne retombe jamais sur une
+    ligne plus ancienne que la dernière écriture.
+
+    - ``idle_timeout`` : le thread d'écriture supprime de la base les
+      sessions non modifiées depuis plus longtemps ; ``expire()``, appelé
+      depuis la boucle asyncio, appelle ensuite ``on_evict(user_id, state,
+      EVICTED_IDLE)`` pour chacune, sans requête SQL ;
+    - ``len()`` et ``count_by_test()`` lisent des compteurs tenus à chaque
+      lot : ils ne font pas de requête et retardent au plus d'un lot.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.5, max_batch: int = 512,
+                 max_cached: int = 10000, idle_timeout: float = None, on_evict=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_cached = max_cached
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict
+        self._cache = OrderedDict()
+        # user_id -> (JSON, test, instant de l'écriture) ou _DELETED
+        self._pending = {}
+        self._flushing = {}
+        # Sessions enregistrées par test, tenues à jour à chaque lot
+        self._counts = Counter()
+        # Sessions supprimées pour inactivité, pas encore passées à on_evict
+        self._expired_states = []
+        self._expired = 0
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id INTEGER PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " test_id TEXT,"
+            " updated_at REAL NOT NULL DEFAULT 0)"
+        )
+        self._migrate()
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        self._counts.update(dict(self._conn.execute("SELECT test_id, COUNT(*) FROM sessions GROUP BY test_id")))
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self._flusher.start()
+
+    def _migrate(self) -> None:
+        """Ajoute le test et l'instant de la dernière écriture aux bases d'avant l'expiration."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if 'updated_at' in columns:
+            return
+        self._conn.execute("BEGIN")
+        self._conn.execute("ALTER TABLE sessions ADD COLUMN test_id TEXT")
+        self._conn.execute("ALTER TABLE sessions ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+        # Les sessions existantes repartent d'un délai d'inactivité complet
+        self._conn.execute(
+            "UPDATE sessions SET test_id = json_extract(state, '$.current_test'), updated_at = ?",
+            (time.time(),)
+        )
+        self._conn.execute("COMMIT")
+
+    # -- Sérialisation -----------------------------------------------------
+
+    @staticmethod
+    def _encode(state) -> str:
+        if isinstance(state, Session):
+            state = state.to_dict()
+        return json.dumps(state, separators=(',', ':'))
+
+    @staticmethod
+    def _decode(raw: str):
+        data = json.loads(raw)
+        # Même format JSON qu'avant ``Session`` : les bases existantes restent lisibles
+        if isinstance(data, dict) and 'current_test' in data:
+            return Session.from_dict(data)
+        return data
+
+    @staticmethod
+    def _test_id(state):
+        if isinstance(state, Session):
+            return state.test_id
+        return state.get('current_test') if isinstance(state, dict) else None
+
+    # -- Cache -------------------------------------------------------------
+
+    def _remember(self, user_id, state) -> None:
+        """Met ``state`` en fin de cache et évince les sessions les moins récentes ; sous ``_lock``."""
+        self._cache[user_id] = state
+        self._cache.move_to_end(user_id)
+        while self.max_cached is not None and len(self._cache) > self.max_cached:
+            # Toujours en base ou en attente d'écriture : seule la copie décodée est perdue
+            self._cache.popitem(last=False)
+
+    def _lookup(self, user_id):
+        """Session connue sans lire la base, ou ``_MISSING`` ; sous ``_lock``.
+
+        Lève ``KeyError`` pour une suppression pas encore écrite.
+        """
+        state = self._cache.get(user_id, _MISSING)
+        if state is not _MISSING:
+            self._cache.move_to_end(user_id)
+            return state
+        # Les écritures en attente sont plus récentes que le lot en cours d'écriture
+        for writes in (self._pending, self._flushing):
+            if user_id in writes:
+                entry = writes[user_id]
+                if entry is _DELETED:
+                    raise KeyError(user_id)
+                state = self._decode(entry[0])
+                self._remember(user_id, state)
+                return state
+        return _MISSING
+
+    # -- Interface dictionnaire ---------------------------------------------
+
+    def __getitem__(self, user_id):
+        with self._lock:
+            state = self._lookup(user_id)
+        if state is not _MISSING:
+            return state
+        # Sous _db_lock, aucun lot ne peut être écrit entre la lecture et la
+        # vérification qui suit
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT state FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            with self._lock:
+                # Une écriture ou une suppression concurrente a pu arriver pendant la lecture
+                state = self._lookup(user_id)
+                if state is not _MISSING:
+                    return state
+                if row is None:
+                    raise KeyError(user_id)
+                state = self._decode(row[0])
+                self._remember(user_id, state)
+                return state
+
+    def __setitem__(self, user_id, state):
+        entry = (self._encode(state), self._test_id(state), time.time())
+        with self._lock:
+            self._remember(user_id, state)
+            self._pending[user_id] = entry
+            backlog = len(self._pending)
+        if backlog >= self.max_batch:
+            self._wakeup.set()
+
+    def __delitem__(self, user_id):
+        if user_id not in self:
+            raise KeyError(user_id)
+        with self._lock:
+            self._cache.pop(user_id, None)
+            self._pending[user_id] = _DELETED
+
+    def __contains__(self, user_id):
+        try:
+            self[user_id]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute("SELECT user_id FROM sessions").fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        with self._lock:
+            return sum(self._counts.values())
+
+    def count_by_test(self) -> Counter:
+        with self._lock:
+            return Counter({test_id: count for test_id, count in self._counts.items()
+                            if test_id is not None and count > 0})
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'active': sum(self._counts.values()),
+                'cached': len(self._cache),
+                'pending': len(self._pending),
+                'expired': self._expired,
+            }
+
+    # -- Écriture différée --------------------------------------------------
+
+    def _stored_tests(self, user_ids) -> dict:
+        """Test enregistré en base pour chacun de ``user_ids`` qui a une ligne."""
+        stored = {}
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            stored.update(self._conn.execute(
+                f"SELECT user_id, test_id FROM sessions WHERE user_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+        return stored
+
+    def flush(self) -> None:
+        # Un seul lot à la fois : le lot en cours d'écriture reste lisible
+        # dans _flushing jusqu'au COMMIT
+        with self._db_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch = self._flushing = self._pending
+                self._pending = {}
+            upserts = [(user_id, *entry) for user_id, entry in batch.items() if entry is not _DELETED]
+            deletes = [(user_id,) for user_id, entry in batch.items() if entry is _DELETED]
+            try:
+                self._conn.execute("BEGIN")
+                stored = self._stored_tests(batch)
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT INTO sessions (user_id, state, test_id, updated_at) VALUES (?, ?, ?, ?)"
+                        " ON CONFLICT(user_id) DO UPDATE SET state = excluded.state,"
+                        " test_id = excluded.test_id, updated_at = excluded.updated_at",
+                        upserts
+                    )
+                if deletes:
+                    self._conn.executemany("DELETE FROM sessions WHERE user_id = ?", deletes)
+                self._conn.execute("COMMIT")
+            except BaseException as exc:
+                # Remettre le lot en attente sans écraser les écritures plus récentes
+                with self._lock:
+                    for user_id, entry in batch.items():
+                        self._pending.setdefault(user_id, entry)
+                    self._flushing = {}
+                # SQLite a pu annuler la transaction lui-même (disque plein…)
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                if not isinstance(exc, sqlite3.Error):
+                    raise
+                logger.exception("Échec de l'écriture de %d sessions", len(batch))
+                return
+            with self._lock:
+                self._flushing = {}
+                for user_id, test_id in stored.items():
+                    self._counts[test_id] -= 1
+                for _, _, test_id, _ in upserts:
+                    self._counts[test_id] += 1
+
+    # -- Expiration ---------------------------------------------------------
+
+    def _expire_idle(self) -> None:
+        """Supprime de la base les sessions inactives (thread d'écriture)."""
+        cutoff = time.time() - self.idle_timeout
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT user_id, state, test_id FROM sessions WHERE updated_at < ?", (cutoff,)
+            ).fetchall()
+            with self._lock:
+                # Une écriture en attente est plus récente que la ligne
+                idle = [row for row in rows if row[0] not in self._pending]
+            if not idle:
+                return
+            try:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("DELETE FROM sessions WHERE user_id = ?", [(row[0],) for row in idle])
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+            with self._lock:
+                for user_id, raw, test_id in idle:
+                    self._counts[test_id] -= 1
+                    if user_id in self._pending:
+                        # Réécrite pendant la suppression : la session continue
+                        continue
+                    self._cache.pop(user_id, None)
+                    self._expired_states.append((user_id, raw))
+                    self._expired += 1
+
+    def expire(self, now: float = None) -> int:
+        """Passe à ``on_evict`` les sessions supprimées pour inactivité ; retourne leur nombre.
+
+        La suppression est faite par le thread d'écriture : cet appel ne lit
+        pas la base et peut être fait depuis la boucle asyncio.
+        """
+        with self._lock:
+            expired, self._expired_states = self._expired_states, []
+        if self.on_evict is not None:
+            for user_id, raw in expired:
+                try:
+                    self.on_evict(user_id, self._decode(raw), EVICTED_IDLE)
+                except Exception:
+                    logger.exception("Échec du rappel d'éviction pour l'utilisateur %s", user_id)
+        return len(expired)
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Échec de l'écriture des sessions")
+            if self.idle_timeout and time.monotonic() >= self._next_sweep:
+                self._next_sweep = time.monotonic() + min(60.0, self.idle_timeout / 4)
+                try:
+                    self._expire_idle()
+                except Exception:
+                    logger.exception("Échec de l'expiration des sessions inactives")
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+def create_session_store() -> SessionStore:
+    """Construit le store configuré par les variables d'environnement.
+
+    ``SESSION_STORE`` vaut ``memory`` (défaut) ou ``sqlite``.
+    ``SESSION_IDLE_TIMEOUT`` (secondes) fait expirer les sessions inactives
+    dans les deux cas. En mémoire, ``SESSION_MAX_ENTRIES`` et
+    ``SESSION_MAX_BYTES`` bornent le store ; avec SQLite,
+    ``SESSION_DB_PATH`` donne le chemin de la base (``sessions.db``) et
+    ``SESSION_CACHE_SIZE`` le nombre de sessions gardées en cache.
+    """
+    backend = os.getenv('SESSION_STORE', 'memory').lower()
+    # Bornes des stores ; 0 désactive la borne correspondante
+    idle_timeout = float(os.getenv('SESSION_IDLE_TIMEOUT', '3600'))
+    if backend == 'memory':
+        max_entries = int(os.getenv('SESSION_MAX_ENTRIES', '100000'))
+        max_bytes = int(os.getenv('SESSION_MAX_BYTES', '0'))
+        return MemorySessionStore(
+            max_entries=max_entries or None,
+            max_bytes=max_bytes or None,
+            idle_timeout=idle_timeout or None,
+        )
+    if backend == 'sqlite':
+        max_cached = int(os.getenv('SESSION_CACHE_SIZE', '10000'))
+        return SQLiteSessionStore(
+            os.getenv('SESSION_DB_PATH', 'sessions.db'),
+            flush_interval=float(os.getenv('SESSION_FLUSH_INTERVAL', '0.5')),
+            max_cached=max_cached or None,
+            idle_timeout=idle_timeout or None,
+        )
+    raise ValueError(f"Backend de sessions inconnu : {backend}")
@@ -0,0 +1,394 @@
+"""Mode multi-processus : un processus d'ingestion et N workers.
+
+Un seul processus asyncio n'utilise qu'un cœur. Avec ``SHARD_WORKERS=N``,
+``main.py`` devient un superviseur qui lance :
+
+- un processus d'ingestion, qui reçoit les mises à jour (polling ou webhook,
+  selon ``TELEGRAM_MODE``) et les répartit sans les traiter ;
+- N workers, qui construisent chacun l'application complète et traitent les
+  mises à jour qui leur sont confiées.
+
+Chaque mise à jour part vers le worker ``shard_for(user_id, N)`` : un
+utilisateur est toujours servi par le même worker, qui détient sa session
+en mémoire et traite ses clics dans l'ordre. Chaque worker lit un tube
+(``multiprocessing.Pipe``) dont le superviseur garde les deux extrémités :
+un worker qui plante est relancé sur le même tube et reprend les mises à
+jour en attente. Seules celles en cours de traitement sont perdues, ainsi
+que les sessions du worker si elles sont en mémoire (``SESSION_STORE=sqlite``
+ou ``STATELESS_SESSIONS=1`` les conservent).
+
+À l'arrêt (SIGTERM ou SIGINT), l'ingestion s'arrête d'abord et vide ses
+envois, puis chaque worker traite sa file jusqu'au bout avant de quitter.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from multiprocessing.connection import wait
+
+import tornado.web
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Mises à jour transmises d'un coup de la file d'un worker à son application
+BATCH_SIZE = 256
+
+# Relance des processus : délai croissant s'ils plantent dès le démarrage
+RESTART_DELAY_MAX = 30.0
+STABLE_AFTER = 10.0
+
+
+def shard_for(user_id: int, workers: int) -> int:
+    """Worker chargé de ``user_id`` (stable d'un processus et d'un redémarrage à l'autre)."""
+    return zlib.crc32(user_id.to_bytes(8, 'little', signed=True)) % workers
+
+
+def update_user_id(data: dict) -> int:
+    """Utilisateur à l'origine d'une mise à jour brute, sans construire d'``Update``.
+
+    Le contenu d'une mise à jour est sous une seule clé (``message``,
+    ``callback_query``…) qui porte l'auteur dans ``from`` ou ``user``. À
+    défaut (publication de canal, sondage), la conversation ou l'identifiant
+    de la mise à jour sert de clé de répartition.
+    """
+    for value in data.values():
+        if isinstance(value, dict):
+            for key in ('from', 'user', 'chat'):
+                sender = value.get(key)
+                if isinstance(sender, dict) and 'id' in sender:
+                    return sender['id']
+    return data.get('update_id', 0)
+
+
+def _feed(pending: queue.SimpleQueue, connection) -> None:
+    """Écrit dans le tube d'un worker, sans bloquer la boucle de l'ingestion."""
+    while True:
+        raw = pending.get()
+        if raw is None:
+            return
+        connection.send_bytes(raw)
+
+
+class UpdateRouter:
+    """Répartit les mises à jour brutes entre les tubes des workers.
+
+    Chaque tube est alimenté par son propre thread : un worker lent ou en
+    cours de relance ne retarde pas les autres.
+    """
+
+    def __init__(self, connections: list):
+        self.pending = [queue.SimpleQueue() for _ in connections]
+        self.feeders = [
+            threading.Thread(target=_feed, args=(pending, connection), daemon=True)
+            for pending, connection in zip(self.pending, connections)
+        ]
+        for feeder in self.feeders:
+            feeder.start()
+        self.routed = [0] * len(connections)
+
+    def route(self, data: dict, raw: bytes = None) -> int:
+        shard = shard_for(update_user_id(data), len(self.pending))
+        self.pending[shard].put(raw if raw is not None else json.dumps(data).encode())
+        self.routed[shard] += 1
+        return shard
+
+    def close(self) -> None:
+        """Termine les écritures en attente."""
+        for pending in self.pending:
+            pending.put(None)
+        for feeder in self.feeders:
+            feeder.join()
+
+
+# -- Workers ----------------------------------------------------------------
+
+def _next_batch(updates, parent) -> list:
+    """Attend des mises à jour dans le tube ; un message vide signale la fin."""
+    while not updates.poll(1.0):
+        # Superviseur tué sans arrêt propre : ne pas rester orphelin
+        if not parent.is_alive():
+            return [b'']
+    batch = [updates.recv_bytes()]
+    while len(batch) < BATCH_SIZE and batch[-1] and updates.poll(0):
+        batch.append(updates.recv_bytes())
+    return batch
+
+
+async def _serve_worker(application, updates) -> None:
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        running = True
+        while running:
+            for raw in await loop.run_in_executor(None, _next_batch, updates, parent):
+                if not raw:
+                    running = False
+                    break
+                application.update_queue.put_nowait(Update.de_json(json.loads(raw), application.bot))
+    finally:
+        # stop() traite les mises à jour déjà transmises avant de rendre la main
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_worker(index: int, build_application, token: str, updates, concurrent_updates: int) -> None:
+    """Point d'entrée d'un worker : traite les mises à jour de son tube."""
+    # L'arrêt passe par le tube (voir Supervisor.stop), pas par les signaux
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    application = build_application(token, concurrent_updates=concurrent_updates)
+    logger.info("Worker %d prêt (pid %d)", index, os.getpid())
+    asyncio.run(_serve_worker(application, updates))
+
+
+# -- Ingestion ----------------------------------------------------------------
+
+def _ingest_bot(token: str) -> Bot:
+    if os.getenv('TELEGRAM_API_URL'):
+        return Bot(token, base_url=os.getenv('TELEGRAM_API_URL'))
+    return Bot(token)
+
+
+async def _poll(bot: Bot, router: UpdateRouter, stopping: asyncio.Event) -> None:
+    await bot.delete_webhook()
+    offset = None
+    while not stopping.is_set():
+        fetching = asyncio.ensure_future(bot.get_updates(offset=offset, timeout=10, allowed_updates=Update.ALL_TYPES))
+        stopped = asyncio.ensure_future(stopping.wait())
+        await asyncio.wait((fetching, stopped), return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        if not fetching.done():
+            fetching.cancel()
+            break
+        try:
+            updates = fetching.result()
+        except TelegramError as exc:
+            logger.warning("getUpdates a échoué : %s", exc)
+            await asyncio.sleep(1.0)
+            continue
+        for update in updates:
+            router.route(update.to_dict(), update.to_json().encode())
+            offset = update.update_id + 1
+    if offset is not None:
+        # Confirme à Telegram les mises à jour déjà réparties
+        try:
+            await bot.get_updates(offset=offset, timeout=0, limit=1)
+        except TelegramError as exc:
+            logger.warning("Mises à jour non confirmées à l'arrêt : %s", exc)
+
+
+class _WebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, router: UpdateRouter, secret: str):
+        self.router = router
+        self.secret = secret
+
+    def post(self):
+        token = self.request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(token, self.secret):
+            self.send_error(403)
+            return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.send_error(400)
+            return
+        self.router.route(data, self.request.body)
+
+
+async def _serve_webhook(bot: Bot, router: UpdateRouter, stopping: asyncio.Event) -> None:
+    url_path = os.getenv('WEBHOOK_PATH', 'webhook')
+    secret = os.getenv('WEBHOOK_SECRET')
+    web_app = tornado.web.Application([(rf'/{url_path}/?', _WebhookHandler, dict(router=router, secret=secret))])
+    server = web_app.listen(int(os.getenv('WEBHOOK_PORT', '8443')), address=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'))
+    await bot.set_webhook(
+        url=f"{os.getenv('WEBHOOK_URL').rstrip('/')}/{url_path}",
+        secret_token=secret,
+        max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '100')),
+        allowed_updates=Update.ALL_TYPES,
+    )
+    try:
+        await stopping.wait()
+    finally:
+        server.stop()
+        await server.close_all_connections()
+
+
+async def _ingest(token: str, mode: str, router: UpdateRouter) -> None:
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+
+    async def watch_parent():
+        parent = multiprocessing.parent_process()
+        while parent.is_alive():
+            await asyncio.sleep(1.0)
+        stopping.set()
+
+    watcher = asyncio.ensure_future(watch_parent())
+    async with _ingest_bot(token) as bot:
+        try:
+            if mode == 'webhook':
+                await _serve_webhook(bot, router, stopping)
+            else:
+                await _poll(bot, router, stopping)
+        finally:
+            watcher.cancel()
+
+
+def run_ingest(token: str, mode: str, connections: list) -> None:
+    """Point d'entrée du processus d'ingestion."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    router = UpdateRouter(connections)
+    try:
+        asyncio.run(_ingest(token, mode, router))
+    finally:
+        router.close()
+    logger.info("Ingestion arrêtée, mises à jour par worker : %s", router.routed)
+
+
+# -- Superviseur --------------------------------------------------------------
+
+@contextmanager
+def _environment(**values):
+    """Variables d'environnement du prochain processus lancé (``spawn`` les copie)."""
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update({name: str(value) for name, value in values.items()})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+class Supervisor:
+    """Lance, surveille et relance l'ingestion et les workers."""
+
+    def __init__(self, token: str, workers: int, build_application, mode: str = 'polling',
+                 concurrent_updates: int = 256, drain_timeout: float = 30.0):
+        self.token = token
+        self.workers = workers
+        self.build_application = build_application
+        self.mode = mode
+        self.concurrent_updates = concurrent_updates
+        self.drain_timeout = drain_timeout
+        # spawn : pas de fork d'un processus qui a déjà des threads (store SQLite, httpx)
+        self.context = multiprocessing.get_context('spawn')
+        # (lecture, écriture) par worker, gardés ouverts pour survivre aux relances
+        self.pipes = [self.context.Pipe(duplex=False) for _ in range(workers)]
+        # nom -> [processus, démarré à, plantages consécutifs, relance prévue à]
+        self.processes = {}
+        self.stopping = False
+
+    def _worker_environment(self, index: int) -> dict:
+        values = {'SHARD_INDEX': index}
+        # Chaque conversation reste sur un worker : seule la limite globale se partage
+        values['RATE_LIMIT_GLOBAL'] = float(os.getenv('RATE_LIMIT_GLOBAL', '30')) / self.workers
+        values['REMINDER_RATE'] = float(os.getenv('REMINDER_RATE', '10')) / self.workers
+        # Même nombre total de connexions vers l'API qu'avec un seul processus
+        values['HTTP_POOL_SIZE'] = max(1, -(-int(os.getenv('HTTP_POOL_SIZE', '256')) // self.workers))
+        if os.getenv('METRICS_PORT'):
+            values['METRICS_PORT'] = int(os.getenv('METRICS_PORT')) + index
+        return values
+
+    def _start(self, name: str) -> None:
+        if name == 'ingest':
+            process = self.context.Process(target=run_ingest, name='ingest',
+                                           args=(self.token, self.mode, [writer for _, writer in self.pipes]))
+            environment = {}
+        else:
+            index = int(name.split('-')[1])
+            process = self.context.Process(
+                target=run_worker, name=name,
+                args=(index, self.build_application, self.token, self.pipes[index][0], self.concurrent_updates))
+            environment = self._worker_environment(index)
+        with _environment(**environment):
+            process.start()
+        entry = self.processes.setdefault(name, [None, 0.0, 0, None])
+        entry[0], entry[1], entry[3] = process, time.monotonic(), None
+
+    def _check(self) -> None:
+        """Relance les processus arrêtés, avec un délai s'ils plantent en boucle."""
+        now = time.monotonic()
+        for name, entry in self.processes.items():
+            process, started, failures, restart_at = entry
+            if restart_at is not None:
+                if now >= restart_at:
+                    self._start(name)
+                continue
+            if process.is_alive():
+                continue
+            failures = failures + 1 if now - started < STABLE_AFTER else 1
+            delay = min(RESTART_DELAY_MAX, 0.5 * 2 ** (failures - 1))
+            logger.error("Processus %s arrêté (code %s), relance dans %.1f s", name, process.exitcode, delay)
+            entry[2], entry[3] = failures, now + delay
+
+    def _request_stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        for index in range(self.workers):
+            self._start(f'worker-{index}')
+        self._start('ingest')
+        logger.info("Superviseur : %d workers, ingestion en mode %s", self.workers, self.mode)
+        while not self.stopping:
+            wait([entry[0].sentinel for entry in self.processes.values()], timeout=0.5)
+            if not self.stopping:
+                self._check()
+        self.stop()
+
+    def stop(self) -> None:
+        """Arrêt propre : ingestion d'abord, puis chaque worker vide son tube."""
+        logger.info("Arrêt : fin de l'ingestion puis des workers")
+        ingest = self.processes['ingest'][0]
+        if ingest.is_alive():
+            ingest.terminate()
+        ingest.join(self.drain_timeout)
+
+        # Un worker en attente de relance doit quand même vider son tube
+        for name, (process, *_) in self.processes.items():
+            if name != 'ingest' and not process.is_alive():
+                self._start(name)
+        for _, writer in self.pipes:
+            writer.send_bytes(b'')
+        deadline = time.monotonic() + self.drain_timeout
+        for name, (process, *_) in self.processes.items():
+            if name == 'ingest':
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("%s n'a pas fini de vider son tube, arrêt forcé", name)
+                process.kill()
+                process.join()
+
+
+def supervise(token: str, workers: int, build_application, mode: str = 'polling') -> None:
+    """Sert le bot avec ``workers`` processus (``SHARD_WORKERS``)."""
+    if mode == 'webhook' and not (os.getenv('WEBHOOK_URL') and os.getenv('WEBHOOK_SECRET')):
+        raise ValueError("Le mode webhook nécessite WEBHOOK_URL et WEBHOOK_SECRET")
+    Supervisor(
+        token, workers, build_application, mode,
+        concurrent_updates=int(os.getenv('CONCURRENT_UPDATES', '256')),
+        drain_timeout=float(os.getenv('SHARD_DRAIN_TIMEOUT', '30')),
+    ).run()
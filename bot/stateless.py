@@ -0,0 +1,119 @@
+"""Sessions sans état serveur : la progression est portée par les boutons.
+
+Chaque bouton de réponse encode l'identifiant du test et toutes les réponses
+données jusqu'ici, y compris celle du bouton. Les réponses sont empaquetées
+en base mixte (une base par question, égale à son nombre d'options), puis
+signées par un HMAC tronqué lié à l'utilisateur pour empêcher la
+falsification ou la réutilisation d'un bouton par un autre compte.
+
+N'importe quel processus peut ainsi traiter un clic sans consulter
+``user_states``. Les tests dont l'état ne tient pas dans les 64 octets d'un
+``callback_data`` restent gérés par le store de sessions, comme les tests
+adaptatifs (``psy.cat``), dont les réponses ne suivent pas l'ordre des
+questions.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot import callbacks
+from bot.render import localized_questions
+
+# Limite imposée par Telegram sur la taille d'un callback_data
+MAX_CALLBACK_BYTES = 64
+
+# Taille de la signature (octets) ajoutée à chaque état
+MAC_BYTES = 6
+
+_key = None
+
+# Résultat de fits() par identifiant de test
+_fits = {}
+
+
+def configure(secret: str) -> None:
+    """Définit la clé de signature des états (partagée par tous les workers)."""
+    global _key
+    _key = hashlib.sha256(secret.encode()).digest()
+
+
+def is_enabled() -> bool:
+    """Le mode sans état est activé par ``STATELESS_SESSIONS=1`` et une clé configurée."""
+    return _key is not None and os.getenv('STATELESS_SESSIONS', '0') == '1'
+
+
+def _radices(questionnaire) -> list:
+    return [len(options) for _, options in questionnaire.questions]
+
+
+def _packed_size(questionnaire) -> int:
+    """Nombre d'octets nécessaires pour empaqueter un jeu complet de réponses."""
+    capacity = 1
+    for radix in _radices(questionnaire):
+        capacity *= radix
+    return max(1, (capacity - 1).bit_length() + 7 >> 3)
+
+
+def _sign(user_id: int, test_id: str, body: bytes) -> bytes:
+    message = b'%d:%s:' % (user_id, test_id.encode()) + body
+    return hmac.new(_key, message, hashlib.sha256).digest()[:MAC_BYTES]
+
+
+def encode_state(user_id: int, questionnaire, responses) -> str:
+    """Construit le ``callback_data`` portant les réponses ``responses``."""
+    value = 0
+    for answer, radix in zip(reversed(responses), reversed(_radices(questionnaire)[:len(responses)])):
+        value = value * radix + answer
+    body = bytes([len(responses)]) + value.to_bytes(_packed_size(questionnaire), 'big')
+    token = base64.urlsafe_b64encode(body + _sign(user_id, questionnaire.id, body)).rstrip(b'=')
+    return callbacks.encode(callbacks.PACKED_ANSWER, questionnaire.id, token.decode())
+
+
+def decode_state(user_id: int, questionnaire, token: str) -> list:
+    """Vérifie la signature d'un état et retourne la liste des réponses.
+
+    Lève ``ValueError`` si l'état est mal formé ou a été falsifié.
+    """
+    raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    body, mac = raw[:-MAC_BYTES], raw[-MAC_BYTES:]
+    if len(body) != 1 + _packed_size(questionnaire):
+        raise ValueError("État de session mal formé")
+    if not hmac.compare_digest(mac, _sign(user_id, questionnaire.id, body)):
+        raise ValueError("Signature de l'état de session invalide")
+
+    count, value = body[0], int.from_bytes(body[1:], 'big')
+    radices = _radices(questionnaire)
+    if count > len(radices):
+        raise ValueError("État de session mal formé")
+    responses = []
+    for radix in radices[:count]:
+        value, answer = divmod(value, radix)
+        responses.append(answer)
+    return responses
+
+
+def fits(questionnaire) -> bool:
+    """Indique si l'état complet du test tient dans un ``callback_data``."""
+    if questionnaire.adaptive is not None:
+        return False
+    if questionnaire.id not in _fits:
+        # Pire cas : toutes les questions répondues avec l'option la plus haute
+        worst = encode_state(0, questionnaire, [radix - 1 for radix in _radices(questionnaire)])
+        _fits[questionnaire.id] = len(worst.encode()) <= MAX_CALLBACK_BYTES
+    return _fits[questionnaire.id]
+
+
+def question_markup(user_id: int, questionnaire, responses, views) -> InlineKeyboardMarkup:
+    """Clavier de la question suivante, dans la langue de ``views``, chaque bouton portant l'état qui en résulte."""
+    question_index = len(responses)
+    _, options = localized_questions(questionnaire, views.messages)[question_index]
+    keyboard = [
+        [InlineKeyboardButton(option, callback_data=encode_state(user_id, questionnaire, [*responses, i]))]
+        for i, option in enumerate(options)
+    ]
+    keyboard.append([views.cancel_button])
+    return InlineKeyboardMarkup(keyboard)
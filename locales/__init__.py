@@ -0,0 +1,145 @@
+"""Catalogues de messages du bot, un par langue.
+
+Chaque langue est décrite par ``locales/<code>.json`` : une table clé →
+message. Un message est un gabarit ``str.format`` (``"Bonjour {name}!"``),
+une liste (un message par tranche de sévérité) ou une table (descriptions
+des types MBTI). La langue par défaut (``DEFAULT_LOCALE``, ``fr``) est
+complète ; une autre langue peut n'en traduire qu'une partie, les clés
+manquantes étant reprises de la langue par défaut.
+
+Un catalogue peut aussi traduire un questionnaire, sans toucher à sa
+définition (``psy/definitions``) ::
+
+    "depression.label": "😔 Depression Test",
+    "depression.questions": [["Little interest or pleasure…", ["Not at all", "…"]]]
+
+Sans ces clés, le libellé et les questions restent ceux de la définition.
+
+Un catalogue est compilé (fusion avec la langue par défaut, vérification
+des champs de chaque gabarit) puis mis en cache sur disque (``marshal``),
+sous une clé dérivée du contenu des deux fichiers, comme les plans de
+``psy.plans``. Il n'est chargé qu'à la première demande de sa langue :
+un worker qui ne sert que des utilisateurs francophones ne lit jamais les
+autres. ``python -m locales`` compile tous les catalogues à l'avance
+(image Docker) et signale les clés non traduites.
+"""
+
+import hashlib
+import json
+import logging
+import marshal
+import os
+import string
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = Path(__file__).parent
+# Langue des utilisateurs dont la langue n'a pas de catalogue
+DEFAULT_LOCALE = os.getenv('DEFAULT_LOCALE', 'fr')
+# Changer ce numéro invalide les catalogues déjà en cache
+CATALOG_FORMAT = 1
+
+
+class Catalog(dict):
+    """Messages d'une langue, après fusion avec la langue par défaut."""
+
+    def __init__(self, code: str, messages: dict):
+        super().__init__(messages)
+        self.code = code
+
+    def format(self, key: str, **fields) -> str:
+        """Message ``key`` avec ses champs remplis."""
+        return self[key].format(**fields)
+
+
+def _fields(template: str) -> set:
+    return {name for _, name, _, _ in string.Formatter().parse(template) if name is not None}
+
+
+def compile_catalog(code: str, messages: dict, default: dict) -> dict:
+    """Fusionne ``messages`` sur le catalogue ``default``.
+
+    Lève ``ValueError`` si un message n'a pas le type du message par défaut,
+    ou si un gabarit n'utilise pas les mêmes champs.
+    """
+    for key, message in messages.items():
+        reference = default.get(key)
+        if reference is None:
+            continue
+        if type(message) is not type(reference):
+            raise ValueError(f"{code}, {key} : {type(reference).__name__} attendu")
+        if isinstance(message, str) and _fields(message) != _fields(reference):
+            raise ValueError(f"{code}, {key} : champs attendus {sorted(_fields(reference))}")
+    return {'format': CATALOG_FORMAT, 'code': code, 'messages': dict(default, **messages)}
+
+
+def available(directory: Path = LOCALES_DIR) -> tuple:
+    """Codes des langues qui ont un catalogue."""
+    return tuple(sorted(path.stem for path in Path(directory).glob('*.json')))
+
+
+def resolve(language_code) -> str:
+    """Langue servie pour un ``language_code`` Telegram (``en-US`` → ``en``)."""
+    if language_code:
+        code = language_code.replace('_', '-').split('-')[0].lower()
+        if code in _available():
+            return code
+    return DEFAULT_LOCALE
+
+
+def _cache_directory() -> Path:
+    configured = os.getenv('CATALOG_CACHE_DIR')
+    return Path(configured) if configured else LOCALES_DIR / '__pycache__' / 'catalogs'
+
+
+def _store(cache_directory: Path, code: str, cache_path: Path, compiled: dict) -> None:
+    try:
+        cache_directory.mkdir(parents=True, exist_ok=True)
+        for stale in cache_directory.glob(f'{code}-*.catalog'):
+            stale.unlink(missing_ok=True)
+        temporary = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        temporary.write_bytes(marshal.dumps(compiled))
+        os.replace(temporary, cache_path)
+    except OSError as exc:
+        # Cache facultatif : répertoire en lecture seule, disque plein…
+        logger.debug("Catalogue %s non mis en cache : %s", code, exc)
+
+
+def load(code: str, directory: Path = LOCALES_DIR, cache_directory: Path = None) -> Catalog:
+    """Charge le catalogue ``code``, depuis le cache si lui et la langue par défaut n'ont pas changé."""
+    directory = Path(directory)
+    raw = (directory / f'{code}.json').read_bytes()
+    default_raw = raw if code == DEFAULT_LOCALE else (directory / f'{DEFAULT_LOCALE}.json').read_bytes()
+    digest = hashlib.sha256(b'%d:%s:' % (CATALOG_FORMAT, DEFAULT_LOCALE.encode()) + default_raw + b'\0' + raw)
+    cache_directory = Path(cache_directory) if cache_directory else _cache_directory()
+    cache_path = cache_directory / f'{code}-{digest.hexdigest()[:20]}.catalog'
+    try:
+        compiled = marshal.loads(cache_path.read_bytes())
+        if compiled.get('format') == CATALOG_FORMAT:
+            return Catalog(code, compiled['messages'])
+    except (OSError, EOFError, ValueError, TypeError, AttributeError):
+        pass
+    compiled = compile_catalog(code, json.loads(raw), json.loads(default_raw))
+    _store(cache_directory, code, cache_path, compiled)
+    return Catalog(code, compiled['messages'])
+
+
+_languages = None
+_catalogs = {}
+
+
+def _available() -> tuple:
+    global _languages
+    if _languages is None:
+        _languages = available()
+    return _languages
+
+
+def catalog(language_code=None) -> Catalog:
+    """Catalogue de la langue de ``language_code``, chargé à la première demande."""
+    code = resolve(language_code)
+    messages = _catalogs.get(code)
+    if messages is None:
+        messages = _catalogs[code] = load(code)
+    return messages
@@ -0,0 +1,27 @@
+"""Compile tous les catalogues dans le cache et signale les clés non traduites.
+
+Usage :
+    python -m locales
+"""
+
+import argparse
+import json
+
+from locales import DEFAULT_LOCALE, LOCALES_DIR, available, load
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    reference = set(json.loads((LOCALES_DIR / f'{DEFAULT_LOCALE}.json').read_bytes()))
+    for code in available():
+        catalog = load(code)
+        missing = sorted(reference - set(json.loads((LOCALES_DIR / f'{code}.json').read_bytes())))
+        print(f"{code} : {len(catalog)} messages" + (f", {len(missing)} repris de {DEFAULT_LOCALE}" if missing else ""))
+        for key in missing:
+            print(f"  {key}")
+
+
+if __name__ == '__main__':
+    main()
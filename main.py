@@ -1,16 +1,28 @@
+import asyncio
 import logging
 import os
+import time
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
+from telegram.error import TelegramError
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
-    MessageHandler,
-    filters
+    TypeHandler
 )
-from psy import big_five, mbti, depression, anxiety
+from psy import registry
+from bot import callbacks, multibot, shards, stateless
+from bot.concurrency import PerUserUpdateProcessor, RecentIds
+from bot.history import create_history, serve_export
+from bot.http import get_updates_request, request_from_env
+from bot.metrics import Metrics, serve as serve_metrics, watch_event_loop
+from bot.outbound import OutboundScheduler
+from bot.recorder import create_recorder
+from bot.reminders import create_reminders
+from bot.render import views
+from bot.sessions import EVICTED_IDLE, Session, create_session_store
 
 # Configuration du logging
 logging.basicConfig(
@@ -22,81 +34,91 @@ logger = logging.getLogger(__name__)
 # Charge les variables d'environnement
 load_dotenv()
 
-# Dictionnaire pour suivre l'état des utilisateurs
-user_states = {}
+# Store des sessions pour suivre l'état des utilisateurs (voir bot/sessions.py)
+user_states = create_session_store()
 
-# Message de démarrage personnalisé
-START_MESSAGE = """
-🌟 *Bienvenue sur PsychoTest Bot* 🌟
+# Prévenir l'utilisateur quand son test expire pour inactivité
+SESSION_EXPIRY_NOTICE = os.getenv('SESSION_EXPIRY_NOTICE', '0') == '1'
 
-Je suis un assistant psychologique qui vous propose plusieurs tests validés scientifiquement :
+# Réduit le nombre d'allers-retours vers l'API Telegram par interaction
+LOW_ROUND_TRIP = os.getenv('LOW_ROUND_TRIP', '1') == '1'
 
-🔹 *Tests de personnalité* :
-- /mbti - Test MBTI (16 personnalités)
-- /bigfive - Test des 5 grands traits (OCEAN)
+# Derniers callbacks traités, pour ignorer les doubles clics et les renvois de Telegram
+recent_callbacks = RecentIds()
 
-🔹 *Tests d'auto-évaluation* :
-- /depression - Test PHQ-9 (dépression)
-- /anxiety - Test GAD-7 (anxiété)
+# Derniers tests sans état terminés, par bouton : deux clics sur le dernier
+# bouton sont deux callbacks différents, mais un seul résultat
+recent_completions = RecentIds(ttl=60.0)
 
-📌 Utilisez les commandes ci-dessus ou le menu interactif pour commencer un test.
+# Métriques Prometheus, servies sur METRICS_PORT s'il est défini (voir bot/metrics.py)
+METRICS_PORT = os.getenv('METRICS_PORT')
+metrics = Metrics(
+    {listing.id: listing.question_count for listing in registry.available()},
+    active_sessions=user_states.count_by_test
+) if METRICS_PORT else None
+_metrics_server = None
 
-ℹ Pour plus d'informations : /help
-"""
+# Journal des résultats terminés si RESULT_LOG_DIR est défini (voir
+# bot/results.py), et statistiques de population des résultats sauf si
+# POPULATION_STATS=0 (voir bot/population.py). Tous deux chargent numpy et
+# tous les tests : ils sont créés au premier résultat (open_result_stores),
+# ou par build_application avec PRELOAD_TESTS=1
+result_log = None
+population = None
+_result_stores_opened = False
 
-# Message d'aide détaillé
-HELP_MESSAGE = """
-🆘 *Aide - PsychoTest Bot* 🆘
+# Rappels de refaire un test si REMINDERS=1 (voir bot/reminders.py), créés
+# par build_application
+reminders = None
 
-*Commandes disponibles* :
+# Historique des résultats si HISTORY_DB_PATH est défini (voir
+# bot/history.py), créé par build_application ; exporté en HTTP sur
+# HISTORY_EXPORT_PORT s'il est défini
+history = None
+_export_server = None
 
-🔹 *Tests de personnalité* :
-- /mbti - Test de typologie MBTI (16 personnalités)
-- /bigfive - Test des 5 grands traits de personnalité (OCEAN)
+# Enregistrement des mises à jour reçues si UPDATE_LOG_DIR est défini (voir
+# bot/recorder.py et benchmarks/replay.py), créé par build_application
+recorder = None
 
-🔹 *Tests de santé mentale* :
-- /depression - Test PHQ-9 (évaluation des symptômes dépressifs)
-- /anxiety - Test GAD-7 (évaluation des symptômes anxieux)
+# Applications servies par le processus, par espace de sessions : une
+# seule, ou une par bot avec BOTS_FILE (voir bot/multibot.py)
+_applications = {}
 
-🔹 *Autres commandes* :
-- /start - Redémarrer le bot
-- /help - Afficher ce message
-- /cancel - Annuler un test en cours
+# Tâches de fond lancées au démarrage (balayage des sessions, métriques, instantanés, rappels)
+_background_tasks = []
 
-📝 *Note importante* : 
-Les résultats fournis sont indicatifs et ne constituent pas un diagnostic médical. En cas de doute, consultez un professionnel de santé.
+def user_views(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Messages rendus dans la langue du bot ou de l'utilisateur (voir bot/render.py et locales/)."""
+    language = context.bot_data.get('language')
+    if language is None and update.effective_user:
+        language = update.effective_user.language_code
+    return views(language)
 
-💡 Conseil : Complétez plusieurs tests pour une meilleure compréhension de vous-même.
-"""
+def session_key(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> int:
+    """Clé de la session de ``user_id`` dans ``user_states``, dans l'espace du bot (voir bot/multibot.py)."""
+    return multibot.session_key(context.bot_data.get('namespace', 0), user_id)
+
+def resolve_session(key: int) -> tuple:
+    """``(application, user_id)`` d'une clé de session ; application ``None`` si son bot n'est plus servi."""
+    namespace, user_id = multibot.split_key(key)
+    return _applications.get(namespace), user_id
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Message de démarrage avec menu interactif."""
-    user = update.effective_user
-    keyboard = [
-        [
-            InlineKeyboardButton("🧠 Test MBTI", callback_data='mbti'),
-            InlineKeyboardButton("🌊 Big Five", callback_data='big_five'),
-        ],
-        [
-            InlineKeyboardButton("😔 Test Dépression", callback_data='depression'),
-            InlineKeyboardButton("😰 Test Anxiété", callback_data='anxiety'),
-        ],
-        [
-            InlineKeyboardButton("ℹ Aide", callback_data='help'),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    rendered = user_views(update, context)
+    reply_markup = rendered.main_menu
     
     # Gestion à la fois des commandes et des callbacks
     if update.message:
         await update.message.reply_text(
-            START_MESSAGE,
+            rendered.messages['start'],
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
     elif update.callback_query:
         await update.callback_query.message.edit_text(
-            START_MESSAGE,
+            rendered.messages['start'],
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
@@ -105,224 +127,301 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Affiche le message d'aide détaillé."""
-    await update.message.reply_text(
-        HELP_MESSAGE,
+    await update.effective_message.reply_text(
+        user_views(update, context).messages['help'],
         parse_mode='Markdown'
     )
 
-async def start_mbti(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Commande pour démarrer directement le test MBTI."""
-    user_id = update.effective_user.id
-    user_states[user_id] = {
-        'current_test': 'mbti',
-        'current_question': 0,
-        'responses': [],
-        'test_started': True
-    }
-    await send_question(update, context, user_id)
-
-async def start_big_five(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Commande pour démarrer directement le test Big Five."""
+async def start_test(update: Update, context: ContextTypes.DEFAULT_TYPE, test_id: str) -> None:
+    """Démarre le test ``test_id`` (commande ou bouton du menu)."""
+    questionnaire = registry.get(test_id)
+    if questionnaire is None:
+        return
     user_id = update.effective_user.id
-    user_states[user_id] = {
-        'current_test': 'big_five',
-        'current_question': 0,
-        'responses': [],
-        'test_started': True
-    }
+    key = session_key(context, user_id)
+    
+    # Un test déjà en cours est abandonné au profit du nouveau
+    if metrics is not None:
+        previous = user_states.get(key)
+        if previous is not None:
+            metrics.test_abandoned(previous.test_id, previous.current_question, 'restart')
+    
+    # En mode sans état, la progression voyage dans les boutons
+    if stateless.is_enabled() and stateless.fits(questionnaire):
+        if key in user_states:
+            del user_states[key]
+        await send_packed_question(update, context, user_id, questionnaire, [])
+        return
+    
+    user_states[key] = Session(test_id)
     await send_question(update, context, user_id)
 
-async def start_depression(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Commande pour démarrer directement le test PHQ-9."""
-    user_id = update.effective_user.id
-    user_states[user_id] = {
-        'current_test': 'depression',
-        'current_question': 0,
-        'responses': [],
-        'test_started': True
-    }
-    await send_question(update, context, user_id)
+def make_test_command(test_id: str):
+    """Crée le handler de la commande qui démarre directement le test ``test_id``."""
+    async def start_test_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await start_test(update, context, test_id)
+    return start_test_command
 
-async def start_anxiety(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Commande pour démarrer directement le test GAD-7."""
-    user_id = update.effective_user.id
-    user_states[user_id] = {
-        'current_test': 'anxiety',
-        'current_question': 0,
-        'responses': [],
-        'test_started': True
-    }
-    await send_question(update, context, user_id)
+def next_question_index(questionnaire, responses):
+    """Indice de la question suivante dans ``questionnaire.questions``, ou ``None`` si le test est terminé."""
+    if questionnaire.adaptive is not None:
+        return questionnaire.adaptive.next_item(responses)
+    return len(responses) if len(responses) < len(questionnaire.questions) else None
 
 async def send_question(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
     """Envoie la question actuelle à l'utilisateur."""
-    user_state = user_states[user_id]
-    test_name = user_state['current_test']
-    question_index = user_state['current_question']
+    user_state = user_states[session_key(context, user_id)]
+    test_name = user_state.test_id
     
     # Récupérer les questions en fonction du test choisi
-    if test_name == 'mbti':
-        questions = mbti.questions
-    elif test_name == 'big_five':
-        questions = big_five.questions
-    elif test_name == 'depression':
-        questions = depression.questions
-    elif test_name == 'anxiety':
-        questions = anxiety.questions
-    else:
+    questionnaire = registry.get(test_name)
+    if questionnaire is None:
         return
     
     # Vérifier si le test est terminé
-    if question_index >= len(questions):
+    question_index = next_question_index(questionnaire, user_state.responses)
+    if question_index is None:
         await show_results(update, context, user_id)
         return
     
-    question_text, options = questions[question_index]
-    
-    # Créer des boutons pour les options de réponse
-    keyboard = []
-    for i, option in enumerate(options):
-        keyboard.append([InlineKeyboardButton(option, callback_data=f'answer_{i}')])
-    
-    # Ajouter un bouton Annuler
-    keyboard.append([InlineKeyboardButton("❌ Annuler le test", callback_data='cancel_test')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Texte et boutons construits au premier affichage, puis partagés
+    rendered = user_views(update, context)
+    if questionnaire.adaptive is not None:
+        text, reply_markup = rendered.adaptive_question(questionnaire, user_state.current_question, question_index)
+    else:
+        text, reply_markup = rendered.question(questionnaire, question_index)
+    await send_question_view(update, context, user_id, text, reply_markup)
+
+async def send_packed_question(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               user_id: int, questionnaire, responses: list) -> None:
+    """Envoie la question suivante d'un test sans état serveur."""
+    if len(responses) >= len(questionnaire.questions):
+        await send_results(update, context, user_id, questionnaire.id, responses)
+        return
     
-    # Envoyer la question
+    rendered = user_views(update, context)
+    text, _ = rendered.question(questionnaire, len(responses))
+    reply_markup = stateless.question_markup(user_id, questionnaire, responses, rendered)
+    await send_question_view(update, context, user_id, text, reply_markup)
+
+async def send_question_view(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                             user_id: int, text: str, reply_markup) -> None:
+    """Affiche une question, en modifiant le message du bouton cliqué si possible."""
     if update.callback_query:
         await update.callback_query.edit_message_text(
-            text=f"*Question {question_index + 1}/{len(questions)}*:\n\n{question_text}",
+            text=text,
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
     else:
         await context.bot.send_message(
             chat_id=user_id,
-            text=f"*Question {question_index + 1}/{len(questions)}*:\n\n{question_text}",
+            text=text,
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
 
-async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                        test_id: str, question_index: str, answer_index: str) -> None:
     """Traite la réponse de l'utilisateur."""
     query = update.callback_query
-    await query.answer()
-    
-    # Gestion de l'annulation
-    if query.data == 'cancel_test':
-        await cancel(update, context)
+    user_id = query.from_user.id
+    key = session_key(context, user_id)
+    user_state = user_states.get(key)
+    if user_state is None:
         return
     
-    user_id = query.from_user.id
-    if user_id not in user_states or not user_states[user_id]['test_started']:
+    # Ignorer les boutons d'un autre test ou d'une question déjà répondue
+    if test_id is not None and test_id != user_state.test_id:
+        return
+    questionnaire = registry.get(user_state.test_id)
+    if questionnaire is None:
+        return
+    # Ignorer un callback_data forgé : indices non numériques ou option inexistante
+    try:
+        question = int(question_index) if question_index is not None else None
+        answer = int(answer_index)
+    except ValueError:
+        logger.warning("Réponse invalide ignorée pour l'utilisateur %s", user_id)
+        return
+    expected = next_question_index(questionnaire, user_state.responses)
+    if expected is None or (question is not None and question != expected):
+        return
+    _, options = questionnaire.questions[expected]
+    if not 0 <= answer < len(options):
         return
     
-    # Extraire l'index de la réponse
-    answer_index = int(query.data.split('_')[1])
-    user_states[user_id]['responses'].append(answer_index)
-    user_states[user_id]['current_question'] += 1
+    if metrics is not None:
+        metrics.question_answered(user_state.test_id, user_state.current_question)
+    user_state.answer(answer)
+    user_states[key] = user_state
     
     # Envoyer la question suivante
     await send_question(update, context, user_id)
 
+async def handle_packed_answer(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               test_id: str, token: str) -> None:
+    """Traite une réponse dont le bouton porte tout l'état du test."""
+    questionnaire = registry.get(test_id)
+    if questionnaire is None:
+        return
+    
+    user_id = update.callback_query.from_user.id
+    try:
+        responses = stateless.decode_state(user_id, questionnaire, token)
+    except ValueError:
+        logger.warning("État de session rejeté pour l'utilisateur %s", user_id)
+        return
+    if len(responses) >= len(questionnaire.questions):
+        completion = (context.bot_data.get('namespace', 0), user_id, test_id, token)
+        if recent_completions.seen(completion):
+            return
+    if metrics is not None and responses:
+        metrics.question_answered(test_id, len(responses) - 1)
+    
+    await send_packed_question(update, context, user_id, questionnaire, responses)
+
+def open_result_stores() -> None:
+    """Crée le journal des résultats et les statistiques de population, une seule fois."""
+    global result_log, population, _result_stores_opened
+    if _result_stores_opened:
+        return
+    _result_stores_opened = True
+    # Importés ici : numpy et les tests restent hors du démarrage
+    from bot.population import create_population
+    from bot.results import create_result_log
+    questionnaires = registry.all_questionnaires()
+    # Pseudonymes du journal des résultats : stables tant que RESULT_LOG_SECRET ne change pas
+    result_log = create_result_log(questionnaires)
+    population = create_population(questionnaires)
+    if population is not None and metrics is not None:
+        metrics.track_population(population)
+
+def population_comparison(questionnaire, scored: dict, messages) -> str:
+    """Position du score parmi les résultats des autres utilisateurs, pour les tests à score unique."""
+    if len(questionnaire.score_maximums) != 1 or not scored:
+        return ""
+    (column,) = questionnaire.score_maximums
+    placement = population.percentile(questionnaire.id, column, scored[column])
+    if placement is None:
+        return ""
+    rank, total = placement
+    return messages.format('results.population', rank=rank, total=total)
+
 async def show_results(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
     """Affiche les résultats du test."""
-    user_state = user_states[user_id]
-    test_name = user_state['current_test']
-    responses = user_state['responses']
+    key = session_key(context, user_id)
+    user_state = user_states[key]
+    await send_results(update, context, user_id, user_state.test_id, user_state.responses)
     
+    # Réinitialiser l'état de l'utilisateur (la session a pu être évincée pendant l'envoi)
+    user_states.pop(key, None)
+
+async def send_results(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                       user_id: int, test_name: str, responses: list) -> None:
+    """Calcule et envoie les résultats d'un test terminé."""
     # Calculer les résultats
-    if test_name == 'mbti':
-        result = mbti.calculate_result(responses)
-    elif test_name == 'big_five':
-        result = big_five.calculate_result(responses)
-    elif test_name == 'depression':
-        result = depression.calculate_result(responses)
-    elif test_name == 'anxiety':
-        result = anxiety.calculate_result(responses)
+    rendered = user_views(update, context)
+    questionnaire = registry.get(test_name)
+    if questionnaire is not None:
+        result = questionnaire.calculate_result(responses, rendered.messages)
+        if metrics is not None:
+            metrics.test_completed(test_name)
+        open_result_stores()
+        # Le journal garde les réponses dans l'ordre des questions : tests complets seulement
+        if result_log is not None and questionnaire.adaptive is None:
+            result_log.record(user_id, test_name, responses)
+        scored = None
+        if population is not None:
+            scored = population.record(user_id, test_name, responses)
+            result += population_comparison(questionnaire, scored, rendered.messages)
+        # Par utilisateur Telegram, quel que soit le bot (voir bot/multibot.py)
+        if history is not None:
+            history.record(user_id, test_name, scored if scored is not None else questionnaire.scored(responses))
+    else:
+        result = rendered.messages['results.unknown_test']
+    
+    # Boutons de suite, avec l'offre d'un rappel pour les tests à refaire
+    listing = registry.listing(test_name)
+    if reminders is not None and listing is not None and listing.follow_up_days:
+        follow_up = rendered.follow_up(listing)
     else:
-        result = "Erreur: test inconnu"
+        follow_up = rendered.after_results
     
-    # Envoyer les résultats
+    # Envoyer les résultats, avec les boutons de suite dans le même message
+    # en mode LOW_ROUND_TRIP, sinon dans un second message
+    reply_markup = follow_up if LOW_ROUND_TRIP else None
     if update.callback_query:
         await update.callback_query.edit_message_text(
             text=result,
+            reply_markup=reply_markup,
             parse_mode='Markdown'
         )
     else:
         await context.bot.send_message(
             chat_id=user_id,
             text=result,
+            reply_markup=reply_markup,
             parse_mode='Markdown'
         )
     
     # Proposer de faire un autre test
-    keyboard = [
-        [InlineKeyboardButton("🔹 Faire un autre test", callback_data='new_test')],
-        [InlineKeyboardButton("🏠 Menu principal", callback_data='start')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await context.bot.send_message(
-        chat_id=user_id,
-        text="Que souhaitez-vous faire maintenant ?",
-        reply_markup=reply_markup
-    )
-    
-    # Réinitialiser l'état de l'utilisateur
-    del user_states[user_id]
+    if not LOW_ROUND_TRIP:
+        await context.bot.send_message(
+            chat_id=user_id,
+            text=rendered.messages['results.next'],
+            reply_markup=follow_up
+        )
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Affiche l'évolution des derniers résultats de l'utilisateur, test par test."""
+    rendered = user_views(update, context)
+    user_id = update.effective_user.id
+    text = rendered.messages['history.title']
+    for listing in registry.available():
+        results = await asyncio.to_thread(history.recent, user_id, listing.id)
+        if results:
+            text += rendered.history_entry(registry.get(listing.id), results)
+    if text == rendered.messages['history.title']:
+        text = rendered.messages['history.empty']
+    await update.effective_message.reply_text(text, parse_mode='Markdown')
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Annule le test en cours."""
-    user_id = update.effective_user.id
-    if user_id in user_states:
-        del user_states[user_id]
+    key = session_key(context, update.effective_user.id)
+    if key in user_states:
+        if metrics is not None:
+            state = user_states[key]
+            metrics.test_abandoned(state.test_id, state.current_question, 'cancel')
+        del user_states[key]
     
+    rendered = user_views(update, context)
     if update.callback_query:
         await update.callback_query.edit_message_text(
-            text="❌ Test annulé. Que souhaitez-vous faire ?",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🏠 Menu principal", callback_data='start')],
-                [InlineKeyboardButton("ℹ Aide", callback_data='help')]
-            ])
+            text=rendered.messages['test.cancelled'],
+            reply_markup=rendered.cancelled
         )
     else:
         await update.message.reply_text(
-            "❌ Test annulé. Utilisez /start pour recommencer ou /help pour voir les options."
+            rendered.messages['test.cancelled_command']
         )
 
-async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str) -> None:
     """Gère les actions du menu principal."""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.data == 'start':
+    if action == 'start':
         await show_main_menu(update, context)
-    elif query.data == 'help':
+    elif action == 'help':
         await help_command(update, context)
-    elif query.data == 'new_test':
+    elif action == 'new_test':
         await show_main_menu(update, context)
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Affiche le menu principal (version compatible callback et commande)"""
     user = update.effective_user
-    keyboard = [
-        [
-            InlineKeyboardButton("🧠 Test MBTI", callback_data='mbti'),
-            InlineKeyboardButton("🌊 Big Five", callback_data='big_five'),
-        ],
-        [
-            InlineKeyboardButton("😔 Test Dépression", callback_data='depression'),
-            InlineKeyboardButton("😰 Test Anxiété", callback_data='anxiety'),
-        ],
-        [
-            InlineKeyboardButton("ℹ Aide", callback_data='help'),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    text = f"Bonjour {user.first_name}!\n" + START_MESSAGE
+    rendered = user_views(update, context)
+    reply_markup = rendered.main_menu
+    
+    text = rendered.messages.format('menu.greeting', name=user.first_name) + rendered.messages['start']
     
     if update.callback_query:
         await update.callback_query.edit_message_text(
@@ -338,37 +437,330 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             parse_mode='Markdown'
         )
 
+async def handle_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE, test_id: str, choice: str) -> None:
+    """Programme (``on``) ou annule (``off``) le rappel de refaire ``test_id``."""
+    listing = registry.listing(test_id)
+    if reminders is None or listing is None or not listing.follow_up_days:
+        return
+    user_id = update.callback_query.from_user.id
+    key = session_key(context, user_id)
+    rendered = user_views(update, context)
+    
+    if choice == 'off':
+        await reminders.cancel(key, test_id)
+        await update.callback_query.edit_message_text(text=rendered.messages['reminders.cancelled'])
+        return
+    
+    # Un seul rappel par test : un second clic le reporte
+    due = time.time() + listing.follow_up_days * 86400
+    await reminders.schedule(key, test_id, due, rendered.messages.code)
+    date = time.strftime(rendered.messages['reminders.date_format'], time.localtime(due))
+    await context.bot.send_message(
+        chat_id=user_id,
+        text=rendered.messages.format('reminders.scheduled', name=rendered.label(listing), date=date),
+        reply_markup=rendered.reminder_cancel(test_id)
+    )
+
+# Handlers des boutons et nombre d'arguments attendu, indexés par action (voir bot/callbacks.py)
+CALLBACK_ACTIONS = {
+    callbacks.MENU: (handle_menu, 1),
+    callbacks.START_TEST: (start_test, 1),
+    callbacks.ANSWER: (handle_answer, 3),
+    callbacks.PACKED_ANSWER: (handle_packed_answer, 2),
+    callbacks.CANCEL: (cancel, 0),
+    callbacks.REMIND: (handle_reminder, 2),
+}
+CALLBACK_ARGUMENTS = {action: count for action, (_, count) in CALLBACK_ACTIONS.items()}
+
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Point d'entrée unique des boutons : décode le callback_data et appelle son handler."""
+    query = update.callback_query
+    if recent_callbacks.seen((context.bot_data.get('namespace', 0), query.id)):
+        return
+    
+    # En mode LOW_ROUND_TRIP, la réponse au callback part en même temps que le
+    # message du handler au lieu de le précéder
+    if LOW_ROUND_TRIP:
+        answering = asyncio.create_task(query.answer())
+    else:
+        await query.answer()
+        answering = None
+    
+    try:
+        # Un callback forgé ou périmé peut porter une action inconnue ou
+        # un mauvais nombre d'arguments
+        parsed = callbacks.parse(query.data, CALLBACK_ARGUMENTS)
+        if parsed is None:
+            logger.warning("callback_data inconnu ou invalide : %r", query.data)
+            return
+        handler = CALLBACK_ACTIONS[parsed[0]][0]
+        
+        if metrics is None:
+            await handler(update, context, *parsed[1])
+        else:
+            started = time.perf_counter()
+            try:
+                await handler(update, context, *parsed[1])
+            finally:
+                metrics.observe_handler(handler.__name__, time.perf_counter() - started)
+    finally:
+        if answering is not None:
+            # Un échec de la réponse (requête expirée…) ne doit pas masquer
+            # l'exception du handler
+            try:
+                await answering
+            except TelegramError as exc:
+                logger.info("Réponse au callback %s impossible : %s", query.id, exc)
+
+async def notify_expired_session(application, user_id: int, state: Session) -> None:
+    """Prévient l'utilisateur que son test a expiré faute d'activité."""
+    # La session ne garde pas la langue de l'utilisateur : langue du bot, ou par défaut
+    rendered = views(application.bot_data.get('language'))
+    listing = registry.listing(state.test_id)
+    name = rendered.label(listing) if listing else rendered.messages['test.current']
+    try:
+        await application.bot.send_message(
+            chat_id=user_id,
+            text=rendered.messages.format('test.expired', name=name),
+            reply_markup=rendered.main_menu
+        )
+    except TelegramError as exc:
+        logger.info("Avis d'expiration non remis à %s : %s", user_id, exc)
+
+async def sweep_sessions(interval: float) -> None:
+    """Retire périodiquement les sessions inactives, même sans trafic."""
+    while True:
+        await asyncio.sleep(interval)
+        expired = user_states.expire()
+        if expired:
+            logger.info("%d sessions inactives expirées, %s", expired, user_states.stats())
+
+async def start_session_expiry(application) -> None:
+    """Branche le suivi des évictions et lance le balayage des sessions inactives."""
+    def on_evict(key, state, reason):
+        if metrics is not None:
+            metrics.test_abandoned(state.test_id, state.current_question, reason)
+        # Les évictions pour capacité arrivent en rafale sous charge : pas d'avis
+        if SESSION_EXPIRY_NOTICE and reason == EVICTED_IDLE:
+            owner, user_id = resolve_session(key)
+            if owner is not None:
+                owner.create_task(notify_expired_session(owner, user_id, state))
+    
+    if hasattr(user_states, 'on_evict') and (SESSION_EXPIRY_NOTICE or metrics is not None):
+        user_states.on_evict = on_evict
+    
+    idle_timeout = getattr(user_states, 'idle_timeout', None)
+    if idle_timeout:
+        _background_tasks.append(asyncio.create_task(sweep_sessions(min(60.0, idle_timeout / 4))))
+
+async def start_metrics(application) -> None:
+    """Sert /metrics et mesure le retard de la boucle asyncio."""
+    global _metrics_server
+    _metrics_server = await serve_metrics(metrics, os.getenv('METRICS_LISTEN', '127.0.0.1'), int(METRICS_PORT))
+    _background_tasks.append(asyncio.create_task(watch_event_loop(metrics)))
+
+async def snapshot_population(interval: float) -> None:
+    """Écrit périodiquement les statistiques de population et relit celles des autres processus."""
+    while True:
+        await asyncio.sleep(interval)
+        if population is None:
+            continue
+        try:
+            # Écriture du fichier hors de la boucle, comme history.recent
+            await asyncio.to_thread(population.snapshot)
+        except OSError as exc:
+            logger.warning("Instantané des statistiques de population impossible : %s", exc)
+
+async def send_reminder(reminder) -> None:
+    """Propose à l'utilisateur de refaire le test de ``reminder``, dans sa langue, par le bot où il l'a demandé."""
+    application, user_id = resolve_session(reminder.user_id)
+    listing = registry.listing(reminder.test_id)
+    if application is None or listing is None:
+        return
+    rendered = views(reminder.language)
+    await application.bot.send_message(
+        chat_id=user_id,
+        text=rendered.messages.format('reminders.due', name=rendered.label(listing), days=listing.follow_up_days),
+        reply_markup=rendered.reminder_due(reminder.test_id)
+    )
+
+async def start_history_export() -> None:
+    """Sert l'export de l'historique, protégé par HISTORY_EXPORT_TOKEN."""
+    global _export_server
+    token = os.getenv('HISTORY_EXPORT_TOKEN')
+    if not token:
+        raise ValueError("HISTORY_EXPORT_PORT nécessite HISTORY_EXPORT_TOKEN")
+    _export_server = await serve_export(history, os.getenv('HISTORY_EXPORT_LISTEN', '127.0.0.1'),
+                                        int(os.getenv('HISTORY_EXPORT_PORT')), token)
+
+async def start_background_tasks(application) -> None:
+    """Lance les tâches de fond au démarrage du bot."""
+    await start_session_expiry(application)
+    if os.getenv('POPULATION_DIR'):
+        interval = float(os.getenv('POPULATION_SNAPSHOT_INTERVAL', '60'))
+        _background_tasks.append(asyncio.create_task(snapshot_population(interval)))
+    if reminders is not None:
+        _background_tasks.append(asyncio.create_task(reminders.run(send_reminder)))
+    if metrics is not None:
+        await start_metrics(application)
+    if history is not None and os.getenv('HISTORY_EXPORT_PORT'):
+        await start_history_export()
+
+async def stop_background_tasks(application) -> None:
+    """Arrête les tâches de fond et écrit les sessions, résultats et statistiques en attente à l'arrêt du bot."""
+    global _metrics_server, _export_server, result_log, reminders, history, recorder
+    for task in _background_tasks:
+        task.cancel()
+    _background_tasks.clear()
+    if _metrics_server is not None:
+        _metrics_server.close()
+        _metrics_server = None
+    if _export_server is not None:
+        _export_server.close()
+        _export_server = None
+    user_states.close()
+    if reminders is not None:
+        reminders.close()
+        reminders = None
+    if history is not None:
+        history.close()
+        history = None
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+    if result_log is not None:
+        result_log.close()
+        result_log = None
+    if population is not None:
+        await asyncio.to_thread(population.snapshot)
+
+def configure_process(token: str) -> None:
+    """Configuration commune à tous les bots du processus, d'après le token du premier."""
+    global reminders, history, recorder
+    # Clé de signature des sessions sans état, commune à tous les workers
+    stateless.configure(os.getenv('CALLBACK_SECRET') or token)
+    # Vérifié au démarrage : le journal n'est ouvert qu'au premier résultat
+    if os.getenv('RESULT_LOG_DIR') and not os.getenv('RESULT_LOG_SECRET'):
+        raise ValueError("RESULT_LOG_DIR nécessite RESULT_LOG_SECRET")
+    # Par défaut, les tests se chargent à leur première utilisation
+    if os.getenv('PRELOAD_TESTS', '0') == '1':
+        open_result_stores()
+    # Chaque worker n'envoie que les rappels de ses utilisateurs (voir bot/shards.py)
+    workers = int(os.getenv('SHARD_WORKERS', '0'))
+    if workers and os.getenv('SHARD_INDEX'):
+        index = int(os.getenv('SHARD_INDEX'))
+        reminders = create_reminders(owns=lambda user_id: shards.shard_for(user_id, workers) == index)
+    else:
+        reminders = create_reminders()
+    history = create_history()
+    recorder = create_recorder(token)
+
+def build_application(token: str, concurrent_updates: int = 0, namespace: int = 0, language: str = None,
+                      requests: tuple = None):
+    """Crée l'application et enregistre tous les handlers du bot.
+    
+    Avec plusieurs bots (voir bot/multibot.py), chacun a son espace de
+    sessions ``namespace``, éventuellement sa langue, et ses clients HTTP
+    ``requests`` (appels, ``getUpdates``) dimensionnés par ``multibot``.
+    """
+    if namespace == 0:
+        configure_process(token)
+    
+    builder = ApplicationBuilder().token(token).post_init(start_background_tasks).post_shutdown(stop_background_tasks)
+    # Pool de connexions persistantes vers l'API (voir bot/http.py)
+    if requests is None:
+        requests = (request_from_env(metrics), get_updates_request())
+    builder.request(requests[0])
+    builder.get_updates_request(requests[1])
+    if concurrent_updates:
+        # Parallèle entre utilisateurs, séquentiel pour un même utilisateur
+        builder.concurrent_updates(PerUserUpdateProcessor(concurrent_updates))
+    # Limites d'envoi de Telegram (flood control), sur demande : le seau par
+    # conversation retarderait les éditions qui suivent chaque clic
+    if os.getenv('OUTBOUND_SCHEDULER', '0') == '1':
+        scheduler = OutboundScheduler(
+            global_rate=float(os.getenv('RATE_LIMIT_GLOBAL', '30')),
+            chat_rate=float(os.getenv('RATE_LIMIT_CHAT', '1'))
+        )
+        builder.rate_limiter(scheduler)
+        if metrics is not None:
+            metrics.track_outbound(namespace, scheduler)
+    # Permet de pointer le bot vers une autre API (serveur local, faux serveur de test)
+    if os.getenv('TELEGRAM_API_URL'):
+        builder.base_url(os.getenv('TELEGRAM_API_URL'))
+    application = builder.build()
+    application.bot_data['namespace'] = namespace
+    if language is not None:
+        application.bot_data['language'] = language
+    _applications[namespace] = application
+    
+    # Durée de chaque handler si les métriques sont activées
+    timed = metrics.timed if metrics is not None else (lambda callback: callback)
+    
+    # Enregistre chaque mise à jour avant les autres handlers
+    if recorder is not None:
+        application.add_handler(TypeHandler(Update, recorder.handle), group=-1)
+    
+    # Ajoute les handlers de commande
+    application.add_handler(CommandHandler("start", timed(show_main_menu)))
+    application.add_handler(CommandHandler("help", timed(help_command)))
+    application.add_handler(CommandHandler("cancel", timed(cancel)))
+    if history is not None:
+        application.add_handler(CommandHandler("history", timed(history_command)))
+    for listing in registry.available():
+        application.add_handler(CommandHandler(listing.command, timed(make_test_command(listing.id))))
+    
+    # Un seul handler pour tous les boutons, dispatch par action
+    application.add_handler(CallbackQueryHandler(timed(handle_callback)))
+    
+    return application
+
+def run_webhook(token: str) -> None:
+    """Sert le bot derrière un webhook, avec traitement concurrent des mises à jour."""
+    webhook_url = os.getenv('WEBHOOK_URL')
+    secret = os.getenv('WEBHOOK_SECRET')
+    if not webhook_url or not secret:
+        raise ValueError("Le mode webhook nécessite WEBHOOK_URL et WEBHOOK_SECRET")
+    
+    url_path = os.getenv('WEBHOOK_PATH', 'webhook')
+    application = build_application(token, concurrent_updates=int(os.getenv('CONCURRENT_UPDATES', '256')))
+    application.run_webhook(
+        listen=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+        port=int(os.getenv('WEBHOOK_PORT', '8443')),
+        url_path=url_path,
+        webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+        secret_token=secret,
+        max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '100'))
+    )
+
 def main() -> None:
     """Lance le bot."""
+    mode = os.getenv('TELEGRAM_MODE', 'polling')
+    if mode not in ('polling', 'webhook'):
+        raise ValueError(f"Mode inconnu : {mode} (attendu : polling ou webhook)")
+    workers = int(os.getenv('SHARD_WORKERS', '0'))
+    
+    # Plusieurs bots dans ce processus (voir bot/multibot.py)
+    bots_file = os.getenv('BOTS_FILE')
+    if bots_file:
+        if workers:
+            raise ValueError("BOTS_FILE et SHARD_WORKERS ne peuvent pas être combinés")
+        multibot.serve(multibot.load_configs(bots_file), build_application, mode,
+                       start_background_tasks, stop_background_tasks, metrics=metrics)
+        return
+    
     # Récupère le token depuis les variables d'environnement
     token = os.getenv('TELEGRAM_TOKEN')
     if not token:
         raise ValueError("Le token Telegram n'a pas été trouvé dans les variables d'environnement")
     
-    # Crée l'application
-    application = ApplicationBuilder().token(token).build()
-    
-    # Ajoute les handlers de commande
-    application.add_handler(CommandHandler("start", show_main_menu))
-    application.add_handler(CallbackQueryHandler(show_main_menu, pattern='^start$'))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("cancel", cancel))
-    application.add_handler(CommandHandler("mbti", start_mbti))
-    application.add_handler(CommandHandler("bigfive", start_big_five))
-    application.add_handler(CommandHandler("depression", start_depression))
-    application.add_handler(CommandHandler("anxiety", start_anxiety))
-    
-    # Handlers pour les callbacks
-    application.add_handler(CallbackQueryHandler(start_mbti, pattern='^mbti$'))
-    application.add_handler(CallbackQueryHandler(start_big_five, pattern='^big_five$'))
-    application.add_handler(CallbackQueryHandler(start_depression, pattern='^depression$'))
-    application.add_handler(CallbackQueryHandler(start_anxiety, pattern='^anxiety$'))
-    application.add_handler(CallbackQueryHandler(handle_answer, pattern='^answer_'))
-    application.add_handler(CallbackQueryHandler(handle_menu, pattern='^(start|help|new_test)$'))
-    application.add_handler(CallbackQueryHandler(cancel, pattern='^cancel_test$'))
-    
-    # Lance le bot
-    application.run_polling()
+    # Plusieurs processus, chaque utilisateur toujours sur le même (voir bot/shards.py)
+    if workers:
+        shards.supervise(token, workers, build_application, mode)
+    elif mode == 'webhook':
+        run_webhook(token)
+    else:
+        build_application(token).run_polling()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
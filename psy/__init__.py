@@ -0,0 +1,5 @@
+# Questionnaires proposés, dans l'ordre du menu principal. Leurs modules ne
+# sont importés qu'à la première demande (voir psy.registry).
+from psy import registry
+
+registry.declare('mbti', 'big_five', 'depression', 'anxiety')
@@ -1,50 +1,35 @@
-questions = [
-    (
-        "Sentiment de nervosité, d'anxiété ou de tension",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Incapacité à arrêter ou à contrôler les inquiétudes",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Inquiétude excessive à propos de différentes choses",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Difficulté à se détendre",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Agitation si intense qu'il est difficile de rester assis tranquillement",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Devenir facilement agacé ou irritable",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Sentiment de peur comme si quelque chose de terrible allait arriver",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    )
-]
+import locales
+from psy import plans, scoring
+from psy.registry import Questionnaire, register
 
-def calculate_result(responses):
-    """Calcule le score GAD-7 et fournit une interprétation."""
-    score = sum(responses)
-    
-    result = f"Votre score GAD-7 est: {score}/21\n\n"
-    
-    if score < 5:
-        result += "Pas d'anxiété significative."
-    elif 5 <= score <= 9:
-        result += "Anxiété légère."
-    elif 10 <= score <= 14:
-        result += "Anxiété modérée."
-    else:
-        result += "Anxiété sévère."
-    
-    result += "\n\nCe test (GAD-7) est un outil de dépistage et ne remplace pas un diagnostic professionnel. "
-    result += "Si vos résultats suggèrent une possible anxiété, veuillez consulter un professionnel de santé."
-    
-    return result
\ No newline at end of file
+# Questions, sous-échelle et tranches : psy/definitions/anxiety.json
+definition = plans.load('anxiety')
+questions = definition.questions
+
+_bands = definition.subscale('total')['bands']
+CUT_POINTS = tuple(_bands['cut_points'])
+SEVERITY_LEVELS = tuple(_bands['levels'])
+
+def score(responses):
+    """Score GAD-7 et tranche de sévérité (indice dans ``SEVERITY_LEVELS``) de chaque ligne."""
+    matrix = scoring.as_matrix(responses, len(questions), definition.plan.option_counts)
+    total = definition.plan.score(matrix)[:, 0]
+    return {'score': total, 'severity': scoring.band(total, CUT_POINTS)}
+
+def calculate_result(responses, messages=None):
+    """Calcule le score GAD-7 et fournit une interprétation, dans la langue de ``messages``."""
+    messages = locales.catalog() if messages is None else messages
+    scored = score(responses)
+    severity = messages['anxiety.severity'][scored['severity'][0]]
+    return messages.format('anxiety.result', score=scored['score'][0], severity=severity)
+
+register(Questionnaire(
+    id=definition.id,
+    command=definition.command,
+    label=definition.label,
+    questions=questions,
+    calculate_result=calculate_result,
+    score=score,
+    result_levels={'severity': SEVERITY_LEVELS},
+    score_maximums={'score': definition.plan.maximums[0].item()}
+))
@@ -0,0 +1,141 @@
+"""Calcul des scores par lots à partir d'un fichier CSV.
+
+Le fichier d'entrée a une ligne d'en-tête ; chaque ligne contient les
+colonnes d'identification (``--id-columns``, recopiées telles quelles) puis
+une colonne par question, dans l'ordre du questionnaire, avec l'indice de
+l'option choisie (0 pour la première). Le fichier est lu par blocs de
+``--chunk-size`` lignes, chaque bloc est calculé d'un coup par la fonction
+``score`` du questionnaire, et les résultats sont écrits au fil de l'eau.
+
+Les lignes incomplètes, hors intervalle ou dont une réponse n'est pas écrite
+avec un à quatre chiffres ASCII sont recopiées avec des colonnes de résultat
+vides et comptées sur la sortie d'erreur.
+
+Usage :
+    python -m psy.batch depression reponses.csv -o scores.csv --id-columns user_id,date
+    zcat reponses.csv.gz | python -m psy.batch anxiety - > scores.csv
+"""
+
+import argparse
+import csv
+import itertools
+import sys
+import time
+
+import numpy as np
+
+from psy import registry
+
+# Chiffres au plus par réponse : au-delà, la cellule est invalide
+MAX_CELL_DIGITS = 4
+
+
+def score_chunk(questionnaire, cells: list):
+    """Calcule les scores d'un bloc de réponses encore sous forme de texte.
+
+    Retourne les colonnes de résultat (libellés substitués aux codes) et le
+    masque des lignes valides.
+    """
+    question_count = len(questionnaire.questions)
+    option_counts = np.array([len(options) for _, options in questionnaire.questions])
+    # Un caractère de plus que le maximum : une cellule trop longue est
+    # tronquée mais reste reconnaissable à sa longueur
+    text = np.array(cells, dtype=f'U{MAX_CELL_DIGITS + 1}')
+    if text.ndim != 2 or text.shape[1] != question_count:
+        raise ValueError(f"{question_count} colonnes de réponses attendues")
+    lengths = np.char.str_len(text)
+    # Chiffres ASCII seulement : isdigit accepte aussi « ٣ », que astype refuse
+    codes = text.view(np.uint32).reshape(text.shape + (MAX_CELL_DIGITS + 1,))
+    digits = (codes >= ord('0')) & (codes <= ord('9'))
+    digits |= np.arange(MAX_CELL_DIGITS + 1) >= lengths[..., np.newaxis]
+    valid = (digits.all(axis=2) & (lengths > 0) & (lengths <= MAX_CELL_DIGITS)).all(axis=1)
+    text[~valid] = '0'
+    matrix = text.astype(np.int16)
+    valid &= (matrix < option_counts).all(axis=1)
+    matrix[~valid] = 0
+
+    columns = questionnaire.score(matrix)
+    for name, levels in questionnaire.result_levels.items():
+        columns[name] = np.asarray(levels)[columns[name]]
+    return columns, valid
+
+
+def run(args) -> int:
+    questionnaire = registry.get(args.test)
+    if questionnaire is None or questionnaire.score is None:
+        available = ', '.join(q.id for q in registry.all_questionnaires() if q.score is not None)
+        print(f"Questionnaire inconnu ou sans calcul par lots : {args.test} (disponibles : {available})",
+              file=sys.stderr)
+        return 2
+
+    source = sys.stdin if args.input == '-' else open(args.input, newline='', encoding='utf-8')
+    target = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    reader = csv.reader(source, delimiter=args.delimiter)
+    writer = csv.writer(target, delimiter=args.delimiter, lineterminator='\n')
+
+    header = next(reader, None)
+    if header is None:
+        print("Fichier d'entrée vide", file=sys.stderr)
+        return 2
+    id_columns = [name for name in args.id_columns.split(',') if name]
+    missing = [name for name in id_columns if name not in header]
+    if missing:
+        print(f"Colonnes d'identification absentes : {', '.join(missing)}", file=sys.stderr)
+        return 2
+    id_indices = [header.index(name) for name in id_columns]
+    item_indices = [index for index in range(len(header)) if index not in id_indices]
+    if len(item_indices) != len(questionnaire.questions):
+        print(f"{len(questionnaire.questions)} colonnes de réponses attendues pour {questionnaire.id}, "
+              f"{len(item_indices)} trouvées", file=sys.stderr)
+        return 2
+
+    # Noms des colonnes de résultat, obtenus sur un bloc vide
+    result_columns = list(questionnaire.score(np.zeros((0, len(item_indices)), dtype=np.int16)))
+    writer.writerow(id_columns + result_columns)
+
+    rows = invalid = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            chunk = list(itertools.islice(reader, args.chunk_size))
+            if not chunk:
+                break
+            cells = [[row[index] if index < len(row) else '' for index in item_indices] for row in chunk]
+            columns, valid = score_chunk(questionnaire, cells)
+            values = [column.tolist() for column in columns.values()]
+            empty = [''] * len(values)
+            for position, row in enumerate(chunk):
+                ids = [row[index] for index in id_indices]
+                if valid[position]:
+                    writer.writerow(ids + [column[position] for column in values])
+                else:
+                    writer.writerow(ids + empty)
+            rows += len(chunk)
+            invalid += int(len(chunk) - valid.sum())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{rows} lignes calculées en {elapsed:.2f} s ({rows / elapsed if elapsed else 0:.0f} lignes/s), "
+          f"{invalid} invalides", file=sys.stderr)
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m psy.batch', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('test', help="identifiant du questionnaire (depression, anxiety, mbti…)")
+    parser.add_argument('input', help="fichier CSV d'entrée, ou - pour l'entrée standard")
+    parser.add_argument('-o', '--output', default='-', help="fichier CSV de sortie (par défaut : sortie standard)")
+    parser.add_argument('--id-columns', default='', help="colonnes recopiées en sortie, séparées par des virgules")
+    parser.add_argument('--chunk-size', type=int, default=100_000, help="lignes calculées par bloc")
+    parser.add_argument('--delimiter', default=',')
+    args = parser.parse_args()
+    sys.exit(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,53 +1,49 @@
-questions = [
-    (
-        "Je suis quelqu'un qui parle facilement aux autres.",
-        ["Fortement en désaccord", "En désaccord", "Neutre", "D'accord", "Fortement d'accord"]
-    ),
-    (
-        "Je suis quelqu'un qui a tendance à critiquer les autres.",
-        ["Fortement en désaccord", "En désaccord", "Neutre", "D'accord", "Fortement d'accord"]
-    ),
-    (
-        "Je fais mon travail de manière méthodique.",
-        ["Fortement en désaccord", "En désaccord", "Neutre", "D'accord", "Fortement d'accord"]
-    ),
-    (
-        "Je suis souvent stressé(e) ou anxieux(se).",
-        ["Fortement en désaccord", "En désaccord", "Neutre", "D'accord", "Fortement d'accord"]
-    ),
-    (
-        "J'ai une imagination active.",
-        ["Fortement en désaccord", "En désaccord", "Neutre", "D'accord", "Fortement d'accord"]
-    )
-    # Ajouter plus de questions pour chaque trait (Extraversion, Agréabilité, Conscience, Névrosisme, Ouverture)
-]
+import locales
+from psy import cat, plans, scoring
+from psy.registry import Questionnaire, register
 
-def calculate_result(responses: str) -> str:
-    """Calcule les scores pour les 5 grands traits de personnalité."""
-    # Dans une vraie implémentation, on calculerait les scores pour chaque trait
-    # en fonction des réponses. Ceci est un exemple simplifié.
-    
-    traits = {
-        "Extraversion": 0,
-        "Agréabilité": 0,
-        "Conscience": 0,
-        "Névrosisme": 0,
-        "Ouverture": 0
-    }
-    
-    # Ici, on devrait avoir une logique pour calculer chaque trait
-    # en fonction des réponses spécifiques qui s'y rapportent
+# Questions, trait de chacune et items inversés : psy/definitions/big_five.json
+definition = plans.load('big_five')
+questions = definition.questions
+
+def _columns(traits):
+    return {trait: traits[:, column] for column, trait in enumerate(definition.plan.subscales)}
+
+def score(responses):
+    """Score de chaque trait (une colonne par sous-échelle) de chaque ligne."""
+    matrix = scoring.as_matrix(responses, len(questions), definition.plan.option_counts)
+    return _columns(definition.plan.score(matrix))
+
+# Mode adaptatif si la définition fournit une banque calibrée (voir psy.cat)
+adaptive = cat.AdaptivePlan(definition, _columns) if definition.adaptive is not None else None
+
+def calculate_result(responses, messages=None) -> str:
+    """Calcule les scores pour les 5 grands traits de personnalité, dans la langue de ``messages``."""
+    messages = locales.catalog() if messages is None else messages
+    scored = adaptive.score(responses) if adaptive is not None else score(responses)
+    # Libellés et descriptions des traits : ceux du catalogue s'il les traduit
+    subscales = [
+        messages.get('big_five.subscales', {}).get(subscale['id'], subscale) for subscale in definition.subscales
+    ]
     
-    result = "📊 Résultats du Test Big Five (OCEAN):\n\n"
-    for trait, score in traits.items():
-        result += f"{trait}: {score}/20\n"
+    result = messages['big_five.title']
+    for subscale, column, maximum in zip(subscales, definition.plan.subscales, definition.plan.maximums):
+        result += messages.format('big_five.score', label=subscale['label'], score=scored[column][0], maximum=maximum)
     
-    result += "\nInterprétation:\n"
-    result += "- Extraversion: Sociabilité et énergie\n"
-    result += "- Agréabilité: Compassion et coopération\n"
-    result += "- Conscience: Auto-discipline et organisation\n"
-    result += "- Névrosisme: Tendance à éprouver des émotions négatives\n"
-    result += "- Ouverture: Appréciation pour l'art, l'aventure, les idées\n"
-    result += "\nCes résultats sont indicatifs et ne constituent pas un diagnostic."
+    result += messages['big_five.interpretation']
+    for subscale in subscales:
+        result += messages.format('big_five.trait', label=subscale['label'], description=subscale['description'])
+    result += messages['big_five.disclaimer']
     
-    return result
\ No newline at end of file
+    return result
+
+register(Questionnaire(
+    id=definition.id,
+    command=definition.command,
+    label=definition.label,
+    questions=questions,
+    calculate_result=calculate_result,
+    score=score,
+    score_maximums=dict(zip(definition.plan.subscales, definition.plan.maximums.tolist())),
+    adaptive=adaptive
+))
@@ -0,0 +1,216 @@
+"""Mode adaptatif (CAT) des questionnaires dont la banque est calibrée en IRT.
+
+Modèle : réponse graduée de Samejima (2PL pour deux options), un trait
+``θ`` par sous-échelle, a priori normal centré réduit. La loi a posteriori
+de chaque trait est tenue sur une grille de ``GRID_POINTS`` points entre
+``-GRID_LIMIT`` et ``GRID_LIMIT`` : une réponse ajoute une ligne de
+log-vraisemblance précalculée, sans intégration numérique.
+
+Tables précalculées à la création du plan (``AdaptivePlan``) :
+
+- la log-vraisemblance de chaque option de chaque question sur la grille ;
+- pour chaque point de la grille, les questions de chaque sous-échelle
+  triées par information de Fisher décroissante. Choisir la question
+  suivante revient à prendre le premier élément non posé de la ligne du
+  ``θ`` estimé ;
+- le score attendu sur la banque complète (courbe caractéristique), pour
+  rendre un résultat sur l'échelle du test complet.
+
+La sous-échelle interrogée est, parmi celles qui ne sont pas arrêtées,
+celle qui a reçu le moins de questions. Une sous-échelle s'arrête :
+
+- si elle a deux pôles (MBTI), dès que la probabilité a posteriori du pôle
+  retenu atteint ``confidence`` ;
+- sinon, dès que l'écart-type a posteriori de ``θ`` descend sous
+  ``standard_error`` ;
+- quand toutes ses questions ont été posées.
+
+Le test s'arrête quand toutes les sous-échelles sont arrêtées, ou après
+``max_items`` questions. Ces critères viennent du bloc ``adaptive`` de la
+définition (voir ``psy.plans``)::
+
+    "adaptive": {"confidence": 0.95, "standard_error": 0.45, "max_items": 24}
+
+La suite des questions ne dépend que des réponses : une session ne garde
+que ses réponses, dans l'ordre où elles ont été données, et l'état est
+reconstruit à partir d'elles. Les états sont gardés en cache par préfixe
+de réponses (beaucoup d'utilisateurs partagent les mêmes débuts de test) :
+un clic ne coûte en général qu'une mise à jour de la grille.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+GRID_POINTS = 81
+GRID_LIMIT = 4.0
+# États mémorisés, par préfixe de réponses
+STATE_CACHE = 16384
+
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_STANDARD_ERROR = 0.45
+
+
+class _State:
+    """État après un préfixe de réponses (immuable, partagé par le cache)."""
+
+    __slots__ = ('items', 'log_posteriors', 'estimates', 'errors', 'above', 'counts', 'next_item')
+
+
+class AdaptivePlan:
+    """Tables et critères du mode adaptatif d'une définition ``psy.plans``.
+
+    ``columns`` convertit une matrice de scores ``(n, sous-échelles)`` en
+    colonnes de résultat : la même fonction sert au test complet et au
+    score attendu d'une session adaptative.
+    """
+
+    def __init__(self, definition, columns):
+        plan = definition.plan
+        settings = definition.adaptive or {}
+        self.columns = columns
+        self.confidence = float(settings.get('confidence', DEFAULT_CONFIDENCE))
+        self.standard_error = float(settings.get('standard_error', DEFAULT_STANDARD_ERROR))
+        self.max_items = min(int(settings.get('max_items', len(definition.questions))), len(definition.questions))
+
+        item_count, subscale_count = plan.weights.shape
+        self.grid = np.linspace(-GRID_LIMIT, GRID_LIMIT, GRID_POINTS)
+        self.integral = np.issubdtype(plan.weights.dtype, np.integer)
+        self.maximums = plan.maximums
+        # Sous-échelle de chaque question, et sens de lecture de ses options
+        self.subscale_of = np.abs(plan.weights).argmax(axis=1)
+        weights = plan.weights[np.arange(item_count), self.subscale_of]
+        self.option_counts = plan.option_counts.tolist()
+
+        log_likelihood = np.full((item_count, max(self.option_counts), GRID_POINTS), -np.inf)
+        information = np.zeros((item_count, GRID_POINTS))
+        expected = np.zeros((subscale_count, GRID_POINTS))
+        for item, (discrimination, thresholds) in enumerate(definition.irt):
+            # P(réponse ≥ k | θ), de k = 0 (certain) à k = options (impossible)
+            cumulative = np.ones((len(thresholds) + 2, GRID_POINTS))
+            cumulative[1:-1] = 1 / (1 + np.exp(-discrimination * (self.grid - np.asarray(thresholds)[:, None])))
+            cumulative[-1] = 0
+            probabilities = np.clip(cumulative[:-1] - cumulative[1:], 1e-12, None)
+            slopes = discrimination * cumulative * (1 - cumulative)
+            information[item] = ((slopes[:-1] - slopes[1:]) ** 2 / probabilities).sum(axis=0)
+            expected[self.subscale_of[item]] += abs(weights[item]) * cumulative[1:-1].sum(axis=0)
+            # Les seuils suivent le sens de la sous-échelle : une question
+            # inversée lit ses options à l'envers
+            oriented = probabilities[::-1] if weights[item] < 0 else probabilities
+            log_likelihood[item, :len(probabilities)] = np.log(oriented)
+        self.log_likelihood = log_likelihood
+        self.information = information
+        self.expected = expected
+
+        self.subscale_items = [np.flatnonzero(self.subscale_of == subscale) for subscale in range(subscale_count)]
+        # Questions de chaque sous-échelle par information décroissante, pour chaque point de la grille
+        self.orders = [
+            [items[column].tolist() for column in np.argsort(-information[items], axis=0, kind='stable').T]
+            for items in self.subscale_items
+        ]
+        # Sous-échelles à deux pôles : seuil de θ au-delà duquel le second pôle l'emporte
+        self.cuts = [
+            _first(2 * self._rounded(expected[subscale]) >= self.maximums[subscale])
+            if 'poles' in definition.subscales[subscale] else None
+            for subscale in range(subscale_count)
+        ]
+        self.log_prior = -self.grid ** 2 / 2
+        self._state = lru_cache(maxsize=STATE_CACHE)(self._compute_state)
+
+    def _rounded(self, scores: np.ndarray) -> np.ndarray:
+        return np.rint(scores) if self.integral else scores
+
+    # -- États --------------------------------------------------------------------
+
+    def state(self, answers) -> _State:
+        """État après ``answers`` (indices d'options, dans l'ordre posé).
+
+        Lève ``ValueError`` si une réponse n'existe pas ou arrive après la fin du test.
+        """
+        return self._state(bytes(answers))
+
+    def _compute_state(self, answers: bytes) -> _State:
+        if not answers:
+            state = _State()
+            state.items = ()
+            state.log_posteriors = (self.log_prior,) * len(self.subscale_items)
+            summaries = [self._summarize(self.log_prior, cut) for cut in self.cuts]
+            state.estimates, state.errors, state.above = (tuple(values) for values in zip(*summaries))
+            state.counts = (0,) * len(self.subscale_items)
+            state.next_item = self._select(state)
+            return state
+
+        previous = self._state(answers[:-1])
+        item, answer = previous.next_item, answers[-1]
+        if item is None or answer >= self.option_counts[item]:
+            raise ValueError("Réponse adaptative invalide")
+        subscale = self.subscale_of[item]
+        log_posterior = previous.log_posteriors[subscale] + self.log_likelihood[item, answer]
+        estimate, error, above = self._summarize(log_posterior, self.cuts[subscale])
+
+        state = _State()
+        state.items = previous.items + (item,)
+        state.log_posteriors = _replace(previous.log_posteriors, subscale, log_posterior)
+        state.estimates = _replace(previous.estimates, subscale, estimate)
+        state.errors = _replace(previous.errors, subscale, error)
+        state.above = _replace(previous.above, subscale, above)
+        state.counts = _replace(previous.counts, subscale, previous.counts[subscale] + 1)
+        state.next_item = self._select(state) if len(state.items) < self.max_items else None
+        return state
+
+    def _summarize(self, log_posterior: np.ndarray, cut):
+        """Moyenne, écart-type et masse au-delà de ``cut`` de la loi a posteriori."""
+        weights = np.exp(log_posterior - log_posterior.max())
+        weights /= weights.sum()
+        mean = float(weights @ self.grid)
+        error = float(np.sqrt(max(weights @ self.grid ** 2 - mean * mean, 0.0)))
+        above = float(weights[cut:].sum()) if cut is not None else 0.5
+        return mean, error, above
+
+    def _finished(self, state: _State, subscale: int) -> bool:
+        if state.counts[subscale] >= len(self.subscale_items[subscale]):
+            return True
+        if self.cuts[subscale] is not None:
+            return max(state.above[subscale], 1 - state.above[subscale]) >= self.confidence
+        return state.errors[subscale] <= self.standard_error
+
+    def _select(self, state: _State):
+        open_subscales = [
+            subscale for subscale in range(len(self.subscale_items)) if not self._finished(state, subscale)
+        ]
+        if not open_subscales:
+            return None
+        subscale = min(open_subscales, key=state.counts.__getitem__)
+        point = int(round((state.estimates[subscale] + GRID_LIMIT) / (2 * GRID_LIMIT) * (GRID_POINTS - 1)))
+        asked = set(state.items)
+        for item in self.orders[subscale][point]:
+            if item not in asked:
+                return item
+        return None
+
+    # -- Session --------------------------------------------------------------------
+
+    def next_item(self, answers):
+        """Indice de la question suivante dans la banque, ou ``None`` si le test est terminé."""
+        return self.state(answers).next_item
+
+    def expected_scores(self, answers) -> np.ndarray:
+        """Scores attendus sur la banque complète, au ``θ`` estimé de chaque sous-échelle."""
+        state = self.state(answers)
+        return np.array([
+            np.interp(estimate, self.grid, expected) for estimate, expected in zip(state.estimates, self.expected)
+        ])
+
+    def score(self, answers) -> dict:
+        """Colonnes de résultat d'une session adaptative (une ligne), comme le test complet."""
+        scores = self._rounded(self.expected_scores(answers))
+        return self.columns(scores.astype(self.maximums.dtype)[None, :])
+
+
+def _first(mask: np.ndarray) -> int:
+    """Indice du premier point vrai de la grille, ou ``GRID_POINTS`` s'il n'y en a pas."""
+    return int(mask.argmax()) if mask.any() else GRID_POINTS
+
+
+def _replace(values: tuple, index: int, value) -> tuple:
+    return values[:index] + (value,) + values[index + 1:]
@@ -1,60 +1,35 @@
-questions = [
-    (
-        "Peu d'intérêt ou de plaisir à faire les choses",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Sentiment de tristesse, dépression ou désespoir",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Problèmes de sommeil (difficulté à dormir, sommeil agité ou excessif)",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Sensation de fatigue ou manque d'énergie",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Perte d'appétit ou excès alimentaire",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Sentiment d'échec ou déception envers soi-même",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Difficulté à se concentrer (lecture, télévision, etc.)",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Mouvements ou parole si lents que les autres pourraient le remarquer, ou au contraire agitation",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    ),
-    (
-        "Pensées que vous seriez mieux mort ou de vous faire du mal d'une certaine manière",
-        ["Pas du tout", "Plusieurs jours", "Plus de la moitié des jours", "Presque tous les jours"]
-    )
-]
+import locales
+from psy import plans, scoring
+from psy.registry import Questionnaire, register
 
-def calculate_result(responses):
-    """Calcule le score PHQ-9 et fournit une interprétation."""
-    score = sum(responses)
-    
-    result = f"Votre score PHQ-9 est: {score}/27\n\n"
-    
-    if score < 5:
-        result += "Pas de dépression significative."
-    elif 5 <= score <= 9:
-        result += "Symptômes dépressifs légers."
-    elif 10 <= score <= 14:
-        result += "Symptômes dépressifs modérés."
-    elif 15 <= score <= 19:
-        result += "Symptômes dépressifs modérément sévères."
-    else:
-        result += "Symptômes dépressifs sévères."
-    
-    result += "\n\nCe test (PHQ-9) est un outil de dépistage et ne remplace pas un diagnostic professionnel. "
-    result += "Si vos résultats suggèrent une possible dépression, veuillez consulter un professionnel de santé."
-    
-    return result
\ No newline at end of file
+# Questions, sous-échelle et tranches : psy/definitions/depression.json
+definition = plans.load('depression')
+questions = definition.questions
+
+_bands = definition.subscale('total')['bands']
+CUT_POINTS = tuple(_bands['cut_points'])
+SEVERITY_LEVELS = tuple(_bands['levels'])
+
+def score(responses):
+    """Score PHQ-9 et tranche de sévérité (indice dans ``SEVERITY_LEVELS``) de chaque ligne."""
+    matrix = scoring.as_matrix(responses, len(questions), definition.plan.option_counts)
+    total = definition.plan.score(matrix)[:, 0]
+    return {'score': total, 'severity': scoring.band(total, CUT_POINTS)}
+
+def calculate_result(responses, messages=None):
+    """Calcule le score PHQ-9 et fournit une interprétation, dans la langue de ``messages``."""
+    messages = locales.catalog() if messages is None else messages
+    scored = score(responses)
+    severity = messages['depression.severity'][scored['severity'][0]]
+    return messages.format('depression.result', score=scored['score'][0], severity=severity)
+
+register(Questionnaire(
+    id=definition.id,
+    command=definition.command,
+    label=definition.label,
+    questions=questions,
+    calculate_result=calculate_result,
+    score=score,
+    result_levels={'severity': SEVERITY_LEVELS},
+    score_maximums={'score': definition.plan.maximums[0].item()}
+))
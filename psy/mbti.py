@@ -1,57 +1,48 @@
-questions = [
-    (
-        "En général, vous préférez:",
-        ["Être entouré de gens", "Rester seul ou avec peu de gens"]
-    ),
-    (
-        "Quand vous apprenez quelque chose de nouveau, vous préférez:",
-        ["Comprendre la théorie d'abord", "Essayer directement"]
-    ),
-    (
-        "Lorsque vous prenez une décision, vous comptez surtout sur:",
-        ["Vos sentiments et valeurs", "La logique et l'objectivité"]
-    ),
-    (
-        "Dans votre vie quotidienne, vous préférez:",
-        ["Planifier à l'avance", "Improviser au fur et à mesure"]
-    )
-    # Ajouter plus de questions pour chaque dimension MBTI
-]
-
-def calculate_result(responses):
-    """Détermine le type MBTI en fonction des réponses."""
-    # Les réponses déterminent les préférences sur 4 dimensions:
-    # E/I, S/N, T/F, J/P
-    
-    # Exemple simplifié - dans une vraie implémentation, on aurait plus de questions
-    # et une logique plus complexe pour déterminer le type
-    
-    mbti_type = []
-    
-    # Extraversion (E) vs Introversion (I)
-    mbti_type.append('E' if sum(responses[0::4]) < len(responses[0::4])/2 else 'I')
-    
-    # Sensation (S) vs Intuition (N)
-    mbti_type.append('S' if sum(responses[1::4]) < len(responses[1::4])/2 else 'N')
-    
-    # Pensée (T) vs Sentiment (F)
-    mbti_type.append('T' if sum(responses[2::4]) < len(responses[2::4])/2 else 'F')
-    
-    # Jugement (J) vs Perception (P)
-    mbti_type.append('J' if sum(responses[3::4]) < len(responses[3::4])/2 else 'P')
-    
-    type_str = ''.join(mbti_type)
-    
-    descriptions = {
-        "INTJ": "L'Architecte - Stratège créatif et original.",
-        "INTP": "Le Logicien - Innovateur théorique assoiffé de connaissances.",
-        "ENTJ": "Le Commandant - Leader charismatique et visionnaire.",
-        "ENTP": "L'Innovateur - Inventeur curieux et astucieux.",
-        # Ajouter les autres types...
-    }
-    
-    result = f"Votre type MBTI est: {type_str}\n\n"
-    result += descriptions.get(type_str, "Description non disponible pour ce type.")
-    result += "\n\nLe MBTI est un indicateur de personnalité qui catégorise les individus en 16 types."
-    
-    return result
\ No newline at end of file
+import itertools
+
+import numpy as np
+
+import locales
+from psy import cat, plans, scoring
+from psy.registry import Questionnaire, register
+
+# Questions et dimension de chacune : psy/definitions/mbti.json
+definition = plans.load('mbti')
+questions = definition.questions
+
+# Pôles de chaque dimension (E/I, S/N, T/F, J/P) ; le score compte le second
+DIMENSIONS = tuple(tuple(subscale['poles']) for subscale in definition.subscales)
+# Les 16 types, indexés par le code retourné par ``score``
+TYPES = tuple(''.join(letters) for letters in itertools.product(*DIMENSIONS))
+_POLE_WEIGHTS = 1 << np.arange(len(DIMENSIONS) - 1, -1, -1, dtype=np.int8)
+
+def _columns(scores):
+    poles = scoring.poles(scores, definition.plan.maximums)
+    return {'type': poles @ _POLE_WEIGHTS}
+
+def score(responses):
+    """Code du type MBTI (indice dans ``TYPES``) de chaque ligne."""
+    matrix = scoring.as_matrix(responses, len(questions), definition.plan.option_counts)
+    return _columns(definition.plan.score(matrix))
+
+# Mode adaptatif si la définition fournit une banque calibrée (voir psy.cat)
+adaptive = cat.AdaptivePlan(definition, _columns) if definition.adaptive is not None else None
+
+def calculate_result(responses, messages=None):
+    """Détermine le type MBTI en fonction des réponses, dans la langue de ``messages``."""
+    messages = locales.catalog() if messages is None else messages
+    scored = adaptive.score(responses) if adaptive is not None else score(responses)
+    type_str = TYPES[scored['type'][0]]
+    description = messages['mbti.descriptions'].get(type_str, messages['mbti.no_description'])
+    return messages.format('mbti.result', type=type_str, description=description)
+
+register(Questionnaire(
+    id=definition.id,
+    command=definition.command,
+    label=definition.label,
+    questions=questions,
+    calculate_result=calculate_result,
+    score=score,
+    result_levels={'type': TYPES},
+    adaptive=adaptive
+))
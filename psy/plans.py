@@ -0,0 +1,230 @@
+"""Définitions déclaratives des questionnaires et plans de calcul compilés.
+
+Chaque questionnaire est décrit par un fichier JSON de ``psy/definitions`` :
+ses métadonnées (identifiant, commande, libellé), ses sous-échelles et ses
+questions. Chaque question indique son jeu d'options, sa sous-échelle, si
+elle est inversée (``reverse``) et son poids (``weight``, 1 par défaut)::
+
+    {
+      "id": "big_five", "command": "bigfive", "label": "🌊 Big Five",
+      "option_sets": {"accord": ["Fortement en désaccord", "…"]},
+      "subscales": [{"id": "agreeableness", "label": "Agréabilité"}],
+      "items": [
+        {"text": "…critiquer les autres.", "options": "accord",
+         "subscale": "agreeableness", "reverse": true}
+      ]
+    }
+
+Au chargement, la définition est compilée en ``ScoringPlan`` : une matrice
+de poids ``(questions, sous-échelles)`` et un décalage par sous-échelle, de
+sorte que toutes les sous-échelles se calculent en un seul produit
+matriciel, quel que soit le nombre de questions. Une question inversée à
+``k`` options vaut ``k - 1 - réponse`` : son poids devient négatif et
+``poids × (k - 1)`` s'ajoute au décalage.
+
+Une définition peut aussi décrire une banque pour le mode adaptatif
+(``psy.cat``) : chaque question porte alors ses paramètres IRT calibrés,
+``"irt": {"a": 1.3, "b": [-1.1, 0.4]}`` (discrimination, puis un seuil
+par option après la première, croissants dans le sens de la sous-échelle :
+une question inversée lit ses options à l'envers), et la définition un
+bloc ``"adaptive"`` avec ses critères d'arrêt.
+
+Le résultat de la compilation est mis en cache sur disque (``marshal``),
+sous une clé dérivée du contenu du fichier : un démarrage ne relit le JSON
+que si la définition a changé.
+"""
+
+import hashlib
+import json
+import logging
+import marshal
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFINITIONS_DIR = Path(__file__).parent / 'definitions'
+# Changer ce numéro invalide les plans déjà en cache
+PLAN_FORMAT = 2
+
+
+class ScoringPlan:
+    """Poids et décalages précalculés d'un questionnaire."""
+
+    __slots__ = ('subscales', 'option_counts', 'weights', 'offsets', 'maximums')
+
+    def __init__(self, subscales: tuple, option_counts: np.ndarray, weights: np.ndarray,
+                 offsets: np.ndarray, maximums: np.ndarray):
+        self.subscales = subscales
+        self.option_counts = option_counts
+        self.weights = weights
+        self.offsets = offsets
+        self.maximums = maximums
+
+    def score(self, matrix: np.ndarray) -> np.ndarray:
+        """Scores ``(n, sous-échelles)`` d'une matrice de réponses ``(n, questions)``."""
+        return matrix @ self.weights + self.offsets
+
+
+@dataclass(frozen=True)
+class Definition:
+    """Questionnaire chargé : métadonnées, questions et plan de calcul."""
+
+    id: str
+    command: str
+    label: str
+    # [(texte, options)], dans l'ordre de présentation
+    questions: tuple
+    # Sous-échelles telles que décrites dans le JSON (id, label, bandes…)
+    subscales: tuple
+    plan: ScoringPlan
+    # Paramètres IRT de chaque question, ((a, (b1, …)), …), ou None
+    irt: tuple = None
+    # Critères du mode adaptatif (voir psy.cat), ou None
+    adaptive: dict = None
+
+    def subscale(self, subscale_id: str) -> dict:
+        for subscale in self.subscales:
+            if subscale['id'] == subscale_id:
+                return subscale
+        raise KeyError(subscale_id)
+
+
+def compile_definition(source: dict) -> dict:
+    """Compile une définition JSON en un plan sérialisable par ``marshal``.
+
+    Lève ``ValueError`` si la définition est incohérente.
+    """
+    name = source.get('id', '?')
+    option_sets = source.get('option_sets', {})
+    subscales = source.get('subscales') or []
+    items = source.get('items') or []
+    if not subscales or not items:
+        raise ValueError(f"{name} : sous-échelles et questions obligatoires")
+    columns = {subscale['id']: index for index, subscale in enumerate(subscales)}
+    if len(columns) != len(subscales):
+        raise ValueError(f"{name} : identifiants de sous-échelles en double")
+
+    questions = []
+    option_counts = []
+    entries = []
+    for position, item in enumerate(items, 1):
+        options = item.get('options')
+        if isinstance(options, str):
+            if options not in option_sets:
+                raise ValueError(f"{name}, question {position} : jeu d'options inconnu {options!r}")
+            options = option_sets[options]
+        if not options or len(options) < 2:
+            raise ValueError(f"{name}, question {position} : au moins deux options requises")
+        if item.get('subscale') not in columns:
+            raise ValueError(f"{name}, question {position} : sous-échelle inconnue {item.get('subscale')!r}")
+        questions.append((item['text'], tuple(options)))
+        option_counts.append(len(options))
+        entries.append((columns[item['subscale']], item.get('weight', 1), bool(item.get('reverse', False))))
+
+    irt = _compile_irt(name, items, option_counts)
+    if source.get('adaptive') is not None and irt is None:
+        raise ValueError(f"{name} : le mode adaptatif demande les paramètres IRT de chaque question")
+
+    integral = all(float(weight).is_integer() for _, weight, _ in entries)
+    dtype = np.int32 if integral else np.float64
+    weights = np.zeros((len(items), len(subscales)), dtype=dtype)
+    offsets = np.zeros(len(subscales), dtype=dtype)
+    maximums = np.zeros(len(subscales), dtype=dtype)
+    for row, ((column, weight, reverse), option_count) in enumerate(zip(entries, option_counts)):
+        top = option_count - 1
+        weights[row, column] = -weight if reverse else weight
+        if reverse:
+            offsets[column] += weight * top
+        maximums[column] += abs(weight) * top
+
+    return {
+        'format': PLAN_FORMAT,
+        'id': source['id'],
+        'command': source.get('command', source['id']),
+        'label': source['label'],
+        'questions': tuple(questions),
+        'subscales': tuple(subscales),
+        'dtype': np.dtype(dtype).str,
+        'option_counts': tuple(option_counts),
+        'weights': weights.tobytes(),
+        'offsets': offsets.tobytes(),
+        'maximums': maximums.tobytes(),
+        'irt': irt,
+        'adaptive': source.get('adaptive'),
+    }
+
+
+def _compile_irt(name: str, items: list, option_counts: list):
+    """Paramètres IRT de toutes les questions, ou None si aucune n'en porte."""
+    if not any('irt' in item for item in items):
+        return None
+    compiled = []
+    for position, (item, option_count) in enumerate(zip(items, option_counts), 1):
+        parameters = item.get('irt') or {}
+        discrimination = float(parameters.get('a', 0))
+        thresholds = tuple(float(threshold) for threshold in parameters.get('b', ()))
+        if discrimination <= 0 or len(thresholds) != option_count - 1 or list(thresholds) != sorted(thresholds):
+            raise ValueError(f"{name}, question {position} : paramètres IRT absents ou invalides")
+        compiled.append((discrimination, thresholds))
+    return tuple(compiled)
+
+
+def _materialize(compiled: dict) -> Definition:
+    dtype = np.dtype(compiled['dtype'])
+    subscale_count = len(compiled['subscales'])
+    plan = ScoringPlan(
+        subscales=tuple(subscale['id'] for subscale in compiled['subscales']),
+        option_counts=np.array(compiled['option_counts'], dtype=np.int16),
+        weights=np.frombuffer(compiled['weights'], dtype=dtype).reshape(-1, subscale_count),
+        offsets=np.frombuffer(compiled['offsets'], dtype=dtype),
+        maximums=np.frombuffer(compiled['maximums'], dtype=dtype),
+    )
+    return Definition(
+        id=compiled['id'],
+        command=compiled['command'],
+        label=compiled['label'],
+        questions=compiled['questions'],
+        subscales=compiled['subscales'],
+        plan=plan,
+        irt=compiled['irt'],
+        adaptive=compiled['adaptive'],
+    )
+
+
+def _cache_directory() -> Path:
+    configured = os.getenv('PLAN_CACHE_DIR')
+    return Path(configured) if configured else Path(__file__).parent / '__pycache__' / 'plans'
+
+
+def _store(cache_directory: Path, name: str, cache_path: Path, compiled: dict) -> None:
+    try:
+        cache_directory.mkdir(parents=True, exist_ok=True)
+        for stale in cache_directory.glob(f'{name}-*.plan'):
+            stale.unlink(missing_ok=True)
+        temporary = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        temporary.write_bytes(marshal.dumps(compiled))
+        os.replace(temporary, cache_path)
+    except OSError as exc:
+        # Cache facultatif : répertoire en lecture seule, disque plein…
+        logger.debug("Plan %s non mis en cache : %s", name, exc)
+
+
+def load(name: str, directory: Path = DEFINITIONS_DIR, cache_directory: Path = None) -> Definition:
+    """Charge ``<directory>/<name>.json``, depuis le cache si la définition n'a pas changé."""
+    raw = (Path(directory) / f'{name}.json').read_bytes()
+    digest = hashlib.sha256(b'%d:' % PLAN_FORMAT + raw).hexdigest()[:20]
+    cache_directory = Path(cache_directory) if cache_directory else _cache_directory()
+    cache_path = cache_directory / f'{name}-{digest}.plan'
+    try:
+        compiled = marshal.loads(cache_path.read_bytes())
+        if compiled.get('format') == PLAN_FORMAT:
+            return _materialize(compiled)
+    except (OSError, EOFError, ValueError, TypeError, AttributeError):
+        pass
+    compiled = compile_definition(json.loads(raw))
+    _store(cache_directory, name, cache_path, compiled)
+    return _materialize(compiled)
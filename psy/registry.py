@@ -0,0 +1,147 @@
+"""Registre des questionnaires disponibles.
+
+Chaque module de ``psy`` s'enregistre ici à l'import avec son identifiant,
+ses questions et sa fonction de calcul. Le bot ne connaît les tests qu'à
+travers ce registre : ajouter un test revient à ajouter un module.
+
+Les modules ne sont pas importés au démarrage : ``psy`` les déclare
+(``declare``), le registre lit alors seulement l'en-tête de leur
+définition (identifiant, commande, libellé, nombre de questions), de quoi
+construire le menu et les commandes sans charger numpy ni compiler de
+plan. Le module d'un test est importé à la première demande (``get``).
+"""
+
+import importlib
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Mapping, Optional
+
+DEFINITIONS_DIR = Path(__file__).parent / 'definitions'
+
+
+@dataclass(frozen=True)
+class Questionnaire:
+    """Description d'un test proposé par le bot."""
+
+    # Identifiant stable, stocké dans les sessions et les callback_data
+    id: str
+    # Commande Telegram qui démarre le test (sans le « / »)
+    command: str
+    # Libellé du bouton dans le menu principal
+    label: str
+    questions: list
+    # Réponses d'une ligne (et catalogue ``locales``, langue par défaut sinon)
+    # -> message de résultat pour le bot
+    calculate_result: Callable
+    # Calcul vectorisé : ligne ou matrice de réponses -> colonnes numériques
+    # (voir ``psy.scoring``) ; ``None`` si le test n'en propose pas
+    score: Optional[Callable] = None
+    # Libellés des colonnes codées de ``score`` : colonne -> libellé par code
+    result_levels: Mapping[str, tuple] = field(default_factory=dict)
+    # Maximum des colonnes numériques de ``score`` (le minimum est 0) ;
+    # entier si la colonne ne prend que des valeurs entières
+    score_maximums: Mapping[str, float] = field(default_factory=dict)
+    # Mode adaptatif (``psy.cat.AdaptivePlan``) ou ``None`` : les réponses
+    # d'une session sont alors dans l'ordre où les questions ont été posées,
+    # la question suivante vient de ``adaptive.next_item`` et
+    # ``calculate_result`` les interprète comme telles ; ``score`` reste le
+    # calcul du test complet (lots), ``adaptive.score`` celui d'une session
+    adaptive: Optional[object] = None
+
+    def scored(self, responses) -> dict:
+        """Colonnes calculées des réponses d'une session, en nombres Python (``{}`` sans ``score``)."""
+        score = self.adaptive.score if self.adaptive is not None else self.score
+        if score is None:
+            return {}
+        return {name: values[0].item() for name, values in score(responses).items()}
+
+
+@dataclass(frozen=True)
+class Listing:
+    """En-tête d'un test déclaré, lu sans importer son module."""
+
+    id: str
+    command: str
+    label: str
+    question_count: int
+    module: str
+    # Délai conseillé avant de refaire le test (rappels, voir bot/reminders.py)
+    follow_up_days: Optional[int] = None
+
+
+_questionnaires = {}
+_listings = {}
+# En-têtes de available() par identifiant, dans l'ordre du menu ; recalculés
+# après chaque déclaration ou enregistrement
+_index = None
+
+
+def declare(*names: str, package: str = 'psy') -> None:
+    """Déclare les modules ``<package>.<name>``, dans l'ordre du menu principal.
+
+    ``name`` est aussi le nom de la définition (``psy/definitions/<name>.json``).
+    """
+    global _index
+    for name in names:
+        source = json.loads((DEFINITIONS_DIR / f'{name}.json').read_bytes())
+        listing = Listing(
+            id=source['id'],
+            command=source.get('command', source['id']),
+            label=source['label'],
+            question_count=len(source['items']),
+            module=f'{package}.{name}',
+            follow_up_days=source.get('follow_up_days'),
+        )
+        if listing.id in _listings:
+            raise ValueError(f"Questionnaire déjà déclaré : {listing.id}")
+        _listings[listing.id] = listing
+        _index = None
+
+
+def register(questionnaire: Questionnaire) -> Questionnaire:
+    """Ajoute un questionnaire au registre."""
+    global _index
+    if questionnaire.id in _questionnaires:
+        raise ValueError(f"Questionnaire déjà enregistré : {questionnaire.id}")
+    _questionnaires[questionnaire.id] = questionnaire
+    if questionnaire.id not in _listings:
+        _index = None
+    return questionnaire
+
+
+def get(test_id: str):
+    """Retourne le questionnaire ``test_id``, importé au besoin, ou ``None`` s'il est inconnu."""
+    questionnaire = _questionnaires.get(test_id)
+    if questionnaire is None and test_id in _listings:
+        importlib.import_module(_listings[test_id].module)
+        questionnaire = _questionnaires.get(test_id)
+    return questionnaire
+
+
+def listing(test_id: str) -> Optional[Listing]:
+    """En-tête du test ``test_id``, ou ``None`` s'il est inconnu."""
+    return _listing_index().get(test_id)
+
+
+def available() -> list:
+    """En-têtes des tests proposés, dans l'ordre du menu, sans importer leurs modules."""
+    return list(_listing_index().values())
+
+
+def _listing_index() -> dict:
+    global _index
+    if _index is None:
+        index = dict(_listings)
+        index.update(
+            (questionnaire.id, Listing(questionnaire.id, questionnaire.command, questionnaire.label,
+                                       len(questionnaire.questions), questionnaire.calculate_result.__module__))
+            for questionnaire in _questionnaires.values() if questionnaire.id not in _listings
+        )
+        _index = index
+    return _index
+
+
+def all_questionnaires() -> list:
+    """Retourne tous les questionnaires, dans l'ordre du menu ; importe ceux qui ne l'étaient pas."""
+    return [get(listing.id) for listing in available()]
@@ -0,0 +1,56 @@
+"""Briques de calcul vectorisées, communes aux questionnaires.
+
+Les fonctions ``score`` des modules de ``psy`` reçoivent une ligne de
+réponses ou une matrice ``(n, nombre de questions)``, la passent dans le
+plan de calcul du questionnaire (``psy.plans``) et retournent des colonnes
+numériques (un tableau NumPy par champ, une valeur par ligne), sans
+mise en forme. Le bot formate ensuite une seule ligne ; le traitement par
+lots (``python -m psy.batch``) en traite des centaines de milliers d'un coup.
+
+Les réponses sont les indices des options choisies (0 pour la première),
+comme dans les sessions du bot.
+"""
+
+import numpy as np
+
+
+def as_matrix(responses, question_count: int, option_counts) -> np.ndarray:
+    """Convertit ``responses`` en matrice d'entiers ``(n, question_count)``.
+
+    ``option_counts`` est le nombre d'options, commun ou par question. Une
+    ligne seule (liste ou tableau 1-D) devient une matrice d'une ligne.
+    Lève ``ValueError`` si la forme ou une réponse est invalide.
+    """
+    matrix = np.asarray(responses)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if matrix.ndim != 2 or matrix.shape[1] != question_count:
+        raise ValueError(f"{question_count} réponses attendues par ligne, forme reçue : {matrix.shape}")
+    if matrix.dtype.kind not in 'iu':
+        raise ValueError(f"Réponses non entières : {matrix.dtype}")
+    if matrix.size and ((matrix < 0).any() or (matrix >= option_counts).any()):
+        raise ValueError("Réponse hors de l'intervalle des options")
+    return matrix
+
+
+def total(matrix: np.ndarray) -> np.ndarray:
+    """Somme des réponses de chaque ligne."""
+    return matrix.sum(axis=1, dtype=np.int32)
+
+
+def band(scores: np.ndarray, cut_points) -> np.ndarray:
+    """Indice de la tranche de chaque score.
+
+    ``cut_points`` donne le premier score de chaque tranche après la
+    première : avec ``(5, 10)``, 0-4 → 0, 5-9 → 1, 10 et plus → 2.
+    """
+    return np.searchsorted(np.asarray(cut_points), scores, side='right').astype(np.int8)
+
+
+def poles(scores: np.ndarray, maximums: np.ndarray) -> np.ndarray:
+    """Pôle retenu (0 ou 1) pour chaque sous-échelle dichotomique.
+
+    Le score compte les choix du second pôle ; celui-ci l'emporte quand il
+    atteint au moins la moitié du maximum de la sous-échelle.
+    """
+    return (2 * scores >= maximums).astype(np.int8)